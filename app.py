@@ -7,11 +7,19 @@ import subprocess
 import threading
 import webbrowser
 import shutil
+import signal
 import traceback
 import base64
-import io
 import math
 import zipfile
+import sqlite3
+import hashlib
+import struct
+import tempfile
+import atexit
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
 from pathlib import Path
 from urllib.request import urlopen, Request
 from urllib.error import URLError, HTTPError
@@ -70,6 +78,7 @@ def _fatal_error(msg):
 # ━━━ 安全导入依赖 ━━━
 try:
     from flask import Flask, request, jsonify, render_template, send_from_directory, Response
+    from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Field, File, Data, Epilogue
 except ImportError:
     _fatal_error("缺少 Flask 库。请检查打包是否完整。")
 
@@ -106,11 +115,17 @@ RENAME_UPLOAD_DIR = BASE_DIR / "uploads_rename"
 UPLOAD_DIR_EDITOR = BASE_DIR / "uploads_editor"
 TEMPLATE_DIR = BASE_DIR / "uploads" / "templates"
 OUTPUT_DIR = BASE_DIR / "output"
+CACHE_DIR = BASE_DIR / "cache"
+RENAME_JOURNAL_DIR = BASE_DIR / "rename_journal"
+SEGMENT_DIR = BASE_DIR / "segments"
 UPLOAD_DIR.mkdir(exist_ok=True)
 RENAME_UPLOAD_DIR.mkdir(exist_ok=True)
 UPLOAD_DIR_EDITOR.mkdir(exist_ok=True)
 TEMPLATE_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
+CACHE_DIR.mkdir(exist_ok=True)
+RENAME_JOURNAL_DIR.mkdir(exist_ok=True)
+SEGMENT_DIR.mkdir(exist_ok=True)
 
 app.config['MAX_CONTENT_LENGTH'] = 4 * 1024 * 1024 * 1024  # 4GB
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # 禁用静态文件缓存
@@ -213,8 +228,220 @@ VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
 MEDIA_EXTENSIONS = VIDEO_EXTENSIONS | IMAGE_EXTENSIONS
 
-# 全局进度追踪
-progress_store = {}
+# 全局进度追踪（多个工作线程并发更新，写入时持有 _progress_lock）
+_progress_lock = threading.Lock()
+TASK_DB_PATH = BASE_DIR / "tasks.db"
+
+
+class ProgressBus:
+    """进度事件总线：工作线程发布增量事件，SSE 连接在条件变量上等待，不再定时轮询
+
+    每个事件带全局递增的 id，保存在有界环形缓冲里，断线重连时按 Last-Event-ID 补发。
+    发布方在持有 _progress_lock 时调用 publish，保证 progress_store 快照与事件 id 一致。
+    """
+
+    def __init__(self, max_events=5000):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=max_events)
+        self._last_id = 0
+        self._listeners = []
+
+    def subscribe(self, callback):
+        """callback(event) 在每次 publish 后同步调用（仍在发布方的 _progress_lock 内）"""
+        self._listeners.append(callback)
+
+    @property
+    def last_id(self):
+        with self._cond:
+            return self._last_id
+
+    def publish(self, task_id, event_type, **data):
+        with self._cond:
+            self._last_id += 1
+            event = {'id': self._last_id, 'task_id': task_id, 'type': event_type, **data}
+            self._events.append(event)
+            self._cond.notify_all()
+        for callback in self._listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"  [Progress] Listener failed: {e}")
+        return event['id']
+
+    def can_resume(self, after_id):
+        """after_id 之后的事件是否都还在缓冲里（否则需要重新发快照）"""
+        with self._cond:
+            oldest = self._events[0]['id'] if self._events else self._last_id + 1
+            return 0 < after_id <= self._last_id and after_id >= oldest - 1
+
+    def wait(self, after_id, task_ids=None, timeout=15.0):
+        """阻塞到 after_id 之后有（匹配 task_ids 的）新事件或超时，返回 (事件列表, 新游标)"""
+        with self._cond:
+            while True:
+                events = []
+                for e in reversed(self._events):
+                    if e['id'] <= after_id:
+                        break
+                    if task_ids is None or e['task_id'] in task_ids:
+                        events.append(e)
+                if events:
+                    events.reverse()
+                    return events, self._last_id
+                after_id = max(after_id, self._last_id)
+                if not self._cond.wait(timeout):
+                    return [], after_id
+
+
+progress_bus = ProgressBus()
+
+
+# 任务的终止状态
+FINISHED_TASK_STATUSES = ('done', 'cancelled')
+
+# 写入任务日志的事件类型（job_progress 这类高频的瞬时事件不落盘）
+JOURNALED_EVENTS = {'job_started', 'result', 'error', 'job_finished', 'task_done'}
+
+
+class TaskStore:
+    """转码任务状态：内存字典 + SQLite（WAL 模式）追加式日志
+
+    内存里保存每个任务的进度状态（即 SSE 快照的内容），读写由 _progress_lock 保护。
+    任务规格（文件列表、套版、输出目录）和 ProgressBus 上的关键事件逐条追加到 task_log 表，
+    重启后按顺序重放即可恢复：已完成的任务仍可查询，中断的任务从未完成的作业继续。
+    已完成的任务按条数上限 taskStoreMaxTasks 和保留时长 taskStoreTTLHours 淘汰，内存和日志一并删除。
+    """
+
+    def __init__(self, db_path):
+        self._tasks = OrderedDict()
+        self._specs = {}
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS task_log ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' task_id TEXT NOT NULL, type TEXT NOT NULL, data TEXT NOT NULL, ts REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS idx_task_log_task ON task_log (task_id)')
+
+    # ── 与 dict 相同的读取接口（调用方持有 _progress_lock）──
+    def get(self, task_id, default=None):
+        return self._tasks.get(task_id, default)
+
+    def __getitem__(self, task_id):
+        return self._tasks[task_id]
+
+    def __contains__(self, task_id):
+        return task_id in self._tasks
+
+    def items(self):
+        return list(self._tasks.items())
+
+    def spec(self, task_id):
+        return self._specs.get(task_id)
+
+    def _append(self, task_id, event_type, data):
+        import time
+        with self._db_lock:
+            self._db.execute(
+                'INSERT INTO task_log (task_id, type, data, ts) VALUES (?, ?, ?, ?)',
+                (task_id, event_type, json.dumps(data, ensure_ascii=False), time.time())
+            )
+
+    def create(self, task_id, state, spec):
+        """登记新任务并写入日志（调用方持有 _progress_lock）
+
+        spec: {"files": files_info, "templates": {...}, "output_dir": "..."}，恢复任务时使用。
+        """
+        import time
+        state.setdefault('created', time.time())
+        self._tasks[task_id] = state
+        self._specs[task_id] = spec
+        self._append(task_id, 'task_created', {'state': state, 'spec': spec})
+        self.evict()
+
+    def on_event(self, event):
+        """ProgressBus 监听器：把关键事件追加到日志"""
+        if event['type'] not in JOURNALED_EVENTS or event['task_id'] not in self._tasks:
+            return
+        data = {k: v for k, v in event.items() if k not in ('id', 'task_id', 'type')}
+        self._append(event['task_id'], event['type'], data)
+        if event['type'] == 'task_done':
+            self.evict()
+
+    def evict(self):
+        """淘汰过期 / 超出条数上限的已完成任务（调用方持有 _progress_lock）"""
+        import time
+        cfg = get_processing_config()
+        max_tasks = max(1, int(cfg.get('taskStoreMaxTasks') or 1))
+        ttl = float(cfg.get('taskStoreTTLHours') or 0) * 3600
+        now = time.time()
+
+        finished = [t for t, st in self._tasks.items() if st['status'] in FINISHED_TASK_STATUSES]
+        doomed = [t for t in finished
+                  if ttl > 0 and now - self._tasks[t].get('finished_at', now) > ttl]
+        overflow = len(self._tasks) - len(doomed) - max_tasks
+        if overflow > 0:
+            doomed += [t for t in finished if t not in doomed][:overflow]
+        if not doomed:
+            return
+        for task_id in doomed:
+            self._tasks.pop(task_id, None)
+            self._specs.pop(task_id, None)
+        with self._db_lock:
+            self._db.executemany('DELETE FROM task_log WHERE task_id = ?', [(t,) for t in doomed])
+        print(f"  [Tasks] Evicted {len(doomed)} finished task(s)")
+
+    def restore(self):
+        """重放日志重建任务状态，返回中断任务列表 [(task_id, 已结束的作业 id 集合, 已开始的作业 {id: 输出文件名})]"""
+        with self._db_lock:
+            rows = self._db.execute('SELECT task_id, type, data, ts FROM task_log ORDER BY seq').fetchall()
+
+        started, finished_jobs, job_entries = {}, {}, {}
+        for task_id, event_type, raw, ts in rows:
+            data = json.loads(raw)
+            if event_type == 'task_created':
+                self._tasks[task_id] = data['state']
+                self._specs[task_id] = data['spec']
+                started[task_id], finished_jobs[task_id] = {}, set()
+                continue
+            state = self._tasks.get(task_id)
+            if state is None:
+                continue
+            if event_type == 'job_started':
+                started[task_id][data['job']] = data.get('files', [])
+            elif event_type == 'result':
+                state['results'].append(data['result'])
+                state['completed'] = data['completed']
+                job_entries.setdefault((task_id, data.get('job')), []).append(('results', data['result']))
+            elif event_type == 'error':
+                state['errors'].append(data['error'])
+                state['completed'] = data['completed']
+                job_entries.setdefault((task_id, data.get('job')), []).append(('errors', data['error']))
+            elif event_type == 'job_finished':
+                finished_jobs[task_id].add(data['job'])
+            elif event_type == 'task_done':
+                state.update(status=data.get('status', 'done'), completed=data['completed'],
+                             finished_at=ts)
+
+        interrupted = []
+        for task_id, state in self._tasks.items():
+            state.update(running=[], jobs={}, current_file='')
+            if state['status'] not in FINISHED_TASK_STATUSES:
+                unfinished = {j: f for j, f in started[task_id].items() if j not in finished_jobs[task_id]}
+                # 中断作业里已记下的部分结果作废，恢复时整个作业重做
+                for job in unfinished:
+                    for kind, entry in job_entries.get((task_id, job), []):
+                        state[kind].remove(entry)
+                        state['completed'] -= 1
+                interrupted.append((task_id, finished_jobs[task_id], unfinished))
+        self.evict()
+        return interrupted
+
+
+progress_store = TaskStore(TASK_DB_PATH)
+progress_bus.subscribe(progress_store.on_event)
 
 # 抑制 Windows 子进程控制台窗口
 _subprocess_kwargs = {}
@@ -242,11 +469,869 @@ def save_config_file(config):
     CONFIG_FILE.write_text(json.dumps(config, ensure_ascii=False, indent=2), encoding='utf-8')
 
 
+# 视频处理参数（保存在 config.json 的 processing 字段）
+DEFAULT_PROCESSING_CONFIG = {
+    'cpuBudget': 0,       # 可用于转码的 CPU 线程总数，0 = 自动（全部核心）
+    'parallelJobs': 0,    # 同时运行的 FFmpeg 作业数，0 = 按 cpuBudget 自动计算
+    'blurDownscale': 8,   # 模糊背景先缩小到 1/N 再模糊，1 = 关闭（全分辨率 gblur）
+    'preScale': 0,        # 1 = 源视频大于输出画布所需尺寸时，分流前先统一缩小一次（画面与原链路有细微差异）
+    'maxFps': 0,          # 帧率上限，高帧率源在分流前先降帧，0 = 不限制
+    'templateCacheEntries': 200,  # 套版检测结果 / 缩略图缓存条数上限
+    'probeCacheEntries': 5000,    # 视频探测结果缓存条数上限
+    'taskStoreMaxTasks': 200,     # 保留的已完成任务条数上限（内存 + tasks.db）
+    'taskStoreTTLHours': 72,      # 已完成任务的保留时长（小时），0 = 不按时间淘汰
+    'outputCacheMaxGB': 20,       # 输出缓存磁盘配额（GB），0 = 不缓存输出
+    'segmentMinMinutes': 10,      # 源视频不短于该时长（分钟）时分段并行编码，0 = 关闭
+    'segmentSeconds': 120,        # 分段目标时长（秒），实际在其后的第一个关键帧处切开
+    'maxQueuedJobs': 1000,        # 全局排队作业上限，超出时拒绝新任务
+    'maxQueuedJobsPerClient': 300,  # 单个客户端（IP）排队作业上限
+    'encoderProfile': 'standard',   # 任务未指定编码档位时使用的档位
+}
+
+
+# 允许小数的处理参数，其余数值参数均为非负整数
+_FLOAT_PROCESSING_KEYS = {'outputCacheMaxGB', 'taskStoreTTLHours', 'segmentMinMinutes'}
+
+
+def coerce_processing_value(key, value):
+    """校验并转换单个处理参数：数值参数须为非负数（整数参数不接受小数），不合法时抛出 ValueError"""
+    default = DEFAULT_PROCESSING_CONFIG[key]
+    if isinstance(default, str):
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f'{key} 必须是非空字符串')
+        return value.strip()
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f'{key} 必须是数字')
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f'{key} 必须是数字') from None
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f'{key} 不能为负数')
+    if key in _FLOAT_PROCESSING_KEYS:
+        return number
+    if number != int(number):
+        raise ValueError(f'{key} 必须是整数')
+    return int(number)
+
+
+def get_processing_config():
+    """读取视频处理参数，合并默认值；config.json 中不合法的值（手工编辑等）按默认值处理"""
+    cfg = dict(DEFAULT_PROCESSING_CONFIG)
+    saved = load_config().get('processing')
+    if isinstance(saved, dict):
+        for key, value in saved.items():
+            if key not in DEFAULT_PROCESSING_CONFIG:
+                continue
+            try:
+                cfg[key] = coerce_processing_value(key, value)
+            except ValueError:
+                pass
+    return cfg
+
+
+# 编码档位（可在 config.json 的 encoderProfiles 字段中覆盖或新增）
+DEFAULT_ENCODER_PROFILES = {
+    'draft':         {'label': '草稿（最快）',        'vcodec': 'libx264', 'preset': 'veryfast', 'crf': 23},
+    'standard':      {'label': '标准',               'vcodec': 'libx264', 'preset': 'medium',   'crf': 18},
+    'archive':       {'label': '归档（更小体积）',     'vcodec': 'libx264', 'preset': 'slow',     'crf': 20},
+    'x265-standard': {'label': 'H.265 标准',         'vcodec': 'libx265', 'preset': 'medium',   'crf': 22},
+    'x265-archive':  {'label': 'H.265 归档（最小体积）', 'vcodec': 'libx265', 'preset': 'slow',     'crf': 24},
+}
+
+_available_encoders = None
+_available_encoders_lock = threading.Lock()
+
+
+def available_encoders():
+    """当前 FFmpeg 编译进的视频编码器名称集合（首次调用时执行 ffmpeg -encoders）"""
+    global _available_encoders
+    with _available_encoders_lock:
+        if _available_encoders is None:
+            try:
+                result = subprocess.run([FFMPEG_PATH, '-hide_banner', '-encoders'],
+                                        capture_output=True, text=True, encoding='utf-8',
+                                        errors='replace', timeout=30, **_subprocess_kwargs)
+                _available_encoders = set(re.findall(r'^\s*V\S*\s+(\S+)', result.stdout, re.M))
+            except (OSError, subprocess.SubprocessError):
+                _available_encoders = set()
+        return _available_encoders
+
+
+def get_encoder_profiles():
+    """全部编码档位 {名称: {label, vcodec, preset, crf, available}}，config.json 中的同名档位覆盖默认值"""
+    profiles = {name: dict(p) for name, p in DEFAULT_ENCODER_PROFILES.items()}
+    saved = load_config().get('encoderProfiles')
+    if isinstance(saved, dict):
+        for name, p in saved.items():
+            if isinstance(p, dict):
+                profiles[name] = {**profiles.get(name, {}), **p}
+    encoders = available_encoders()
+    for name, p in list(profiles.items()):
+        if not all(k in p for k in ('vcodec', 'preset', 'crf')):
+            del profiles[name]
+            continue
+        p.setdefault('label', name)
+        p['available'] = p['vcodec'] in encoders
+    return profiles
+
+
+def resolve_encoder_profile(name=None):
+    """按名称取编码档位（附带 name 字段）；未指定、不存在或当前 FFmpeg 不支持时退回默认档位 / standard"""
+    profiles = get_encoder_profiles()
+    default = get_processing_config().get('encoderProfile') or 'standard'
+    for candidate in (name, default, 'standard'):
+        p = profiles.get(candidate) if candidate else None
+        if p and p['available']:
+            if name and candidate != name:
+                print(f"  [Encoder] Profile {name!r} unavailable, using {candidate!r}")
+            return dict(p, name=candidate)
+    return dict(DEFAULT_ENCODER_PROFILES['standard'], name='standard', available=True)
+
+
+# 投放平台的交付限制（可在 config.json 的 deliveryTargets 字段中覆盖）：
+#   maxrateKbps / bufsizeKbps — 视频 VBV 码率上限与缓冲（在编码档位的 CRF 之上封顶）
+#   maxSizeMB — 单个输出文件大小上限；maxFps — 帧率上限；audioKbps — AAC 音频码率
+DEFAULT_DELIVERY_TARGETS = {
+    'FB': {'label': 'Facebook', 'maxrateKbps': 8000, 'bufsizeKbps': 16000,
+           'maxSizeMB': 250, 'maxFps': 30, 'audioKbps': 128},
+    'GG': {'label': 'Google / YouTube', 'maxrateKbps': 10000, 'bufsizeKbps': 20000,
+           'maxSizeMB': 1024, 'maxFps': 60, 'audioKbps': 192},
+    'TT': {'label': 'TikTok', 'maxrateKbps': 6000, 'bufsizeKbps': 12000,
+           'maxSizeMB': 287, 'maxFps': 30, 'audioKbps': 128},
+}
+DELIVERY_MIN_VIDEO_KBPS = 300  # 按大小上限反推的码率不低于此值，避免极长视频画质崩坏
+DELIVERY_SIZE_MARGIN = 0.97    # 预留约 3% 给封装开销
+
+
+def get_delivery_targets():
+    """各平台的交付限制 {平台代码: {...}}，config.json 中的同名平台覆盖默认值"""
+    targets = {name: dict(t) for name, t in DEFAULT_DELIVERY_TARGETS.items()}
+    saved = load_config().get('deliveryTargets')
+    if isinstance(saved, dict):
+        for name, t in saved.items():
+            if isinstance(t, dict):
+                targets[name.upper()] = {**targets.get(name.upper(), {'label': name}), **t}
+    return targets
+
+
+def apply_delivery_target(profile, platform, duration=0):
+    """把平台交付限制合并进编码档位，返回新的档位 dict（platform 为空或未知时原样返回）
+
+    码率上限取平台 maxrate 与按 maxSizeMB 反推的码率中较小者：VBV 保证任意 bufsize 窗口内
+    不超过 maxrate，所以总大小 ≤ maxrate × 时长 + bufsize + 音频，据此反推即可保证不超过上限，
+    不需要两遍编码。
+    """
+    target = get_delivery_targets().get((platform or '').upper())
+    if not target:
+        return profile
+    maxrate = int(target.get('maxrateKbps') or 0)
+    bufsize = int(target.get('bufsizeKbps') or 0) or maxrate * 2
+    audio = int(target.get('audioKbps') or 0)
+    max_size = float(target.get('maxSizeMB') or 0)
+    if max_size and duration:
+        budget_kbits = max_size * 1024 * 1024 * 8 / 1000 * DELIVERY_SIZE_MARGIN
+        size_rate = (budget_kbits - bufsize) / duration - (audio or 320)
+        if size_rate < DELIVERY_MIN_VIDEO_KBPS:
+            print(f"  [Delivery] {platform}: {duration:.0f}s does not fit {max_size:g}MB, "
+                  f"capping at {DELIVERY_MIN_VIDEO_KBPS} kbps")
+            size_rate = DELIVERY_MIN_VIDEO_KBPS
+        maxrate = min(maxrate, int(size_rate)) if maxrate else int(size_rate)
+    return dict(profile, platform=platform.upper(), maxrateKbps=maxrate,
+                bufsizeKbps=min(bufsize, maxrate * 2) if maxrate else bufsize,
+                maxFps=target.get('maxFps'), audioKbps=audio,
+                maxSizeBytes=int(max_size * 1024 * 1024) if max_size else None)
+
+
+def resolve_platform(platform, filename=''):
+    """任务的平台选项 -> 平台代码：'auto' 时从文件名中识别（命名规范里的平台段）"""
+    if (platform or '').lower() == 'auto':
+        return parse_filename_local(filename)['platform'] or None
+    return platform or None
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 持久化缓存
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+class PersistentCache:
+    """按 LRU 淘汰的持久化键值缓存，保存在 JSON 文件中，并统计命中 / 未命中次数
+
+    on_evict(key, value): 条目被淘汰时回调，用于清理条目关联的磁盘文件。
+    max_bytes: 大于 0 时另按条目的 value['size'] 之和限制总大小（磁盘配额）。
+
+    写入只标记脏数据，SAVE_DELAY_SECONDS 后由定时器合并写盘一次（整份 JSON 可达 MB 级，
+    逐次重写会让所有查找排队等锁）；进程退出时 atexit 再 flush 一次。
+    """
+
+    SAVE_DELAY_SECONDS = 2.0
+
+    def __init__(self, path, max_entries, on_evict=None, max_bytes=0):
+        self._path = Path(path)
+        self._max_entries = max(1, int(max_entries))
+        self._max_bytes = max(0, int(max_bytes))
+        self._on_evict = on_evict
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._flush_timer = None
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if self._path.exists():
+            try:
+                self._data = OrderedDict(json.loads(self._path.read_text(encoding='utf-8')))
+            except Exception as e:
+                print(f"  [Cache] Failed to load {self._path.name}: {e}")
+        atexit.register(self.flush)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def _total_bytes(self):
+        return sum(v.get('size', 0) for v in self._data.values() if isinstance(v, dict))
+
+    def _evict_over_limit(self):
+        """按上限淘汰最久未用的条目（调用方持有锁），返回被淘汰的 [(key, value)]"""
+        evicted = []
+        while len(self._data) > self._max_entries:
+            evicted.append(self._data.popitem(last=False))
+        if self._max_bytes:
+            total = self._total_bytes()
+            while total > self._max_bytes and self._data:
+                old = self._data.popitem(last=False)
+                total -= old[1].get('size', 0)
+                evicted.append(old)
+        return evicted
+
+    def _notify_evicted(self, evicted):
+        if self._on_evict:
+            for old_key, old_value in evicted:
+                try:
+                    self._on_evict(old_key, old_value)
+                except Exception:
+                    pass
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            evicted = self._evict_over_limit()
+            self._mark_dirty()
+        self._notify_evicted(evicted)
+
+    def resize(self, max_entries, max_bytes=None):
+        """配置变更后调整条数上限（及 max_bytes 磁盘配额），超出的条目立即淘汰"""
+        with self._lock:
+            self._max_entries = max(1, int(max_entries))
+            if max_bytes is not None:
+                self._max_bytes = max(0, int(max_bytes))
+            evicted = self._evict_over_limit()
+            if evicted:
+                self._mark_dirty()
+        self._notify_evicted(evicted)
+        return len(evicted)
+
+    def clear(self):
+        """淘汰全部条目（触发 on_evict），返回淘汰的条数"""
+        with self._lock:
+            evicted = list(self._data.items())
+            self._data.clear()
+            self._mark_dirty()
+        self._notify_evicted(evicted)
+        return len(evicted)
+
+    def pop(self, key):
+        """删除条目（不触发 on_evict），返回原值"""
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self._mark_dirty()
+            return value
+
+    def _mark_dirty(self):
+        """标记有未写盘的修改并安排一次延迟写盘（调用方持有锁）"""
+        self._dirty = True
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.SAVE_DELAY_SECONDS, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """把未写盘的修改写入 JSON 文件；序列化在锁内，写文件在锁外，不阻塞查找"""
+        with self._save_lock:
+            with self._lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                payload = json.dumps(self._data, ensure_ascii=False)
+            # 先写临时文件再替换，避免写到一半崩溃留下损坏的索引
+            tmp_path = self._path.with_suffix('.tmp')
+            tmp_path.write_text(payload, encoding='utf-8')
+            os.replace(tmp_path, self._path)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'entries': len(self._data),
+                'max_entries': self._max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+            if self._max_bytes:
+                stats.update(bytes=self._total_bytes(), max_bytes=self._max_bytes)
+            return stats
+
+
+def file_sha256(filepath, chunk_size=1024 * 1024):
+    """计算文件内容的 SHA-256（分块读取）"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# 套版缓存：内容哈希 -> 透明区域；缩略图 PNG 单独存放在 template_thumbs/ 下
+TEMPLATE_THUMB_DIR = CACHE_DIR / "template_thumbs"
+TEMPLATE_THUMB_DIR.mkdir(exist_ok=True)
+
+
+# 预渲染的套版帧（按输出画布缩放、裁到不透明区域）：{content_hash}_{宽}x{高}_v{版本}_{x}_{y}.png
+# x / y 为裁剪后图片在画布上的位置，写在文件名里，重启后可直接复用磁盘上的渲染结果
+TEMPLATE_RENDER_DIR = CACHE_DIR / "template_renders"
+TEMPLATE_RENDER_VERSION = 2  # 预渲染格式变化时递增（v1 为预乘 alpha），不复用旧文件
+TEMPLATE_RENDER_DIR.mkdir(exist_ok=True)
+
+
+def _evict_template_thumb(content_hash, _entry):
+    (TEMPLATE_THUMB_DIR / f"{content_hash}.png").unlink(missing_ok=True)
+    for render in TEMPLATE_RENDER_DIR.glob(f"{content_hash}_*.png"):
+        render.unlink(missing_ok=True)
+    with _template_render_lock:
+        for key in [k for k in _template_renders if k[0] == content_hash]:
+            del _template_renders[key]
+
+
+template_cache = PersistentCache(
+    CACHE_DIR / "templates.json",
+    max_entries=get_processing_config()['templateCacheEntries'],
+    on_evict=_evict_template_thumb,
+)
+
+# 视频探测缓存：路径+大小+修改时间（或内容哈希）-> {width, height, duration, fps, ...}
+probe_cache = PersistentCache(
+    CACHE_DIR / "probe.json",
+    max_entries=get_processing_config()['probeCacheEntries'],
+)
+
+# 输出缓存：源视频哈希 + 目标比例 + 套版哈希/区域 + 编码参数 -> 已编码的输出文件
+OUTPUT_CACHE_DIR = CACHE_DIR / "outputs"
+OUTPUT_CACHE_DIR.mkdir(exist_ok=True)
+
+
+def _evict_cached_output(key, entry):
+    (OUTPUT_CACHE_DIR / entry['file']).unlink(missing_ok=True)
+
+
+OUTPUT_CACHE_MAX_ENTRIES = 100000  # 输出缓存主要按磁盘配额淘汰，条数上限只作兜底
+output_cache = PersistentCache(
+    CACHE_DIR / "outputs.json",
+    max_entries=OUTPUT_CACHE_MAX_ENTRIES,
+    on_evict=_evict_cached_output,
+    max_bytes=int(float(get_processing_config()['outputCacheMaxGB']) * 1024 ** 3),
+)
+
+
+def reconfigure_caches():
+    """配置变更后按新的上限调整各缓存（与 reconfigure_scheduler 一样在保存配置时调用）"""
+    cfg = get_processing_config()
+    for name, cache, limit in (('Template', template_cache, cfg['templateCacheEntries']),
+                               ('Probe', probe_cache, cfg['probeCacheEntries'])):
+        evicted = cache.resize(limit)
+        if evicted:
+            print(f"  [Cache] {name} cache resized, {evicted} entries evicted")
+    # 输出缓存按磁盘配额淘汰；配额改为 0（关闭）时删除全部已缓存的输出
+    max_bytes = int(float(cfg['outputCacheMaxGB'] or 0) * 1024 ** 3)
+    evicted = output_cache.resize(OUTPUT_CACHE_MAX_ENTRIES, max_bytes) if max_bytes > 0 else output_cache.clear()
+    if evicted:
+        print(f"  [Cache] Output cache resized, {evicted} entries evicted")
+
+
+OUTPUT_CACHE_VERSION = 5  # 输出格式或滤镜图变化时递增，使旧条目全部失效
+
+
+def output_cache_enabled():
+    return float(get_processing_config().get('outputCacheMaxGB') or 0) > 0
+
+
+def _encoder_signature(profile=None):
+    """影响输出内容的编码参数，任一变化都会换一个缓存键"""
+    profile = profile or resolve_encoder_profile()
+    return {
+        'version': OUTPUT_CACHE_VERSION,
+        'vcodec': profile['vcodec'], 'crf': profile['crf'], 'preset': profile['preset'],
+        'maxrate': profile.get('maxrateKbps'), 'bufsize': profile.get('bufsizeKbps'),
+        'maxFps': profile.get('maxFps'), 'audio': profile.get('audioKbps') or 'copy',
+        'blurSigma': BLUR_SIGMA,
+        'blurDownscale': int(get_processing_config().get('blurDownscale') or 1),
+        'preScale': int(get_processing_config().get('preScale') or 0),
+        'fpsCap': int(get_processing_config().get('maxFps') or 0),
+    }
+
+
+def _template_hash(template):
+    """套版的内容哈希：优先用上传时算好的 content_hash，否则现算"""
+    return template.get('content_hash') or file_sha256(template['path'])
+
+
+def output_cache_key(source_hash, target_ratio, template=None, profile=None):
+    """源视频哈希 + 目标比例 + 套版（内容哈希与区域）+ 编码参数 -> 缓存键"""
+    parts = {
+        'source': source_hash,
+        'ratio': target_ratio,
+        'template': ({'hash': _template_hash(template), 'region': template['region']}
+                     if template else None),
+        'encoder': _encoder_signature(profile),
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def fetch_cached_output(key, output_path):
+    """命中时把缓存文件硬链接 / 复制到 output_path，返回是否命中"""
+    entry = output_cache.get(key)
+    if entry is None:
+        return False
+    cached_path = OUTPUT_CACHE_DIR / entry['file']
+    try:
+        if cached_path.stat().st_size != entry['size']:
+            raise OSError('cached output size mismatch')
+        _link_or_copy(cached_path, Path(output_path))
+        return True
+    except OSError as e:
+        print(f"  [Cache] Dropping broken output entry {key[:12]}: {e}")
+        output_cache.pop(key)
+        cached_path.unlink(missing_ok=True)
+        return False
+
+
+def store_cached_output(key, output_path):
+    """把刚编码好的输出登记进缓存（与输出文件共享数据块，不额外占空间时最好）"""
+    output_path = Path(output_path)
+    name = f"{key}{output_path.suffix}"
+    try:
+        _link_or_copy(output_path, OUTPUT_CACHE_DIR / name)
+        output_cache.put(key, {'file': name, 'size': output_path.stat().st_size})
+    except OSError as e:
+        print(f"  [Cache] Failed to store output {output_path.name}: {e}")
+
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 视频/图片信息获取
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-def get_video_info(filepath):
-    """使用 ffprobe 或 ffmpeg 回退获取视频宽高和时长"""
+# ━━━ 容器头解析（进程内，无需启动 ffprobe）━━━
+MP4_EXTENSIONS = {'.mp4', '.mov', '.m4v'}
+EBML_EXTENSIONS = {'.mkv', '.webm'}
+_MP4_CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+_MP4_CODEC_NAMES = {
+    'avc1': 'h264', 'avc3': 'h264', 'hvc1': 'hevc', 'hev1': 'hevc',
+    'av01': 'av1', 'vp09': 'vp9', 'mp4v': 'mpeg4', 'apcn': 'prores', 'apch': 'prores',
+}
+_HEADER_READ_LIMIT = 64 * 1024 * 1024  # moov / EBML 头部最多读取 64MB
+
+
+def _apply_rotation(info, rotation):
+    """按旋转角度交换宽高（手机竖拍视频常以横向编码 + 90° 旋转矩阵存储）"""
+    rotation = int(round(rotation)) % 360
+    if rotation in (90, 270):
+        info['width'], info['height'] = info['height'], info['width']
+    info['rotation'] = rotation
+    return info
+
+
+_AVC_CHROMA_FORMATS = {0: 'gray', 1: 'yuv420p', 2: 'yuv422p', 3: 'yuv444p'}
+
+
+def _avc_pix_fmt(avcc):
+    """从 AVCDecoderConfigurationRecord（MP4 avcC / MKV CodecPrivate）推断像素格式
+
+    Baseline / Main / Extended 固定为 8bit 4:2:0；High 系列读取 PPS 之后的扩展字段，
+    High (100) 没有扩展字段时按规范同样是 8bit 4:2:0。无法判断时返回空字符串。
+    """
+    if len(avcc) < 7:
+        return ''
+    profile = avcc[1]
+    if profile in (66, 77, 88):
+        return 'yuv420p'
+    pos = 6
+    for _ in range(avcc[5] & 0x1F):
+        pos += 2 + int.from_bytes(avcc[pos:pos + 2], 'big')
+    if pos < len(avcc):
+        num_pps = avcc[pos]
+        pos += 1
+        for _ in range(num_pps):
+            pos += 2 + int.from_bytes(avcc[pos:pos + 2], 'big')
+    if pos + 3 <= len(avcc):
+        chroma = _AVC_CHROMA_FORMATS[avcc[pos] & 0x03]
+        depth = (avcc[pos + 1] & 0x07) + 8
+        return chroma if depth == 8 else f"{chroma}{depth}le"
+    return 'yuv420p' if profile == 100 else ''
+
+
+def _iter_mp4_boxes(data, start=0, end=None):
+    """遍历一段字节中的 MP4 box，产出 (类型, 内容起点, 内容终点)"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size = int.from_bytes(data[pos:pos + 4], 'big')
+        box_type = data[pos + 4:pos + 8]
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = int.from_bytes(data[pos + 8:pos + 16], 'big')
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def _mp4_header_duration(data, body):
+    """解析 mvhd / mdhd（两者布局相同）中的时长，单位秒"""
+    if data[body] == 1:
+        timescale = int.from_bytes(data[body + 20:body + 24], 'big')
+        duration = int.from_bytes(data[body + 24:body + 32], 'big')
+    else:
+        timescale = int.from_bytes(data[body + 12:body + 16], 'big')
+        duration = int.from_bytes(data[body + 16:body + 20], 'big')
+    return duration / timescale if timescale else 0.0
+
+
+def _read_mp4_moov(f):
+    """在顶层 box 中定位 moov 并读出其内容（moov 可能位于文件末尾）"""
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    pos = 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            return None
+        size = int.from_bytes(header[:4], 'big')
+        box_type = header[4:8]
+        header_len = 8
+        if size == 1:
+            size = int.from_bytes(header[8:16], 'big')
+            header_len = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_len:
+            return None
+        if box_type == b'moov':
+            if size > _HEADER_READ_LIMIT:
+                return None
+            f.seek(pos + header_len)
+            return f.read(size - header_len)
+        pos += size
+    return None
+
+
+def _parse_mp4_info(filepath):
+    """解析 MP4/MOV 的 moov → mvhd / tkhd / mdhd / stsd / stts，返回视频轨的宽高、时长、帧率、旋转"""
+    with open(filepath, 'rb') as f:
+        moov = _read_mp4_moov(f)
+    if not moov:
+        return None
+
+    movie_duration = 0.0
+    video = None
+
+    def walk(start, end, track):
+        for box_type, body, box_end in _iter_mp4_boxes(moov, start, end):
+            if box_type == b'tkhd':
+                version = moov[body]
+                matrix_at = body + (52 if version == 1 else 40)
+                a = int.from_bytes(moov[matrix_at:matrix_at + 4], 'big', signed=True)
+                b = int.from_bytes(moov[matrix_at + 4:matrix_at + 8], 'big', signed=True)
+                # 与 FFmpeg displaymatrix 的角度方向保持一致（逆时针为正）
+                track['rotation'] = -math.degrees(math.atan2(b, a)) if (a or b) else 0
+                dims_at = matrix_at + 36
+                track['tkhd_width'] = int.from_bytes(moov[dims_at:dims_at + 4], 'big') >> 16
+                track['tkhd_height'] = int.from_bytes(moov[dims_at + 4:dims_at + 8], 'big') >> 16
+            elif box_type == b'mdhd':
+                track['duration'] = _mp4_header_duration(moov, body)
+            elif box_type == b'stts':
+                # 每项 (sample_count, sample_delta)，样本总数 / 轨道时长 = 平均帧率
+                count = int.from_bytes(moov[body + 4:body + 8], 'big')
+                track['frames'] = sum(
+                    int.from_bytes(moov[at:at + 4], 'big')
+                    for at in range(body + 8, min(body + 8 + count * 8, box_end), 8))
+            elif box_type == b'hdlr':
+                # MOV 的 minf 下还有数据引用 hdlr（'alis' 等），只取 mdia 的第一个
+                track.setdefault('handler', moov[body + 8:body + 12])
+            elif box_type == b'stsd':
+                # 第一个 sample entry：size(4) type(4) reserved(6) dref(2) + 视觉头 16 字节后是宽高
+                entry = body + 8
+                track['codec'] = moov[entry + 4:entry + 8].decode('latin-1')
+                track['width'] = int.from_bytes(moov[entry + 32:entry + 34], 'big')
+                track['height'] = int.from_bytes(moov[entry + 34:entry + 36], 'big')
+                # 视觉 sample entry 固定 86 字节，之后是 avcC 等子 box
+                entry_end = min(entry + int.from_bytes(moov[entry:entry + 4], 'big'), box_end)
+                for child_type, c_body, c_end in _iter_mp4_boxes(moov, entry + 86, entry_end):
+                    if child_type == b'avcC':
+                        track['pix_fmt'] = _avc_pix_fmt(moov[c_body:c_end])
+            elif box_type in _MP4_CONTAINER_BOXES:
+                walk(body, box_end, track)
+
+    for box_type, body, box_end in _iter_mp4_boxes(moov):
+        if box_type == b'mvhd':
+            movie_duration = _mp4_header_duration(moov, body)
+        elif box_type == b'trak':
+            track = {}
+            walk(body, box_end, track)
+            if track.get('handler') == b'vide' and video is None:
+                video = track
+
+    if not video:
+        return None
+    w = video.get('width') or video.get('tkhd_width')
+    h = video.get('height') or video.get('tkhd_height')
+    duration = video.get('duration') or movie_duration
+    # 分片 MP4（moov 中无时长）等情况交给 ffprobe
+    if not w or not h or not duration:
+        return None
+
+    info = {'width': w, 'height': h, 'duration': duration}
+    if video.get('frames') and video.get('duration'):
+        info['fps'] = round(video['frames'] / video['duration'], 3)
+    codec = video.get('codec', '')
+    info['codec'] = _MP4_CODEC_NAMES.get(codec, codec)
+    info['pix_fmt'] = video.get('pix_fmt', '')
+    return _apply_rotation(info, video.get('rotation', 0))
+
+
+# EBML / Matroska 元素 ID
+_EBML_HEADER = 0x1A45DFA3
+_MKV_SEGMENT = 0x18538067
+_MKV_INFO = 0x1549A966
+_MKV_TIMECODE_SCALE = 0x2AD7B1
+_MKV_DURATION = 0x4489
+_MKV_TRACKS = 0x1654AE6B
+_MKV_TRACK_ENTRY = 0xAE
+_MKV_TRACK_TYPE = 0x83
+_MKV_CODEC_ID = 0x86
+_MKV_CODEC_PRIVATE = 0x63A2
+_MKV_DEFAULT_DURATION = 0x23E383
+_MKV_VIDEO = 0xE0
+_MKV_PIXEL_WIDTH = 0xB0
+_MKV_PIXEL_HEIGHT = 0xBA
+_MKV_CLUSTER = 0x1F43B675
+_MKV_CODEC_NAMES = {
+    'V_MPEG4/ISO/AVC': 'h264', 'V_MPEGH/ISO/HEVC': 'hevc',
+    'V_VP8': 'vp8', 'V_VP9': 'vp9', 'V_AV1': 'av1',
+}
+
+
+def _read_ebml_vint(f, keep_marker=False):
+    """读取 EBML 变长整数；keep_marker=True 用于元素 ID。返回 (值, 是否未知长度)"""
+    first = f.read(1)
+    if not first:
+        raise EOFError
+    first = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not (first & mask):
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError('invalid EBML vint')
+    value = first if keep_marker else first & (mask - 1)
+    unknown = (first & (mask - 1)) == mask - 1
+    for byte in f.read(length - 1):
+        value = (value << 8) | byte
+        unknown = unknown and byte == 0xFF
+    return value, unknown
+
+
+def _iter_ebml_elements(f, end):
+    """遍历 [当前位置, end) 内的 EBML 元素，产出 (ID, 内容起点, 内容终点)"""
+    while f.tell() < end:
+        element_id, _ = _read_ebml_vint(f, keep_marker=True)
+        size, unknown = _read_ebml_vint(f)
+        body = f.tell()
+        element_end = end if unknown else min(body + size, end)
+        yield element_id, body, element_end
+        f.seek(element_end)
+
+
+def _read_ebml_uint(f, start, end):
+    f.seek(start)
+    return int.from_bytes(f.read(min(end - start, 8)), 'big')
+
+
+def _parse_ebml_info(filepath):
+    """解析 MKV/WebM 的 EBML 头：Segment → Info（时长）+ Tracks（视频轨宽高、帧率）"""
+    with open(filepath, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        file_size = f.tell()
+        f.seek(0)
+        header_id, _ = _read_ebml_vint(f, keep_marker=True)
+        if header_id != _EBML_HEADER:
+            return None
+        f.seek(0)
+
+        segment = None
+        for element_id, body, end in _iter_ebml_elements(f, file_size):
+            if element_id == _MKV_SEGMENT:
+                segment = (body, min(end, file_size))
+                break
+        if not segment:
+            return None
+
+        timecode_scale = 1_000_000
+        duration = None
+        video = None
+        f.seek(segment[0])
+        for element_id, body, end in _iter_ebml_elements(f, segment[1]):
+            if element_id == _MKV_INFO:
+                for child_id, c_body, c_end in _iter_ebml_elements(f, end):
+                    if child_id == _MKV_TIMECODE_SCALE:
+                        timecode_scale = _read_ebml_uint(f, c_body, c_end)
+                    elif child_id == _MKV_DURATION:
+                        f.seek(c_body)
+                        raw = f.read(min(c_end - c_body, 8))
+                        duration = struct.unpack('>f' if len(raw) == 4 else '>d', raw)[0]
+                f.seek(end)
+            elif element_id == _MKV_TRACKS:
+                for entry_id, e_body, e_end in _iter_ebml_elements(f, end):
+                    if entry_id != _MKV_TRACK_ENTRY or video:
+                        continue
+                    track = {}
+                    for child_id, c_body, c_end in _iter_ebml_elements(f, e_end):
+                        if child_id == _MKV_TRACK_TYPE:
+                            track['type'] = _read_ebml_uint(f, c_body, c_end)
+                        elif child_id == _MKV_CODEC_ID:
+                            f.seek(c_body)
+                            track['codec'] = f.read(min(c_end - c_body, 64)).rstrip(b'\x00').decode('ascii', 'replace')
+                        elif child_id == _MKV_DEFAULT_DURATION:
+                            track['frame_ns'] = _read_ebml_uint(f, c_body, c_end)
+                        elif child_id == _MKV_CODEC_PRIVATE and c_end - c_body <= 65536:
+                            f.seek(c_body)
+                            track['private'] = f.read(c_end - c_body)
+                        elif child_id == _MKV_VIDEO:
+                            for v_id, v_body, v_end in _iter_ebml_elements(f, c_end):
+                                if v_id == _MKV_PIXEL_WIDTH:
+                                    track['width'] = _read_ebml_uint(f, v_body, v_end)
+                                elif v_id == _MKV_PIXEL_HEIGHT:
+                                    track['height'] = _read_ebml_uint(f, v_body, v_end)
+                            f.seek(c_end)
+                    if track.get('type') == 1:
+                        video = track
+                    f.seek(e_end)
+                f.seek(end)
+            elif element_id == _MKV_CLUSTER:
+                break
+            if video and duration is not None:
+                break
+
+    if not video or not video.get('width') or not video.get('height') or not duration:
+        return None
+    codec = video.get('codec', '')
+    pix_fmt = ''
+    if codec == 'V_MPEG4/ISO/AVC' and video.get('private'):
+        pix_fmt = _avc_pix_fmt(video['private'])
+    info = {
+        'width': video['width'],
+        'height': video['height'],
+        'duration': duration * timecode_scale / 1e9,
+        'codec': _MKV_CODEC_NAMES.get(codec, codec),
+        'pix_fmt': pix_fmt,
+        'rotation': 0,
+    }
+    if video.get('frame_ns'):
+        info['fps'] = round(1e9 / video['frame_ns'], 3)
+    return info
+
+
+def _probe_container_header(filepath):
+    """进程内解析容器头获取视频信息，无法解析时返回 None（由调用方回退到 ffprobe）"""
+    ext = Path(filepath).suffix.lower()
+    try:
+        if ext in MP4_EXTENSIONS:
+            return _parse_mp4_info(filepath)
+        if ext in EBML_EXTENSIONS:
+            return _parse_ebml_info(filepath)
+    except (OSError, ValueError, EOFError, IndexError, struct.error):
+        pass
+    return None
+
+
+def _probe_cache_key(filepath):
+    """探测缓存键：绝对路径 + 文件大小 + 修改时间，文件被改动后自动失效"""
+    st = os.stat(filepath)
+    return f"{Path(filepath).resolve()}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def get_video_info(filepath, content_hash=None):
+    """获取视频宽高和时长（带持久化缓存，上传 / 处理阶段共享探测结果）
+
+    content_hash: 可选的内容哈希，相同内容换了路径也能命中缓存。
+    """
+    try:
+        path_key = _probe_cache_key(filepath)
+    except OSError:
+        return None
+
+    cached = probe_cache.get(path_key)
+    if cached is None and content_hash:
+        cached = probe_cache.get(f"sha256:{content_hash}")
+    # 早期条目没有帧率字段（降帧需要），重新探测一次
+    if cached is not None and 'fps' in cached:
+        return dict(cached)
+
+    info = _probe_video(filepath)
+    if info is not None:
+        info.setdefault('fps', None)
+        probe_cache.put(path_key, info)
+        if content_hash:
+            probe_cache.put(f"sha256:{content_hash}", info)
+    return info
+
+
+def cached_file_sha256(filepath):
+    """源文件内容哈希，记在探测缓存中（键为 路径+大小+修改时间），同一文件版本只读一遍
+
+    本地导入的文件没有上传时顺带算出的哈希，输出缓存查找前不必每次整文件重读。
+    """
+    hash_key = f"{_probe_cache_key(filepath)}|sha256"
+    cached = probe_cache.get(hash_key)
+    if cached is not None:
+        return cached['sha256']
+    digest = file_sha256(filepath)
+    probe_cache.put(hash_key, {'sha256': digest})
+    return digest
+
+
+def _probe_video(filepath):
+    """获取视频宽高、时长和帧率：优先进程内解析容器头，失败再用 ffprobe 或 ffmpeg 回退
+    宽高为旋转后的显示尺寸（与 FFmpeg 自动旋转后滤镜看到的尺寸一致）"""
+    info = _probe_container_header(filepath)
+    if info:
+        return info
+
     if FFPROBE_PATH:
         cmd = [
             FFPROBE_PATH, '-v', 'quiet',
@@ -266,7 +1351,17 @@ def get_video_info(filepath):
                     duration = float(stream.get('duration', 0))
                     if duration == 0:
                         duration = float(data.get('format', {}).get('duration', 0))
-                    return {'width': w, 'height': h, 'duration': duration}
+                    rotation = float(stream.get('tags', {}).get('rotate', 0) or 0)
+                    for side_data in stream.get('side_data_list', []):
+                        if 'rotation' in side_data:
+                            rotation = float(side_data['rotation'])
+                    info = {'width': w, 'height': h, 'duration': duration,
+                            'codec': stream.get('codec_name', ''),
+                            'pix_fmt': stream.get('pix_fmt', '')}
+                    num, _, den = (stream.get('avg_frame_rate') or '0/0').partition('/')
+                    if float(den or 0) and float(num):
+                        info['fps'] = round(float(num) / float(den), 3)
+                    return _apply_rotation(info, rotation)
         except Exception:
             pass
 
@@ -285,7 +1380,20 @@ def get_video_info(filepath):
             if dur_match:
                 hh, mm, ss = dur_match.groups()
                 duration = int(hh) * 3600 + int(mm) * 60 + float(ss)
-            return {'width': w, 'height': h, 'duration': duration}
+            rotation = 0
+            rot_match = (re.search(r'displaymatrix: rotation of (-?[\d.]+) degrees', stderr)
+                         or re.search(r'rotate\s*:\s*(-?\d+)', stderr))
+            if rot_match:
+                rotation = float(rot_match.group(1))
+            codec_match = re.search(r'Stream.*Video:\s*(\w+)', stderr)
+            pix_fmt_match = re.search(r'Stream.*Video:[^,]*,\s*(\w+)', stderr)
+            info = {'width': w, 'height': h, 'duration': duration,
+                    'codec': codec_match.group(1) if codec_match else '',
+                    'pix_fmt': pix_fmt_match.group(1) if pix_fmt_match else ''}
+            fps_match = re.search(r'Stream.*Video.*?([\d.]+) fps', stderr)
+            if fps_match:
+                info['fps'] = float(fps_match.group(1))
+            return _apply_rotation(info, rotation)
     except Exception:
         pass
 
@@ -362,45 +1470,365 @@ def generate_output_filename(original_name, target_ratio):
     return f"{new_name}{ext}"
 
 
-def process_video(input_path, target_ratio, output_path):
-    """处理单个视频到目标比例（模糊背景）"""
-    info = get_video_info(input_path)
+def _blur_filter(bg_src, fg_src, out_w, out_h, out_label, downscale=None):
+    """模糊背景滤镜链：bg_src 铺满画布后模糊，fg_src 等比缩放后居中叠加
+
+    downscale > 1 时启用快速模糊：背景分支先缩小到 1/downscale 再以等比例缩小的
+    sigma 模糊，最后放大回画布尺寸。大 sigma 高斯模糊本身只保留低频，视觉上几乎
+    无差别，但 gblur 的计算量按像素数下降。None 表示读取配置 blurDownscale。
+    缩小再放大时宽高比会有取整误差，scale 会把它折算进 SAR，故放大后和输出处都重置为方形像素。
+    """
+    if downscale is None:
+        downscale = int(get_processing_config().get('blurDownscale') or 1)
+    if downscale > 1:
+        small_w = make_even(max(2, out_w // downscale))
+        small_h = make_even(max(2, out_h // downscale))
+        sigma = BLUR_SIGMA * small_w / out_w
+        bg_chain = (
+            f"{bg_src}scale={small_w}:{small_h}:force_original_aspect_ratio=increase,"
+            f"crop={small_w}:{small_h},gblur=sigma={sigma:.3f},"
+            f"scale={out_w}:{out_h},setsar=1[bg_{out_label}];"
+        )
+    else:
+        bg_chain = (
+            f"{bg_src}scale={out_w}:{out_h}:force_original_aspect_ratio=increase,"
+            f"crop={out_w}:{out_h},gblur=sigma={BLUR_SIGMA}[bg_{out_label}];"
+        )
+    return (
+        bg_chain +
+        f"{fg_src}scale={out_w}:{out_h}:force_original_aspect_ratio=decrease[fg_{out_label}];"
+        f"[bg_{out_label}][fg_{out_label}]overlay=(W-w)/2:(H-h)/2,setsar=1[{out_label}]"
+    )
+
+
+def source_prefilter(info, profile=None, prescale=None, max_fps=None):
+    """源视频在分流（split）之前的公共前处理：降帧 + 缩小到输出实际需要的分辨率
+
+    前景一律 fit 在画布内且不放大，三种标准画布中所需缩放比例最大的那个决定了源视频
+    有用的分辨率；超出部分在每个模糊 / 套版分支里都会被各自缩掉，提前缩一次后所有分支
+    都在小图上运算，前景清晰度不变。按全部标准比例而非本次的目标比例计算，同一比例的
+    输出与一起编码的其他比例无关（输出缓存按单个比例命中）。
+    帧率上限取配置 maxFps 与交付限制 profile['maxFps'] 中较小者，只在探测到源帧率更高时生效。
+    prescale / max_fps 为 None 时读取配置 preScale / maxFps。
+
+    返回 (滤镜前缀, 前处理后的 info)：滤镜前缀为空串表示无需前处理；
+    info 中的宽高 / 帧率为前处理后的值，供 _template_layout 等计算布局。
+    """
+    cfg = get_processing_config()
+    if prescale is None:
+        prescale = int(cfg.get('preScale') or 0)
+    if max_fps is None:
+        max_fps = int(cfg.get('maxFps') or 0)
+    steps = []
+
+    caps = [int(c) for c in (max_fps, (profile or {}).get('maxFps')) if c]
+    if caps and (info.get('fps') or 0) > min(caps) + 0.01:
+        steps.append(f"fps={min(caps)}")
+        info = dict(info, fps=float(min(caps)))
+
+    if prescale:
+        w, h = info['width'], info['height']
+        need = max(min(out_w / w, out_h / h) for out_w, out_h in
+                   (calculate_output_dimensions(w, h, r) for r in STANDARD_RATIOS))
+        new_w, new_h = make_even(max(2, round(w * need))), make_even(max(2, round(h * need)))
+        if new_w < w and new_h < h:
+            steps.append(f"scale={new_w}:{new_h}")
+            info = dict(info, width=new_w, height=new_h)
+
+    return ','.join(steps), info
+
+
+def _source_chain(prefilter, count):
+    """把 [0:v] 经前处理后分成 count 路，返回 (滤镜链或 None, 各路输入标签)
+    无前处理时直接复用 [0:v]（输入流可被多个滤镜引用），不额外 split"""
+    if not prefilter:
+        return None, ['[0:v]'] * count
+    labels = [f"[src{i}]" for i in range(count)]
+    if count == 1:
+        return f"[0:v]{prefilter}{labels[0]}", labels
+    return f"[0:v]{prefilter},split={count}{''.join(labels)}", labels
+
+
+FFMPEG_STDERR_TAIL_LINES = 40
+
+
+class JobCancelled(Exception):
+    """作业被用户取消"""
+
+
+def _suspend_process(process):
+    """挂起子进程：POSIX 发 SIGSTOP，Windows 调用 NtSuspendProcess"""
+    if sys.platform == 'win32':
+        import ctypes
+        ctypes.windll.ntdll.NtSuspendProcess(int(process._handle))
+    else:
+        os.kill(process.pid, signal.SIGSTOP)
+
+
+def _resume_process(process):
+    if sys.platform == 'win32':
+        import ctypes
+        ctypes.windll.ntdll.NtResumeProcess(int(process._handle))
+    else:
+        os.kill(process.pid, signal.SIGCONT)
+
+
+class JobControl:
+    """单个作业的控制句柄：登记正在运行的 FFmpeg 进程，支持取消 / 暂停 / 继续
+
+    暂停时挂起进程并向调度器借一个工作线程（挂起的进程不占 CPU）；尚未启动的作业只记下暂停标记，
+    进程启动后立即挂起。取消直接结束进程，run_ffmpeg 随即抛出 JobCancelled。
+    分段编码时每个分段有自己的子句柄（spawn），取消 / 暂停 / 继续会同步到全部子句柄。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._process = None
+        self._slot_lent = False
+        self._children = []
+        self.cancelled = False
+        self.paused = False
+
+    def spawn(self):
+        """创建继承当前取消 / 暂停状态的子句柄"""
+        child = JobControl()
+        with self._lock:
+            child.cancelled, child.paused = self.cancelled, self.paused
+            self._children.append(child)
+        return child
+
+    def _suspend_locked(self):
+        _suspend_process(self._process)
+        if not self._slot_lent:
+            self._slot_lent = True
+            get_scheduler().lend_slot()
+
+    def _resume_locked(self):
+        if self._process is not None:
+            _resume_process(self._process)
+        if self._slot_lent:
+            self._slot_lent = False
+            get_scheduler().return_slot()
+
+    def attach(self, process):
+        with self._lock:
+            self._process = process
+            if self.cancelled:
+                process.kill()
+            elif self.paused:
+                self._suspend_locked()
+
+    def detach(self):
+        with self._lock:
+            self._process = None
+            if self._slot_lent:
+                self._slot_lent = False
+                get_scheduler().return_slot()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._process is not None:
+                if self.paused:
+                    self._resume_locked()
+                self._process.kill()
+            self.paused = False
+            children = list(self._children)
+        for child in children:
+            child.cancel()
+
+    def pause(self):
+        with self._lock:
+            if self.paused or self.cancelled:
+                return False
+            self.paused = True
+            if self._process is not None:
+                self._suspend_locked()
+            children = list(self._children)
+        for child in children:
+            child.pause()
+        return True
+
+    def resume(self):
+        with self._lock:
+            if not self.paused:
+                return False
+            self.paused = False
+            self._resume_locked()
+            children = list(self._children)
+        for child in children:
+            child.resume()
+        return True
+
+
+def _parse_progress_time(value):
+    try:
+        return max(0.0, int(value) / 1_000_000)
+    except (TypeError, ValueError):
+        return None
+
+
+def run_ffmpeg(cmd, duration=0, on_progress=None, label='FFmpeg', control=None):
+    """运行 FFmpeg 并逐块解析 -progress 输出
+
+    cmd 为完整命令（首项是 FFmpeg 可执行文件），会自动插入 -hide_banner -progress pipe:1 -nostats。
+    每个进度块（约 0.5 秒一次）调用 on_progress({percent, fps, speed, out_time, eta})，
+    percent / eta 依据探测到的 duration 计算，未知时为 None。
+    stderr 只保留最后 FFMPEG_STDERR_TAIL_LINES 行，失败时随 RuntimeError 一起抛出。
+    control: JobControl，登记子进程以便取消 / 暂停；被取消时抛出 JobCancelled。
+    """
+    import time
+    cmd = [cmd[0], '-hide_banner', '-progress', 'pipe:1', '-nostats', *cmd[1:]]
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        encoding='utf-8', errors='replace',
+        **_subprocess_kwargs
+    )
+
+    if control is not None:
+        control.attach(process)
+
+    stderr_tail = deque(maxlen=FFMPEG_STDERR_TAIL_LINES)
+
+    def drain_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line.rstrip())
+
+    stderr_thread = threading.Thread(target=drain_stderr, daemon=True)
+    stderr_thread.start()
+
+    started = time.monotonic()
+    block = {}
+    for line in process.stdout:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            continue
+        if key != 'progress':
+            block[key] = value
+            continue
+        if on_progress is not None:
+            out_time = _parse_progress_time(block.get('out_time_us') or block.get('out_time_ms'))
+            try:
+                fps = float(block.get('fps', ''))
+            except ValueError:
+                fps = None
+            try:
+                speed = float(block.get('speed', '').rstrip('x'))
+            except ValueError:
+                speed = None
+            percent = eta = None
+            if value == 'end':
+                percent, eta = 100.0, 0.0
+            elif duration and out_time is not None:
+                percent = min(99.9, out_time / duration * 100)
+                if speed:
+                    eta = max(0.0, (duration - out_time) / speed)
+                elif out_time > 0:
+                    elapsed = time.monotonic() - started
+                    eta = max(0.0, elapsed * (duration - out_time) / out_time)
+            try:
+                on_progress({'percent': percent, 'fps': fps, 'speed': speed,
+                             'out_time': out_time, 'eta': eta})
+            except Exception as e:
+                print(f"  [{label}] progress callback failed: {e}")
+        block = {}
+
+    process.wait()
+    stderr_thread.join()
+    if control is not None:
+        control.detach()
+        if control.cancelled:
+            raise JobCancelled('已取消')
+    if process.returncode != 0:
+        tail = '\n'.join(stderr_tail)
+        print(f"  [{label}] FFmpeg FAILED: {tail[-500:]}")
+        raise RuntimeError(f"FFmpeg 错误: {tail}")
+
+
+def process_video(input_path, target_ratio, output_path, info=None, on_progress=None,
+                  control=None, profile=None):
+    """处理单个视频到目标比例（模糊背景）
+    info: 已探测的 {width, height, duration}，为空时重新探测
+    on_progress / control: 编码进度回调与作业控制句柄，见 run_ffmpeg
+    profile: 编码档位（resolve_encoder_profile 的结果），为空时用默认档位
+    """
+    info = info or get_video_info(input_path)
     if not info:
         raise ValueError(f"无法读取视频信息: {input_path}")
 
-    orig_w, orig_h = info['width'], info['height']
-    out_w, out_h = calculate_output_dimensions(orig_w, orig_h, target_ratio)
+    prefilter, src_info = source_prefilter(info, profile)
+    out_w, out_h = calculate_output_dimensions(src_info['width'], src_info['height'], target_ratio)
 
-    filter_complex = (
-        f"[0:v]scale={out_w}:{out_h}:force_original_aspect_ratio=increase,"
-        f"crop={out_w}:{out_h},gblur=sigma={BLUR_SIGMA}[bg];"
-        f"[0:v]scale={out_w}:{out_h}:force_original_aspect_ratio=decrease[fg];"
-        f"[bg][fg]overlay=(W-w)/2:(H-h)/2[out]"
-    )
+    source, (bg_src, fg_src) = _source_chain(prefilter, 2)
+    filter_complex = _blur_filter(bg_src, fg_src, out_w, out_h, 'out')
+    if source:
+        filter_complex = f"{source};{filter_complex}"
 
     cmd = [
-        FFMPEG_PATH, '-y', '-i', str(input_path),
+        FFMPEG_PATH, '-y', *_ffmpeg_thread_args(), '-i', str(input_path),
         '-filter_complex', filter_complex,
         '-map', '[out]', '-map', '0:a?',
-        '-c:v', 'libx264', '-crf', '18', '-preset', 'medium',
-        '-c:a', 'copy',
+        *_video_encoder_args(profile, output_path),
+        *_audio_encoder_args(profile),
         '-movflags', '+faststart',
         str(output_path)
     ]
 
-    process = subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-        encoding='utf-8', errors='replace',
-        **_subprocess_kwargs
-    )
-    _, stderr = process.communicate()
+    run_ffmpeg(cmd, info.get('duration') or 0, on_progress, control=control)
 
-    if process.returncode != 0:
-        raise RuntimeError(f"FFmpeg 错误: {stderr}")
+    return output_path
+
+
+def can_passthrough(info, target_ratio, template=None, profile=None):
+    """源视频已是目标画布时可直接封装复制：H.264 / yuv420p / 无旋转 / 尺寸与目标一致，且不套版
+
+    与重新编码的输出（libx264 yuv420p）同样兼容，只省掉一次有损转码；
+    编码档位要求其他编码器（如 H.265），或套用了平台交付限制（码率 / 帧率 / 音频需重新控制）时不直通；
+    source_prefilter 需要降帧（配置 maxFps 低于源帧率，或源帧率未知无法确认）时也不直通。
+    """
+    if template or not info:
+        return False
+    profile = profile or resolve_encoder_profile()
+    if profile['vcodec'] != 'libx264' or profile.get('platform'):
+        return False
+    if info.get('codec') != 'h264' or info.get('pix_fmt') != 'yuv420p' or info.get('rotation'):
+        return False
+    if source_prefilter(info, profile)[0]:
+        return False
+    if int(get_processing_config().get('maxFps') or 0) and not info.get('fps'):
+        return False
+    out_w, out_h = calculate_output_dimensions(info['width'], info['height'], target_ratio)
+    return (info['width'], info['height']) == (out_w, out_h)
 
+
+def passthrough_video(input_path, output_path, info=None, on_progress=None, control=None):
+    """流复制重新封装（视频 + 音频），并把 moov 前置以便边下边播"""
+    info = info or get_video_info(input_path) or {}
+    cmd = [
+        FFMPEG_PATH, '-y', '-i', str(input_path),
+        '-map', '0:v:0', '-map', '0:a?',
+        '-c', 'copy',
+        '-movflags', '+faststart',
+        str(output_path)
+    ]
+    run_ffmpeg(cmd, info.get('duration') or 0, on_progress, label='Remux', control=control)
     return output_path
 
 
+def _transparent_pixel_counts(alpha, threshold):
+    """统计每列 / 每行 alpha < threshold 的像素数（Pillow 整图运算，不逐像素访问）
+
+    先用查找表把 alpha 转成 0/1 掩码，再以 BOX 滤波分别缩放到 (w, 1) 和 (1, h)，
+    得到每列 / 每行的透明占比，乘回像素数取整即为精确计数（float32 误差远小于 0.5）。
+    返回: (col_counts, row_counts)
+    """
+    w, h = alpha.size
+    mask = alpha.point([1 if v < threshold else 0 for v in range(256)]).convert('F')
+    col_means = array('f', mask.resize((w, 1), PILImage.BOX).tobytes())
+    row_means = array('f', mask.resize((1, h), PILImage.BOX).tobytes())
+    return [round(v * h) for v in col_means], [round(v * w) for v in row_means]
+
+
 def detect_transparent_region(template_path, threshold=10, col_row_pct=0.5):
     """检测 PNG 套版的透明区域（视频放置位置）
 
@@ -414,22 +1842,16 @@ def detect_transparent_region(template_path, threshold=10, col_row_pct=0.5):
         raise RuntimeError("需要 Pillow 库来检测套版透明区域")
 
     img = PILImage.open(template_path).convert('RGBA')
-    alpha = img.split()[3]  # Alpha 通道
+    alpha = img.getchannel('A')  # Alpha 通道
     w, h = img.size
 
+    col_counts, row_counts = _transparent_pixel_counts(alpha, threshold)
+
     # 逐列统计：该列中透明像素(alpha < threshold)占比 > col_row_pct 才算透明列
-    transparent_cols = []
-    for col in range(w):
-        count = sum(1 for row in range(h) if alpha.getpixel((col, row)) < threshold)
-        if count / h >= col_row_pct:
-            transparent_cols.append(col)
+    transparent_cols = [col for col, count in enumerate(col_counts) if count / h >= col_row_pct]
 
     # 逐行统计：该行中透明像素占比 > col_row_pct 才算透明行
-    transparent_rows = []
-    for row in range(h):
-        count = sum(1 for col in range(w) if alpha.getpixel((col, row)) < threshold)
-        if count / w >= col_row_pct:
-            transparent_rows.append(row)
+    transparent_rows = [row for row, count in enumerate(row_counts) if count / w >= col_row_pct]
 
     if not transparent_cols or not transparent_rows:
         # 统计法没结果，回退到 getbbox 兜底
@@ -469,27 +1891,11 @@ def detect_transparent_region(template_path, threshold=10, col_row_pct=0.5):
     return region
 
 
-def process_video_with_template(input_path, template_path, region, output_path,
-                                target_ratio=None):
-    """使用套版合成视频
-
-    核心逻辑（与 process_video 保持一致的缩放）：
-      1. 输出分辨率 = 根据视频尺寸 + 目标比例计算（和无套版时完全一样）
-      2. 视频缩放 = 和 process_video 完全一样（fit 在画布内，不放大）
-      3. 位置 = 视频居中对齐到套版的透明区域（而非画布居中）
-      4. 套版 PNG 缩放到输出尺寸，叠在最上层
+def _template_layout(vid_w, vid_h, region, target_ratio=None):
+    """计算套版模式下的画布尺寸与视频位置（process_video_with_template 的第1~4步）
 
-    合成层次：
-      底层: 黑色画布 (输出尺寸，和无套版时一致)
-      中层: 源视频 (原始缩放，对齐透明区域)
-      顶层: 套版 PNG (缩放至输出尺寸)
+    返回: {out_w, out_h, offset_x, offset_y, scaled_w, scaled_h}
     """
-    info = get_video_info(input_path)
-    if not info:
-        raise ValueError(f"无法读取视频信息: {input_path}")
-
-    vid_w, vid_h = info['width'], info['height']
-
     # ━━━ 第1步：输出画布尺寸由视频决定（和 process_video 一致）━━━
     if target_ratio:
         out_w, out_h = calculate_output_dimensions(vid_w, vid_h, target_ratio)
@@ -533,28 +1939,158 @@ def process_video_with_template(input_path, template_path, region, output_path,
     print(f"  [Template] Compare: blur mode would be "
           f"({(out_w-scaled_vid_w)//2},{(out_h-scaled_vid_h)//2})")
 
-    # FFmpeg 滤镜：
-    #   1. 视频缩放 — 和 process_video 一样的逻辑
-    #   2. 黑色画布
-    #   3. 视频放到透明区域中心位置
-    #   4. 套版缩放到画布大小，叠在最上层
-    filter_complex = (
-        f"[0:v]scale='min({out_w},iw)':'min({out_h},ih)'"
-        f":force_original_aspect_ratio=decrease[vid];"
-        f"color=c=black:s={out_w}x{out_h}[base];"
-        f"[base][vid]overlay={offset_x}:{offset_y}:shortest=1[withvid];"
-        f"[1:v]scale={out_w}:{out_h}[tpl];"
-        f"[withvid][tpl]overlay=0:0:format=auto:shortest=1[out]"
+    return {
+        'out_w': out_w, 'out_h': out_h,
+        'offset_x': offset_x, 'offset_y': offset_y,
+        'scaled_w': scaled_vid_w, 'scaled_h': scaled_vid_h,
+    }
+
+
+# 进程内的预渲染结果 {(content_hash, out_w, out_h): {path, x, y} 或 {path: None}}
+_template_renders = {}
+_template_render_lock = threading.Lock()
+
+
+def prerender_template(template_path, out_w, out_h, content_hash=None):
+    """把套版预先缩放到输出画布，裁掉全透明的边缘，整批视频共用同一张静态帧
+
+    保留非预乘 alpha：FFmpeg overlay 的 alpha=premultiplied 在 YUV 格式下会把颜色压暗
+    （白色 255 → 236），非预乘 + format=yuv420 与旧链路结果一致且不必转到 RGB 合成。
+
+    返回 {path, x, y}：裁剪后图片的路径及其在画布上的位置；套版完全透明时 path 为 None；
+    没有 Pillow 时返回 None（调用方退回逐帧缩放的旧滤镜链）。
+    """
+    if not HAS_PIL:
+        return None
+    content_hash = content_hash or file_sha256(template_path)
+    key = (content_hash, out_w, out_h)
+    with _template_render_lock:
+        render = _template_renders.get(key)
+        # 渲染文件可能已随套版缓存淘汰被删除，此时重新渲染
+        if render is not None and (render['path'] is None or render['path'].exists()):
+            return render
+
+        prefix = f"{content_hash}_{out_w}x{out_h}_v{TEMPLATE_RENDER_VERSION}_"
+        for existing in TEMPLATE_RENDER_DIR.glob(f"{prefix}*.png"):
+            try:
+                x, y = (int(v) for v in existing.stem[len(prefix):].split('_'))
+            except ValueError:
+                continue
+            render = {'path': existing, 'x': x, 'y': y}
+            _template_renders[key] = render
+            return render
+
+        with PILImage.open(template_path) as img:
+            canvas = img.convert('RGBA').resize((out_w, out_h), PILImage.LANCZOS)
+        bbox = canvas.getchannel('A').getbbox()
+        if bbox is None:
+            render = {'path': None, 'x': 0, 'y': 0}
+        else:
+            cropped = canvas.crop(bbox)
+            path = TEMPLATE_RENDER_DIR / f"{prefix}{bbox[0]}_{bbox[1]}.png"
+            tmp_path = path.with_suffix('.tmp')
+            cropped.save(tmp_path, format='PNG', compress_level=1)
+            os.replace(tmp_path, path)
+            render = {'path': path, 'x': bbox[0], 'y': bbox[1]}
+            print(f"  [Template] Pre-rendered {out_w}x{out_h}, opaque bbox {bbox}")
+        _template_renders[key] = render
+        return render
+
+
+def _template_inputs(template_path, render):
+    """套版的 FFmpeg 输入参数：预渲染帧只解码一次（overlay 以 eof_action=repeat 重复使用）"""
+    if render is None:
+        return ['-loop', '1', '-i', str(template_path)]
+    if render['path'] is None:
+        return []
+    return ['-i', str(render['path'])]
+
+
+def _template_filter(vid_src, tpl_src, layout, out_label, render=None):
+    """套版滤镜链：
+      1. 视频缩放 — 和 process_video 一样的逻辑
+      2. 黑色画布
+      3. 视频放到透明区域中心位置
+      4. 套版缩放到画布大小，叠在最上层
+
+    render: prerender_template 的结果。提供时套版已是画布尺寸的静态帧，
+    每帧只需把视频 pad 到画布上，再在不透明区域内做一次 overlay；
+    视频超出画布（pad 无法表示）时仍用黑色画布 + overlay 放置视频。
+    pad 保留缩放后视频的 SAR，需重置为方形像素（旧链路由 color 画布决定 SAR）。
+    """
+    out_w, out_h = layout['out_w'], layout['out_h']
+    if render is not None:
+        x, y = layout['offset_x'], layout['offset_y']
+        scaled = (f"{vid_src}scale='min({out_w},iw)':'min({out_h},ih)'"
+                  f":force_original_aspect_ratio=decrease")
+        if x >= 0 and y >= 0 and x + layout['scaled_w'] <= out_w and y + layout['scaled_h'] <= out_h:
+            base = f"{scaled},pad={out_w}:{out_h}:{x}:{y}:color=black,setsar=1"
+        else:
+            base = (f"{scaled}[vid_{out_label}];"
+                    f"color=c=black:s={out_w}x{out_h}[base_{out_label}];"
+                    f"[base_{out_label}][vid_{out_label}]overlay={x}:{y}:shortest=1,setsar=1")
+        if render['path'] is None:
+            return f"{base}[{out_label}]"
+        return (
+            f"{base}[withvid_{out_label}];"
+            f"[withvid_{out_label}]{tpl_src}overlay={render['x']}:{render['y']}"
+            f":eof_action=repeat:format=yuv420[{out_label}]"
+        )
+    return (
+        f"{vid_src}scale='min({out_w},iw)':'min({out_h},ih)'"
+        f":force_original_aspect_ratio=decrease[vid_{out_label}];"
+        f"color=c=black:s={out_w}x{out_h}[base_{out_label}];"
+        f"[base_{out_label}][vid_{out_label}]overlay={layout['offset_x']}:{layout['offset_y']}"
+        f":shortest=1[withvid_{out_label}];"
+        f"{tpl_src}scale={out_w}:{out_h}[tpl_{out_label}];"
+        f"[withvid_{out_label}][tpl_{out_label}]overlay=0:0:format=auto:shortest=1[{out_label}]"
     )
 
+
+def process_video_with_template(input_path, template_path, region, output_path,
+                                target_ratio=None, info=None, on_progress=None, control=None,
+                                content_hash=None, profile=None):
+    """使用套版合成视频
+
+    核心逻辑（与 process_video 保持一致的缩放）：
+      1. 输出分辨率 = 根据视频尺寸 + 目标比例计算（和无套版时完全一样）
+      2. 视频缩放 = 和 process_video 完全一样（fit 在画布内，不放大）
+      3. 位置 = 视频居中对齐到套版的透明区域（而非画布居中）
+      4. 套版 PNG 缩放到输出尺寸，叠在最上层
+
+    合成层次：
+      底层: 黑色画布 (输出尺寸，和无套版时一致)
+      中层: 源视频 (原始缩放，对齐透明区域)
+      顶层: 套版 PNG (缩放至输出尺寸)
+
+    套版按画布尺寸预渲染一次（prerender_template），整批视频共用，不再逐帧解码、缩放。
+
+    info: 已探测的 {width, height, duration}，为空时重新探测
+    on_progress / control: 编码进度回调与作业控制句柄，见 run_ffmpeg
+    content_hash: 套版内容哈希（预渲染缓存键），为空时现算
+    profile: 编码档位，为空时用默认档位
+    """
+    info = info or get_video_info(input_path)
+    if not info:
+        raise ValueError(f"无法读取视频信息: {input_path}")
+
+    # 布局按前处理（缩小）后的源尺寸计算，与滤镜图里视频分支实际看到的尺寸一致
+    prefilter, src_info = source_prefilter(info, profile)
+    layout = _template_layout(src_info['width'], src_info['height'], region, target_ratio)
+    render = prerender_template(template_path, layout['out_w'], layout['out_h'], content_hash)
+    source, (vid_src,) = _source_chain(prefilter, 1)
+    filter_complex = _template_filter(vid_src, '[1:v]', layout, 'out', render)
+    if source:
+        filter_complex = f"{source};{filter_complex}"
+
     cmd = [
-        FFMPEG_PATH, '-y',
+        FFMPEG_PATH, '-y', *_ffmpeg_thread_args(),
         '-i', str(input_path),
-        '-loop', '1', '-i', str(template_path),
+        *_template_inputs(template_path, render),
         '-filter_complex', filter_complex,
         '-map', '[out]', '-map', '0:a?',
-        '-c:v', 'libx264', '-crf', '18', '-preset', 'medium',
-        '-c:a', 'copy',
+        *_video_encoder_args(profile, output_path),
+        *_audio_encoder_args(profile),
         '-movflags', '+faststart',
         '-shortest',
         str(output_path)
@@ -562,94 +2098,1039 @@ def process_video_with_template(input_path, template_path, region, output_path,
 
     print(f"  [Template] FFmpeg filter: {filter_complex}")
 
-    process = subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-        encoding='utf-8', errors='replace',
-        **_subprocess_kwargs
-    )
-    _, stderr = process.communicate()
-
-    if process.returncode != 0:
-        print(f"  [Template] FFmpeg FAILED: {stderr[:500]}")
-        raise RuntimeError(f"FFmpeg 错误: {stderr}")
+    run_ffmpeg(cmd, info.get('duration') or 0, on_progress, label='Template', control=control)
 
     print(f"  [Template] Success!")
     return output_path
 
 
-def process_task(task_id, files_info, output_dir=None, templates=None):
+def process_video_multi(input_path, outputs, info=None, on_progress=None, control=None,
+                        profile=None):
+    """单次解码，一条 FFmpeg 命令同时输出多个目标比例
+
+    outputs: list of dict {"target_ratio": "9:16", "output_path": Path, "template": {...} 或 None}
+    源视频只解码一次，经 split 分流到各比例的模糊 / 套版分支，各分支独立编码写出。
+    info: 已探测的 {width, height, duration}，为空时重新探测
+    on_progress / control: 编码进度回调与作业控制句柄，见 run_ffmpeg
+    profile: 编码档位，为空时用默认档位（所有输出相同）
+    """
+    info = info or get_video_info(input_path)
+    if not info:
+        raise ValueError(f"无法读取视频信息: {input_path}")
+    profile = profile or resolve_encoder_profile()
+
+    # 降帧 / 缩小在 split 之前做一次，各分支都在前处理后的画面上运算
+    prefilter, src_info = source_prefilter(info, profile)
+    vid_w, vid_h = src_info['width'], src_info['height']
+
+    # 模糊分支需要两路（背景 + 前景），套版分支需要一路
+    branch_count = sum(1 if o.get('template') else 2 for o in outputs)
+    split_labels = [f"[s{i}]" for i in range(branch_count)]
+    chains = [f"[0:v]{prefilter + ',' if prefilter else ''}split={branch_count}{''.join(split_labels)}"]
+
+    inputs = ['-i', str(input_path)]
+    output_args = []
+    next_split = 0
+    next_input = 1
+
+    for idx, out in enumerate(outputs):
+        label = f"out{idx}"
+        tpl = out.get('template')
+        if tpl:
+            layout = _template_layout(vid_w, vid_h, tpl['region'], out['target_ratio'])
+            render = prerender_template(tpl['path'], layout['out_w'], layout['out_h'],
+                                        tpl.get('content_hash'))
+            chains.append(_template_filter(split_labels[next_split], f"[{next_input}:v]",
+                                           layout, label, render))
+            tpl_inputs = _template_inputs(tpl['path'], render)
+            inputs += tpl_inputs
+            next_split += 1
+            next_input += 1 if tpl_inputs else 0
+        else:
+            out_w, out_h = calculate_output_dimensions(vid_w, vid_h, out['target_ratio'])
+            chains.append(_blur_filter(split_labels[next_split], split_labels[next_split + 1],
+                                       out_w, out_h, label))
+            next_split += 2
+
+        output_args += [
+            '-map', f"[{label}]", '-map', '0:a?',
+            *_video_encoder_args(profile, out['output_path'], len(outputs)),
+            *_audio_encoder_args(profile),
+            '-movflags', '+faststart',
+        ]
+        if tpl:
+            output_args.append('-shortest')
+        output_args.append(str(out['output_path']))
+
+    filter_complex = ';'.join(chains)
+    cmd = [FFMPEG_PATH, '-y', *_ffmpeg_thread_args()] + inputs + ['-filter_complex', filter_complex] + output_args
+
+    print(f"  [Multi] {Path(input_path).name}: {len(outputs)} outputs, single decode"
+          + (f", pre-filter {prefilter}" if prefilter else ''))
+
+    run_ffmpeg(cmd, info.get('duration') or 0, on_progress, label='Multi', control=control)
+
+    return [out['output_path'] for out in outputs]
+
+
+PREVIEW_FORMATS = {
+    'jpeg': (['-c:v', 'mjpeg', '-q:v', '3', '-f', 'image2pipe'], 'image/jpeg'),
+    'webp': (['-c:v', 'libwebp', '-quality', '80', '-f', 'webp'], 'image/webp'),
+}
+PREVIEW_MAX_CLIP_SECONDS = 5
+
+
+def render_preview(input_path, target_ratio, template=None, at=0.0, fmt='jpeg', width=540,
+                   clip=0.0, info=None):
+    """渲染预览：目标比例下 at 秒处的一帧合成画面（JPEG / WebP），或 clip 秒的低清 MP4 片段
+
+    滤镜图与正式编码完全相同（_blur_filter / _template_layout + _template_filter），
+    只在末尾缩小到 width；-ss 放在 -i 之前做输入端定位，只解码目标时间点附近的 GOP。
+    返回 (数据, MIME 类型)。
+    """
+    info = info or get_video_info(input_path)
+    if not info:
+        raise ValueError(f"无法读取视频信息: {input_path}")
+    duration = info.get('duration') or 0
+    at = max(0.0, min(float(at), max(0.0, duration - 0.1))) if duration else max(0.0, float(at))
+
+    inputs = ['-ss', f"{at:.3f}", '-i', str(input_path)]
+    prefilter, src_info = source_prefilter(info)
+    if template:
+        layout = _template_layout(src_info['width'], src_info['height'], template['region'],
+                                  target_ratio)
+        render = prerender_template(template['path'], layout['out_w'], layout['out_h'],
+                                    template.get('content_hash'))
+        source, (vid_src,) = _source_chain(prefilter, 1)
+        graph = _template_filter(vid_src, '[1:v]', layout, 'out', render)
+        inputs += _template_inputs(template['path'], render)
+        out_w = layout['out_w']
+    else:
+        out_w, out_h = calculate_output_dimensions(src_info['width'], src_info['height'],
+                                                   target_ratio)
+        source, (bg_src, fg_src) = _source_chain(prefilter, 2)
+        graph = _blur_filter(bg_src, fg_src, out_w, out_h, 'out')
+    if source:
+        graph = f"{source};{graph}"
+    width = make_even(max(16, min(int(width), out_w)))
+    graph += f";[out]scale={width}:-2[preview]"
+
+    if clip:
+        output_args = ['-t', f"{min(float(clip), PREVIEW_MAX_CLIP_SECONDS):.3f}",
+                       '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '28', '-pix_fmt', 'yuv420p',
+                       '-movflags', 'frag_keyframe+empty_moov', '-f', 'mp4']
+        mimetype = 'video/mp4'
+    else:
+        output_args, mimetype = PREVIEW_FORMATS[fmt]
+        output_args = ['-frames:v', '1', *output_args]
+
+    cmd = [FFMPEG_PATH, '-hide_banner', '-v', 'error', *inputs,
+           '-filter_complex', graph, '-map', '[preview]', '-an', *output_args, 'pipe:1']
+    result = subprocess.run(cmd, capture_output=True, timeout=60, **_subprocess_kwargs)
+    if result.returncode != 0 or not result.stdout:
+        tail = result.stderr.decode('utf-8', 'replace').strip()[-500:]
+        raise RuntimeError(f"预览渲染失败: {tail or '没有输出画面'}")
+    return result.stdout, mimetype
+
+
+def split_at_keyframes(input_path, work_dir, segment_seconds, control=None):
+    """把源视频的视频流按关键帧无损切成若干段（流复制，不解码），返回按顺序排列的分段路径
+
+    segment 复用器只在关键帧处切开，每段都能独立解码；音频不切分，拼接时从源文件整体复制。
+    """
+    pattern = Path(work_dir) / 'src_%04d.mkv'
+    cmd = [
+        FFMPEG_PATH, '-y', '-i', str(input_path),
+        '-map', '0:v:0', '-c', 'copy',
+        '-f', 'segment', '-segment_time', str(segment_seconds), '-reset_timestamps', '1',
+        str(pattern)
+    ]
+    run_ffmpeg(cmd, label='Split', control=control)
+    return sorted(Path(work_dir).glob('src_*.mkv'))
+
+
+def concat_segments(segment_paths, audio_source, output_path, duration=0, control=None,
+                    audio_args=None):
+    """用 concat 复用器无损拼接已编码的分段，并从源文件取整条音轨（audio_args 为空时直接复制）"""
+    list_path = Path(segment_paths[0]).with_name(f"concat_{uuid.uuid4().hex[:8]}.txt")
+    # concat 列表中路径用单引号包裹，路径里的单引号需转义
+    list_path.write_text(
+        ''.join("file '{}'\n".format(str(p).replace("'", "'\\''")) for p in segment_paths),
+        encoding='utf-8'
+    )
+    try:
+        cmd = [
+            FFMPEG_PATH, '-y',
+            '-f', 'concat', '-safe', '0', '-i', str(list_path),
+            '-i', str(audio_source),
+            '-map', '0:v', '-map', '1:a?',
+            '-c:v', 'copy', *(audio_args or ['-c:a', 'copy']),
+            '-movflags', '+faststart',
+            str(output_path)
+        ]
+        run_ffmpeg(cmd, duration, label='Concat', control=control)
+    finally:
+        list_path.unlink(missing_ok=True)
+    return output_path
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 并行作业调度
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+class _QueuedJob:
+    __slots__ = ('future', 'fn', 'args', 'kwargs', 'tags', 'group', 'client',
+                 'priority', 'cost', 'seq', 'started')
+
+    def __init__(self, future, fn, args, kwargs, tags, group, client, priority, cost, seq):
+        self.future, self.fn, self.args, self.kwargs = future, fn, args, kwargs
+        self.tags, self.group, self.client = tags, group, client
+        self.priority, self.cost, self.seq = priority, cost, seq
+        self.started = None
+
+
+class JobScheduler:
+    """全局作业调度器：固定数量的工作线程从共享队列取作业执行，
+    CPU 预算按作业数平分，决定每个 FFmpeg 进程可用的线程数
+
+    出队顺序：优先级高的先出；同优先级下按客户端公平分配——已获服务量（已出队作业的预估代价之和）
+    最少的客户端先出；同一客户端内按预估代价（源视频时长 × 输出数）短作业优先；最后按提交顺序。
+    客户端从空闲变为活跃时，服务量提升到当前活跃客户端的最小值，空闲期间不积攒"欠账"。
+
+    作业可带若干标签（任务 id、作业 id）：被 hold 的标签对应的排队作业暂不出队，
+    cancel_tagged 直接取消仍在排队的作业。作业被暂停（进程挂起）时用 lend_slot 临时多开一个工作线程，
+    让其他排队作业不必等它恢复。
+    """
+
+    # 未知时长的作业按 60 秒估算，避免被当作最短作业插队
+    DEFAULT_COST = 60.0
+
+    def __init__(self, workers, threads_per_job, on_change=None):
+        self._cond = threading.Condition()
+        self._pending = []
+        self._running = []
+        self._held = set()
+        self._served = {}
+        self._seq = 0
+        self._base = 0
+        self._lent = 0
+        self._alive = 0
+        # 每个作业的处理速度（源视频秒数 / 墙钟秒数）的滑动平均，用于估算开始时间
+        self._rate = 1.0
+        self._on_change = on_change
+        self.threads_per_job = threads_per_job
+        self.resize(workers, threads_per_job)
+
+    def resize(self, workers, threads_per_job):
+        """调整工作线程数；多余的线程在取下一个作业前自行退出"""
+        with self._cond:
+            self._base = max(1, workers)
+            self.threads_per_job = max(1, threads_per_job)
+            self._spawn_locked()
+
+    def _spawn_locked(self):
+        while self._alive < self._base + self._lent:
+            self._alive += 1
+            threading.Thread(target=self._worker, daemon=True).start()
+        self._cond.notify_all()
+
+    @property
+    def workers(self):
+        return self._base
+
+    def lend_slot(self):
+        """一个运行中的作业被挂起：临时增加一个工作线程"""
+        with self._cond:
+            self._lent += 1
+            self._spawn_locked()
+
+    def return_slot(self):
+        """挂起的作业恢复运行：收回临时工作线程（在它完成当前作业后退出）"""
+        with self._cond:
+            self._lent = max(0, self._lent - 1)
+            self._cond.notify_all()
+
+    def submit(self, fn, *args, tags=(), group=None, client='', priority=0, cost=0.0, **kwargs):
+        """提交作业，返回 Future
+
+        group: 作业所属任务（用于排队位置统计）；client: 提交方（公平分配的单位）；
+        priority: 越大越先执行；cost: 预估代价（秒），用于短作业优先和开始时间估算。
+        """
+        future = Future()
+        with self._cond:
+            active = {j.client for j in self._pending} | {j.client for j in self._running}
+            if client not in active:
+                floor = min((self._served.get(c, 0.0) for c in active), default=0.0)
+                self._served[client] = max(self._served.get(client, 0.0), floor)
+            self._seq += 1
+            self._pending.append(_QueuedJob(future, fn, args, kwargs, frozenset(tags), group, client,
+                                            priority, cost or self.DEFAULT_COST, self._seq))
+            self._cond.notify()
+        self._changed()
+        return future
+
+    def queued_count(self, client=None):
+        with self._cond:
+            return sum(1 for j in self._pending if client is None or j.client == client)
+
+    def hold(self, tag):
+        with self._cond:
+            self._held.add(tag)
+        self._changed()
+
+    def release(self, tag):
+        with self._cond:
+            self._held.discard(tag)
+            self._cond.notify_all()
+        self._changed()
+
+    def cancel_tagged(self, tag):
+        """取消所有带 tag 的排队作业，返回被取消的数量（已开始运行的不受影响）"""
+        with self._cond:
+            keep, dropped = [], []
+            for job in self._pending:
+                (dropped if tag in job.tags else keep).append(job)
+            self._pending = keep
+        for job in dropped:
+            job.future.cancel()
+        if dropped:
+            self._changed()
+        return len(dropped)
+
+    @staticmethod
+    def _order_key(job, served):
+        return (-job.priority, served.get(job.client, 0.0), job.cost, job.seq)
+
+    def _ordered_locked(self):
+        """按出队顺序排列可运行的排队作业（模拟逐个出队时各客户端服务量的变化）
+
+        同一客户端内服务量相同，其最优作业就是按 (优先级, 代价, 顺序) 排在最前的那个，
+        所以每步只需比较各客户端队首，复杂度 O(作业数 × 客户端数)。
+        """
+        served = dict(self._served)
+        per_client = {}
+        for job in self._pending:
+            if not (job.tags & self._held):
+                per_client.setdefault(job.client, []).append(job)
+        for jobs in per_client.values():
+            jobs.sort(key=lambda j: (-j.priority, j.cost, j.seq), reverse=True)
+        ordered = []
+        while per_client:
+            client = min(per_client, key=lambda c: self._order_key(per_client[c][-1], served))
+            job = per_client[client].pop()
+            if not per_client[client]:
+                del per_client[client]
+            served[client] = served.get(client, 0.0) + job.cost
+            ordered.append(job)
+        return ordered
+
+    def _next_locked(self):
+        candidates = [j for j in self._pending if not (j.tags & self._held)]
+        if not candidates:
+            return None
+        best = min(candidates, key=lambda j: self._order_key(j, self._served))
+        self._pending.remove(best)
+        self._served[best.client] = self._served.get(best.client, 0.0) + best.cost
+        return best
+
+    def queue_report(self):
+        """各任务的排队情况 {group: {position, queued, eta_start}}
+
+        position 为该任务最靠前的排队作业在全局队列中的位置（1 起）；eta_start 为预计开始秒数：
+        用运行中作业的剩余代价和各作业的代价按处理速度依次排到最早空闲的工作线程上估算。
+        """
+        import time
+        now = time.monotonic()
+        with self._cond:
+            slots = sorted(
+                max(0.0, j.cost / self._rate - (now - j.started)) for j in self._running
+            )[:self._base]
+            slots += [0.0] * (self._base - len(slots))
+            report = {}
+            for position, job in enumerate(self._ordered_locked(), 1):
+                start = min(slots)
+                slots[slots.index(start)] = start + job.cost / self._rate
+                entry = report.setdefault(job.group, {'position': position, 'queued': 0,
+                                                      'eta_start': round(start, 1)})
+                entry['queued'] += 1
+            for job in self._pending:
+                if job.tags & self._held:
+                    report.setdefault(job.group, {'position': None, 'queued': 0, 'eta_start': None})
+                    report[job.group]['queued'] += 1
+            return report
+
+    def _changed(self):
+        if self._on_change is not None:
+            try:
+                self._on_change(self)
+            except Exception as e:
+                print(f"  [Scheduler] Queue report failed: {e}")
+
+    def _worker(self):
+        import time
+        while True:
+            with self._cond:
+                while True:
+                    if self._alive > self._base + self._lent:
+                        self._alive -= 1
+                        return
+                    job = self._next_locked()
+                    if job is not None:
+                        break
+                    self._cond.wait(timeout=1)
+                job.started = time.monotonic()
+                self._running.append(job)
+            self._changed()
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.fn(*job.args, **job.kwargs))
+                    except BaseException as e:
+                        job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running.remove(job)
+                    elapsed = time.monotonic() - job.started
+                    if elapsed > 1:
+                        self._rate = 0.7 * self._rate + 0.3 * (job.cost / elapsed)
+                self._changed()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+# 最近一次推送的排队情况 {task_id: {position, queued, eta_start}}
+_last_queue_report = {}
+_queue_report_lock = threading.Lock()
+
+
+def _publish_queue_report(scheduler):
+    """调度队列变化时，向排队中的任务推送 queue 事件（排队位置与预计开始时间）"""
+    global _last_queue_report
+    with _queue_report_lock:
+        report = {g: e for g, e in scheduler.queue_report().items() if g is not None}
+        previous = _last_queue_report
+        _last_queue_report = report
+        for task_id, entry in report.items():
+            if previous.get(task_id) != entry:
+                progress_bus.publish(task_id, 'queue', **entry)
+        for task_id in previous.keys() - report.keys():
+            progress_bus.publish(task_id, 'queue', position=None, queued=0, eta_start=None)
+
+
+def _compute_parallelism():
+    """根据 CPU 预算计算 (并行作业数, 每作业线程数)"""
+    cfg = get_processing_config()
+    budget = int(cfg.get('cpuBudget') or 0) or (os.cpu_count() or 1)
+    jobs = int(cfg.get('parallelJobs') or 0)
+    if jobs <= 0:
+        # libx264 单进程约 6 线程后收益明显下降，多余核心留给并行作业
+        jobs = max(1, min(8, budget // 6))
+    jobs = max(1, min(jobs, budget))
+    return jobs, max(1, budget // jobs)
+
+
+def get_scheduler():
+    """获取全局调度器（首次调用时按配置创建）"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            jobs, threads = _compute_parallelism()
+            _scheduler = JobScheduler(jobs, threads, on_change=_publish_queue_report)
+            print(f"  [Scheduler] {jobs} parallel jobs x {threads} threads")
+        return _scheduler
+
+
+def reconfigure_scheduler():
+    """配置变更后调整调度器规模（已运行的作业不受影响）"""
+    with _scheduler_lock:
+        if _scheduler is not None:
+            jobs, threads = _compute_parallelism()
+            _scheduler.resize(jobs, threads)
+            print(f"  [Scheduler] Resized: {jobs} parallel jobs x {threads} threads")
+
+
+def _ffmpeg_thread_args():
+    """FFmpeg 全局线程参数：滤镜图线程数 = 当前作业分到的线程数"""
+    return ['-filter_complex_threads', str(get_scheduler().threads_per_job)]
+
+
+def _encoder_thread_args(n_outputs=1):
+    """编码器线程参数：多路输出时平分作业线程"""
+    return ['-threads', str(max(1, get_scheduler().threads_per_job // n_outputs))]
+
+
+def _video_encoder_args(profile, output_path, n_outputs=1):
+    """按编码档位生成视频编码参数（含线程数）
+
+    libx265 不读取 -threads，线程池大小经 x265-params pools 传入；
+    MP4 / MOV 中的 HEVC 打 hvc1 标签，Apple 系播放器才能识别。
+    合并了交付限制的档位（apply_delivery_target）另加 VBV 封顶（capped CRF）和帧率上限。
+    """
+    profile = profile or resolve_encoder_profile()
+    args = ['-c:v', profile['vcodec'], '-crf', str(profile['crf']), '-preset', str(profile['preset'])]
+    if profile.get('maxrateKbps'):
+        args += ['-maxrate', f"{profile['maxrateKbps']}k", '-bufsize', f"{profile['bufsizeKbps']}k"]
+    if profile.get('maxFps'):
+        args += ['-fpsmax', str(profile['maxFps'])]
+    if profile['vcodec'] == 'libx265':
+        threads = max(1, get_scheduler().threads_per_job // n_outputs)
+        args += ['-x265-params', f"pools={threads}:log-level=error"]
+        if Path(output_path).suffix.lower() in MP4_EXTENSIONS:
+            args += ['-tag:v', 'hvc1']
+    else:
+        args += _encoder_thread_args(n_outputs)
+    return args
+
+
+def _audio_encoder_args(profile=None):
+    """音频参数：默认直接复制；交付限制指定了音频码率时转为 AAC"""
+    if profile and profile.get('audioKbps'):
+        return ['-c:a', 'aac', '-b:a', f"{profile['audioKbps']}k"]
+    return ['-c:a', 'copy']
+
+
+def _is_within(path, directory):
+    """判断 path 是否位于 directory 之下"""
+    try:
+        Path(path).resolve().relative_to(Path(directory).resolve())
+        return True
+    except (ValueError, OSError):
+        return False
+
+
+def _reserve_output_path(directory, filename):
+    """原子地占用输出文件名：以 O_EXCL 创建占位文件，并发任务之间不会拿到同一路径
+    （FFmpeg 使用 -y 覆盖占位文件并沿用其权限，故按普通文件的 0o666 & ~umask 创建）"""
+    stem = Path(filename).stem
+    ext = Path(filename).suffix
+    output_path = directory / filename
+    counter = 1
+    while True:
+        try:
+            fd = os.open(str(output_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            os.close(fd)
+            return output_path
+        except FileExistsError:
+            output_path = directory / f"{stem}_{counter}{ext}"
+            counter += 1
+
+
+def _file_probe_info(file_info):
+    """优先使用 /upload 时已探测、随 files_info 传回的尺寸和时长，缺失时再查探测缓存"""
+    try:
+        w, h = int(file_info['width']), int(file_info['height'])
+        if w > 0 and h > 0:
+            return {'width': w, 'height': h, 'duration': float(file_info.get('duration') or 0),
+                    'codec': file_info.get('codec', ''), 'pix_fmt': file_info.get('pix_fmt', ''),
+                    'rotation': file_info.get('rotation', 0), 'fps': file_info.get('fps')}
+    except (KeyError, TypeError, ValueError):
+        pass
+    return get_video_info(file_info['path'])
+
+
+def _encode_outputs(input_path, outputs, info, on_progress=None, control=None, profile=None):
+    """编码一个源视频的多个输出，返回 [(output, 错误或 None)]
+
+    优先单次解码多路输出；失败时逐个比例单独处理，便于定位出错的比例。
+    """
+    try:
+        if control is not None and control.cancelled:
+            raise JobCancelled('已取消')
+        process_video_multi(input_path, outputs, info=info, on_progress=on_progress,
+                            control=control, profile=profile)
+        return [(o, None) for o in outputs]
+    except JobCancelled as e:
+        return [(o, e) for o in outputs]
+    except Exception as multi_error:
+        print(f"  [Multi] Falling back to per-ratio encode: {multi_error.__class__.__name__}")
+
+    done_outputs = []
+    for o in outputs:
+        try:
+            if control is not None and control.cancelled:
+                raise JobCancelled('已取消')
+            if o['template']:
+                process_video_with_template(
+                    input_path, o['template']['path'], o['template']['region'],
+                    o['output_path'], target_ratio=o['target_ratio'], info=info,
+                    on_progress=on_progress, control=control,
+                    content_hash=o['template'].get('content_hash'), profile=profile
+                )
+            else:
+                process_video(input_path, o['target_ratio'], o['output_path'], info=info,
+                              on_progress=on_progress, control=control, profile=profile)
+            done_outputs.append((o, None))
+        except Exception as e:
+            done_outputs.append((o, e))
+    return done_outputs
+
+
+def _should_segment(info):
+    """长源视频（不短于 segmentMinMinutes）才值得分段并行编码"""
+    minutes = float(get_processing_config().get('segmentMinMinutes') or 0)
+    return minutes > 0 and bool(info) and (info.get('duration') or 0) >= minutes * 60
+
+
+def _encode_segmented(task_id, job_id, input_path, outputs, info, on_progress=None, control=None,
+                      profile=None):
+    """分段并行编码：按关键帧切段 → 各段作为独立作业提交调度器并行编码 → concat 无损拼接
+
+    每段使用与整片编码完全相同的滤镜图和 CRF 参数（_encode_outputs），模糊 / 套版都是逐帧运算，
+    分段边界处没有状态差异；音频在拼接时从源文件整体复制一次。
+    返回值与 _encode_outputs 相同；切出的分段不足两段时直接整片编码。
+    """
+    cfg = get_processing_config()
+    control = control or JobControl()
+    work_dir = Path(tempfile.mkdtemp(prefix=f"{job_id}_", dir=SEGMENT_DIR))
+    try:
+        try:
+            segments = split_at_keyframes(input_path, work_dir, int(cfg.get('segmentSeconds') or 120),
+                                          control=control)
+        except JobCancelled as e:
+            return [(o, e) for o in outputs]
+        except Exception as e:
+            print(f"  [Segment] Split failed, encoding whole file: {e.__class__.__name__}")
+            segments = []
+        if len(segments) < 2:
+            return _encode_outputs(input_path, outputs, info, on_progress, control, profile)
+
+        seg_infos = []
+        for seg_path in segments:
+            seg_info = dict(info)
+            seg_info['duration'] = (_probe_video(seg_path) or {}).get('duration') or 0
+            seg_infos.append(seg_info)
+        total = sum(si['duration'] for si in seg_infos) or info.get('duration') or 0
+        print(f"  [Segment] {Path(input_path).name}: {len(segments)} segments, {len(outputs)} outputs")
+
+        # 汇总各分段进度：已完成秒数之和 / 总时长，速度为运行中分段之和
+        progress_lock = threading.Lock()
+        seg_done = [0.0] * len(segments)
+        seg_speed = {}
+
+        def segment_progress(index):
+            def callback(p):
+                with progress_lock:
+                    if p['out_time'] is not None:
+                        seg_done[index] = min(p['out_time'], seg_infos[index]['duration'] or p['out_time'])
+                    if p['percent'] == 100.0:
+                        seg_done[index] = seg_infos[index]['duration']
+                        seg_speed.pop(index, None)
+                    elif p['speed']:
+                        seg_speed[index] = (p['fps'] or 0, p['speed'])
+                    done = sum(seg_done)
+                    fps = sum(f for f, _ in seg_speed.values()) or None
+                    speed = sum(sp for _, sp in seg_speed.values()) or None
+                if on_progress is not None:
+                    on_progress({
+                        'percent': min(99.9, done / total * 100) if total else None,
+                        'fps': round(fps, 1) if fps else None,
+                        'speed': round(speed, 2) if speed else None,
+                        'out_time': done,
+                        'eta': max(0.0, (total - done) / speed) if speed and total else None,
+                    })
+            return callback
+
+        spec = progress_store.spec(task_id) or {}
+        scheduler = get_scheduler()
+        seg_outputs = []
+        futures = []
+        for index, (seg_path, seg_info) in enumerate(zip(segments, seg_infos)):
+            per_segment = [dict(o, output_path=work_dir / f"enc_{index:04d}_{n}.mp4")
+                           for n, o in enumerate(outputs)]
+            seg_outputs.append(per_segment)
+            futures.append(scheduler.submit(
+                _encode_outputs, seg_path, per_segment, seg_info, segment_progress(index),
+                control.spawn(), profile,
+                tags=(task_id, _job_tag(task_id, job_id)), group=task_id,
+                client=spec.get('client', ''), priority=spec.get('priority', 0),
+                cost=seg_info['duration'] * len(outputs),
+            ))
+
+        # 等待分段期间本作业不占 CPU，借出工作线程给分段作业，避免线程池被等待者占满而死锁
+        errors = {}
+        scheduler.lend_slot()
+        try:
+            for future in futures:
+                try:
+                    for n, (_, error) in enumerate(future.result()):
+                        if error is not None:
+                            errors.setdefault(n, error)
+                except CancelledError:
+                    for n in range(len(outputs)):
+                        errors.setdefault(n, JobCancelled('已取消'))
+                except Exception as e:
+                    for n in range(len(outputs)):
+                        errors.setdefault(n, e)
+        finally:
+            scheduler.return_slot()
+
+        done_outputs = []
+        for n, o in enumerate(outputs):
+            error = errors.get(n)
+            if error is None:
+                try:
+                    concat_segments([seg[n]['output_path'] for seg in seg_outputs], input_path,
+                                    o['output_path'], duration=info.get('duration') or 0,
+                                    control=control, audio_args=_audio_encoder_args(profile))
+                except Exception as e:
+                    error = e
+            done_outputs.append((o, error))
+        return done_outputs
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _process_file_job(task_id, file_info, actual_output_dir, templates, control=None,
+                      profile=None, platform=None):
+    """工作线程：处理单个源视频的全部目标比例，并把结果写回 progress_store
+    control: 该作业的 JobControl，用于取消 / 暂停正在运行的 FFmpeg
+    profile: 编码档位（resolve_encoder_profile 的结果）
+    platform: 投放平台代码或 'auto'（按文件名识别），据此在档位上叠加交付限制
+    """
+    control = control or JobControl()
+    input_path = Path(file_info['path'])
+    original_name = file_info['original_name']
+    info = _file_probe_info(file_info)
+    profile = apply_delivery_target(profile or resolve_encoder_profile(),
+                                    resolve_platform(platform, original_name),
+                                    (info or {}).get('duration') or 0)
+
+    outputs = []
+    for target_ratio in file_info['targets']:
+        output_name = generate_output_filename(original_name, target_ratio)
+        output_path = _reserve_output_path(actual_output_dir, output_name)
+
+        # 判断是否有对应比例的套版
+        tpl = templates.get(target_ratio)
+        if not (tpl and tpl.get('path') and tpl.get('region')):
+            tpl = None
+        mode_label = "套版" if tpl else "模糊"
+        print(f"  [{mode_label}] {original_name} -> {target_ratio}, tpl={'YES path=' + tpl['path'] if tpl else 'NO'}")
+        outputs.append({
+            'target_ratio': target_ratio,
+            'output_path': output_path,
+            'template': tpl,
+        })
+
+    if not outputs:
+        return
+
+    current = f"{original_name} → {'/'.join(RATIO_LABELS[o['target_ratio']] for o in outputs)}"
+    job_id = file_info['file_id']
+    job_state = {'label': current, 'outputs': len(outputs), 'percent': 0.0,
+                 'fps': None, 'speed': None, 'eta': None, 'paused': control.paused}
+    with _progress_lock:
+        progress_store[task_id]['current_file'] = current
+        progress_store[task_id]['running'].append(current)
+        progress_store[task_id]['jobs'][job_id] = job_state
+        progress_bus.publish(task_id, 'job_started', job=job_id,
+                             files=[o['output_path'].name for o in outputs], **job_state)
+
+    def on_progress(p):
+        with _progress_lock:
+            job_state.update(fps=p['fps'], speed=p['speed'],
+                             eta=round(p['eta'], 1) if p['eta'] is not None else None)
+            if p['percent'] is not None:
+                job_state['percent'] = round(p['percent'], 1)
+            progress_bus.publish(task_id, 'job_progress', job=job_id, **job_state)
+
+    # 直通：源视频已经是目标画布时只做封装复制，不重新编码
+    done_outputs = []
+    for o in outputs:
+        if not can_passthrough(info, o['target_ratio'], o['template'], profile):
+            continue
+        try:
+            if control.cancelled:
+                raise JobCancelled('已取消')
+            passthrough_video(input_path, o['output_path'], info=info,
+                              on_progress=on_progress, control=control)
+            o['method'] = 'passthrough'
+            done_outputs.append((o, None))
+        except JobCancelled as e:
+            o['method'] = 'passthrough'
+            done_outputs.append((o, e))
+        except Exception as e:
+            print(f"  [Passthrough] {original_name}: remux failed, re-encoding ({e.__class__.__name__})")
+
+    # 输出缓存：相同源 + 比例 + 套版 + 编码参数的结果直接硬链接 / 拷贝，不再编码
+    pending = [o for o in outputs if 'method' not in o]
+    if output_cache_enabled() and pending:
+        try:
+            source_hash = file_info.get('sha256') or cached_file_sha256(input_path)
+        except OSError:
+            source_hash = None
+        for o in pending if source_hash else []:
+            o['cache_key'] = output_cache_key(source_hash, o['target_ratio'], o['template'], profile)
+            if fetch_cached_output(o['cache_key'], o['output_path']):
+                o['method'] = 'cache'
+                done_outputs.append((o, None))
+    to_encode = [o for o in pending if 'method' not in o]
+    if to_encode:
+        print(f"  [Cache] {original_name}: {len(pending) - len(to_encode)} hit(s), {len(to_encode)} to encode")
+        if _should_segment(info):
+            encoded = _encode_segmented(task_id, job_id, input_path, to_encode, info,
+                                        on_progress, control, profile)
+        else:
+            encoded = _encode_outputs(input_path, to_encode, info, on_progress, control, profile)
+        for o, error in encoded:
+            if error is None:
+                o['method'] = 'encode'
+                if o.get('cache_key'):
+                    store_cached_output(o['cache_key'], o['output_path'])
+        done_outputs += encoded
+
+    with _progress_lock:
+        state = progress_store[task_id]
+        for o, error in done_outputs:
+            target_ratio = o['target_ratio']
+            if error is None:
+                try:
+                    size = o['output_path'].stat().st_size
+                except OSError:
+                    size = None
+                result = {
+                    'filename': o['output_path'].name,
+                    'ratio': target_ratio,
+                    'label': RATIO_LABELS[target_ratio],
+                    'method': o['method'],
+                    'size': size,
+                    'platform': profile.get('platform'),
+                    'max_size': profile.get('maxSizeBytes'),
+                }
+                if size and profile.get('maxSizeBytes') and size > profile['maxSizeBytes']:
+                    print(f"  [Delivery] {result['filename']}: {size / 1024 ** 2:.1f}MB exceeds "
+                          f"{profile['platform']} limit {profile['maxSizeBytes'] / 1024 ** 2:.0f}MB")
+                state['results'].append(result)
+                state['completed'] += 1
+                progress_bus.publish(task_id, 'result', job=job_id, result=result,
+                                     completed=state['completed'])
+            else:
+                # 清理失败输出留下的占位文件 / 半成品
+                try:
+                    o['output_path'].unlink(missing_ok=True)
+                except OSError:
+                    pass
+                error_entry = {
+                    'filename': original_name,
+                    'target': target_ratio,
+                    'error': str(error)
+                }
+                state['errors'].append(error_entry)
+                state['completed'] += 1
+                progress_bus.publish(task_id, 'error', job=job_id, error=error_entry,
+                                     completed=state['completed'])
+        if current in state['running']:
+            state['running'].remove(current)
+        state['jobs'].pop(job_id, None)
+        state['current_file'] = state['running'][-1] if state['running'] else ''
+        progress_bus.publish(task_id, 'job_finished', job=job_id, label=current,
+                             current_file=state['current_file'])
+
+
+class TaskControl:
+    """任务级控制：各作业的 JobControl 以及任务的取消 / 暂停状态"""
+
+    def __init__(self):
+        self.cancelled = False
+        self.paused = False
+        self.jobs = {}  # file_id -> JobControl
+
+
+# 运行中任务的控制句柄（读写时持有 _progress_lock）
+_task_controls = {}
+
+
+def _job_tag(task_id, job_id):
+    return f"{task_id}/{job_id}"
+
+
+def _set_job_paused(task_id, job_id, paused):
+    state = progress_store[task_id]
+    if job_id in state['jobs']:
+        state['jobs'][job_id]['paused'] = paused
+    progress_bus.publish(task_id, 'job_paused' if paused else 'job_resumed', job=job_id)
+
+
+def control_task(task_id, action):
+    """取消 / 暂停 / 继续整个任务，返回 (是否生效, 错误信息)
+
+    暂停：排队中的作业不再出队，运行中的 FFmpeg 被挂起并让出工作线程；
+    取消：排队作业直接撤销，运行中的 FFmpeg 被结束，半成品输出由作业自行删除。
+    """
+    scheduler = get_scheduler()
+    with _progress_lock:
+        control = _task_controls.get(task_id)
+        if control is None:
+            return False, '任务不存在或已结束'
+        if action == 'cancel':
+            control.cancelled = True
+            control.paused = False
+            scheduler.cancel_tagged(task_id)
+            scheduler.release(task_id)
+            for job in control.jobs.values():
+                job.cancel()
+            progress_bus.publish(task_id, 'task_cancelling')
+        elif action == 'pause':
+            if control.paused or control.cancelled:
+                return False, '任务已暂停或已取消'
+            control.paused = True
+            scheduler.hold(task_id)
+            for job_id, job in control.jobs.items():
+                if job.pause():
+                    _set_job_paused(task_id, job_id, True)
+            progress_store[task_id]['status'] = 'paused'
+            progress_bus.publish(task_id, 'task_paused')
+        elif action == 'resume':
+            if not control.paused:
+                return False, '任务未暂停'
+            control.paused = False
+            for job_id, job in control.jobs.items():
+                scheduler.release(_job_tag(task_id, job_id))
+                if job.resume():
+                    _set_job_paused(task_id, job_id, False)
+            scheduler.release(task_id)
+            progress_store[task_id]['status'] = 'processing'
+            progress_bus.publish(task_id, 'task_resumed')
+        else:
+            return False, f'未知操作: {action}'
+    print(f"  [Tasks] {action} task {task_id}")
+    return True, ''
+
+
+def control_job(task_id, job_id, action):
+    """取消 / 暂停 / 继续任务中的单个作业（一个源视频的全部目标比例）"""
+    scheduler = get_scheduler()
+    tag = _job_tag(task_id, job_id)
+    with _progress_lock:
+        control = _task_controls.get(task_id)
+        job = control.jobs.get(job_id) if control else None
+        if job is None:
+            return False, '作业不存在或已结束'
+        if action == 'cancel':
+            scheduler.cancel_tagged(tag)
+            scheduler.release(tag)
+            job.cancel()
+        elif action == 'pause':
+            scheduler.hold(tag)
+            if not job.pause():
+                return False, '作业已暂停或已取消'
+            _set_job_paused(task_id, job_id, True)
+        elif action == 'resume':
+            scheduler.release(tag)
+            if not job.resume():
+                return False, '作业未暂停'
+            _set_job_paused(task_id, job_id, False)
+        else:
+            return False, f'未知操作: {action}'
+    print(f"  [Tasks] {action} job {job_id} of task {task_id}")
+    return True, ''
+
+
+def process_task(task_id, files_info, output_dir=None, templates=None, skip_jobs=None,
+                 priority=0, client='', profile=None, platform=None):
     """后台任务：处理所有上传的视频（支持套版合成）
     templates: dict, 格式 {"9:16": {"path": "...", "region": {...}}, ...}
+    skip_jobs: 重启后恢复任务时传入已完成作业的 file_id 集合，任务状态沿用 progress_store 中恢复的记录
+    priority / client: 任务优先级与提交方，决定作业在全局队列中的出队顺序
+    profile: 编码档位名称（见 get_encoder_profiles），为空时用配置的默认档位
+    platform: 投放平台（FB / GG / TT，见 get_delivery_targets）或 'auto'（按文件名识别），为空时不限制
+
+    每个源视频作为一个作业提交到全局调度器，由工作线程池并行执行。
     """
+    import time
     if templates is None:
         templates = {}
 
-    actual_output_dir = Path(output_dir) if output_dir else OUTPUT_DIR
-    actual_output_dir.mkdir(parents=True, exist_ok=True)
-
-    total_jobs = sum(len(f['targets']) for f in files_info)
-    completed = 0
-    progress_store[task_id] = {
-        'status': 'processing',
-        'total': total_jobs,
-        'completed': 0,
-        'current_file': '',
-        'results': [],
-        'errors': [],
-        'output_dir': str(actual_output_dir)
-    }
+    actual_output_dir = Path(output_dir) if output_dir else OUTPUT_DIR
+    actual_output_dir.mkdir(parents=True, exist_ok=True)
 
     for file_info in files_info:
-        input_path = Path(file_info['path'])
-        original_name = file_info['original_name']
-
-        for target_ratio in file_info['targets']:
-            output_name = generate_output_filename(original_name, target_ratio)
-            output_path = actual_output_dir / output_name
-
-            counter = 1
-            while output_path.exists():
-                stem = Path(output_name).stem
-                ext = Path(output_name).suffix
-                output_path = actual_output_dir / f"{stem}_{counter}{ext}"
-                counter += 1
-
-            # 判断是否有对应比例的套版
-            tpl = templates.get(target_ratio)
-            mode_label = "套版" if tpl else "模糊"
-            print(f"  [{mode_label}] {original_name} -> {target_ratio}, tpl={'YES path=' + tpl['path'] if tpl else 'NO'}")
-            progress_store[task_id]['current_file'] = (
-                f"{original_name} → {RATIO_LABELS[target_ratio]}（{mode_label}）"
-            )
-
-            try:
-                if tpl and tpl.get('path') and tpl.get('region'):
-                    # 使用套版合成
-                    process_video_with_template(
-                        input_path, tpl['path'], tpl['region'], output_path,
-                        target_ratio=target_ratio
-                    )
-                else:
-                    # 使用模糊背景
-                    process_video(input_path, target_ratio, output_path)
+        file_info.setdefault('file_id', uuid.uuid4().hex)
 
-                progress_store[task_id]['results'].append({
-                    'filename': output_path.name,
-                    'ratio': target_ratio,
-                    'label': RATIO_LABELS[target_ratio]
-                })
-            except Exception as e:
-                progress_store[task_id]['errors'].append({
-                    'filename': original_name,
-                    'target': target_ratio,
+    encoder_profile = resolve_encoder_profile(profile)
+    total_jobs = sum(len(f['targets']) for f in files_info)
+    with _progress_lock:
+        if skip_jobs is None:
+            progress_store.create(task_id, {
+                'status': 'processing',
+                'total': total_jobs,
+                'completed': 0,
+                'current_file': '',
+                'running': [],
+                'jobs': {},
+                'results': [],
+                'errors': [],
+                'output_dir': str(actual_output_dir),
+                'profile': encoder_profile['name'],
+                'platform': platform,
+            }, spec={
+                'files': files_info,
+                'templates': templates,
+                'output_dir': str(actual_output_dir),
+                'priority': priority,
+                'client': client,
+                'profile': encoder_profile['name'],
+                'platform': platform,
+            })
+        else:
+            progress_store[task_id]['status'] = 'processing'
+        progress_bus.publish(task_id, 'task_started', total=total_jobs,
+                             output_dir=str(actual_output_dir))
+
+    pending_files = [f for f in files_info if not skip_jobs or f['file_id'] not in skip_jobs]
+    task_control = TaskControl()
+    with _progress_lock:
+        _task_controls[task_id] = task_control
+        for file_info in pending_files:
+            task_control.jobs[file_info['file_id']] = JobControl()
+    scheduler = get_scheduler()
+    futures = [
+        scheduler.submit(_process_file_job, task_id, file_info, actual_output_dir, templates,
+                         task_control.jobs[file_info['file_id']], encoder_profile, platform,
+                         tags=(task_id, _job_tag(task_id, file_info['file_id'])),
+                         group=task_id, client=client, priority=priority,
+                         cost=float(file_info.get('duration') or 0) * len(file_info['targets']))
+        for file_info in pending_files
+    ]
+    for future, file_info in zip(futures, pending_files):
+        try:
+            future.result()
+        except CancelledError:
+            # 排队中被取消，作业从未启动，也没有输出文件
+            with _progress_lock:
+                state = progress_store[task_id]
+                for target_ratio in file_info['targets']:
+                    error_entry = {
+                        'filename': file_info['original_name'],
+                        'target': target_ratio,
+                        'error': '已取消'
+                    }
+                    state['errors'].append(error_entry)
+                    state['completed'] += 1
+                    progress_bus.publish(task_id, 'error', job=file_info['file_id'],
+                                         error=error_entry, completed=state['completed'])
+                progress_bus.publish(task_id, 'job_finished', job=file_info['file_id'],
+                                     label=file_info['original_name'],
+                                     current_file=state['current_file'])
+        except Exception as e:
+            # 作业在生成输出前就失败（例如无法创建输出文件）
+            with _progress_lock:
+                error_entry = {
+                    'filename': file_info['original_name'],
+                    'target': '',
                     'error': str(e)
-                })
-
-            completed += 1
-            progress_store[task_id]['completed'] = completed
-
-    # 清理上传的临时视频文件
+                }
+                progress_store[task_id]['errors'].append(error_entry)
+                progress_bus.publish(task_id, 'error', error=error_entry,
+                                     completed=progress_store[task_id]['completed'])
+                progress_bus.publish(task_id, 'job_finished', job=file_info['file_id'],
+                                     label=file_info['original_name'],
+                                     current_file=progress_store[task_id]['current_file'])
+
+    # 清理上传的临时视频文件（本地导入的源文件不在 uploads/ 下，原样保留）
     for file_info in files_info:
+        if not _is_within(file_info['path'], UPLOAD_DIR):
+            continue
         try:
             os.remove(file_info['path'])
         except OSError:
@@ -664,8 +3145,37 @@ def process_task(task_id, files_info, output_dir=None, templates=None):
         except OSError:
             pass
 
-    progress_store[task_id]['status'] = 'done'
-    progress_store[task_id]['current_file'] = ''
+    with _progress_lock:
+        _task_controls.pop(task_id, None)
+        status = 'cancelled' if task_control.cancelled else 'done'
+        progress_store[task_id]['status'] = status
+        progress_store[task_id]['current_file'] = ''
+        progress_store[task_id]['completed'] = total_jobs
+        progress_store[task_id]['finished_at'] = time.time()
+        progress_bus.publish(task_id, 'task_done', status=status, completed=total_jobs)
+
+
+def resume_interrupted_tasks():
+    """启动时重放任务日志：清理中断作业的半成品输出，并在后台继续未完成的作业"""
+    with _progress_lock:
+        interrupted = progress_store.restore()
+    for task_id, finished_jobs, unfinished in interrupted:
+        spec = progress_store.spec(task_id)
+        output_dir = Path(spec['output_dir'])
+        for names in unfinished.values():
+            for name in names:
+                (output_dir / name).unlink(missing_ok=True)
+        remaining = sum(1 for f in spec['files'] if f['file_id'] not in finished_jobs)
+        print(f"  [Tasks] Resuming task {task_id}: {remaining} unfinished job(s)")
+        thread = threading.Thread(
+            target=process_task,
+            args=(task_id, spec['files'], spec['output_dir']),
+            kwargs={'templates': spec['templates'], 'skip_jobs': finished_jobs,
+                    'priority': spec.get('priority', 0), 'client': spec.get('client', ''),
+                    'profile': spec.get('profile'), 'platform': spec.get('platform')}
+        )
+        thread.daemon = True
+        thread.start()
 
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -800,6 +3310,253 @@ def parse_filename_local(filename):
     return result
 
 
+# ━━━ 零拷贝导出：rename → hardlink → reflink / copy_file_range → 缓冲拷贝 ━━━
+_FICLONE = 0x40049409  # Linux ioctl：Btrfs / XFS / bcachefs 等的写时复制克隆
+
+
+def _copy_file_fast(src, dst):
+    """把 src 的内容复制到 dst，优先使用内核侧的零拷贝方式，返回实际使用的方式"""
+    if sys.platform.startswith('linux'):
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                import fcntl
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                method = 'reflink'
+            except (OSError, ImportError):
+                method = None
+            if method is None and hasattr(os, 'copy_file_range'):
+                try:
+                    remaining = os.fstat(fsrc.fileno()).st_size
+                    while remaining > 0:
+                        copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                        if copied == 0:
+                            break
+                        remaining -= copied
+                    if remaining == 0:
+                        method = 'copy_file_range'
+                    else:
+                        fdst.seek(0)
+                        fdst.truncate()
+                except OSError:
+                    fdst.seek(0)
+                    fdst.truncate()
+        if method:
+            shutil.copystat(src, dst)
+            return method
+
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+def _link_or_copy(src, dst):
+    """让 dst 与 src 内容相同且保留 src：优先硬链接，跨文件系统时退回零拷贝复制
+
+    先链接到临时名再替换，dst 上的占位文件不会让 os.link 失败。
+    """
+    tmp_link = dst.with_name(f".{dst.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        os.link(src, tmp_link)
+        os.replace(tmp_link, dst)
+        return 'hardlink'
+    except (OSError, AttributeError, NotImplementedError):
+        tmp_link.unlink(missing_ok=True)
+        return _copy_file_fast(src, dst)
+
+
+def move_file_fast(src, dst):
+    """把 src 移动到 dst，按代价从低到高依次尝试，返回实际使用的方式：
+      rename          — 同一文件系统内 os.replace，只改目录项
+      hardlink        — 新建硬链接后删除源文件
+      reflink         — 写时复制克隆（不复制数据块）
+      copy_file_range — 内核内拷贝（不经过用户态缓冲区）
+      copy            — 普通缓冲拷贝（shutil.copy2）
+    dst 已存在（例如占位文件）时会被覆盖。
+    """
+    src, dst = Path(src), Path(dst)
+    try:
+        os.replace(src, dst)
+        return 'rename'
+    except OSError:
+        pass
+
+    method = _link_or_copy(src, dst)
+    try:
+        src.unlink()
+    except OSError:
+        pass
+    return method
+
+
+# ━━━ 原地批量重命名：两阶段改名 + 撤销日志 ━━━
+class RenameError(Exception):
+    """批量改名失败（已回滚）"""
+
+
+def probe_media_info(path):
+    """按扩展名探测素材宽高：视频走 get_video_info，图片走 get_image_info"""
+    ext = Path(path).suffix.lower()
+    if ext in VIDEO_EXTENSIONS:
+        return get_video_info(path)
+    if ext in IMAGE_EXTENSIONS:
+        return get_image_info(path)
+    return None
+
+
+def _is_bare_filename(name):
+    return bool(name) and name not in ('.', '..') and Path(name).name == name and '/' not in name and '\\' not in name
+
+
+def plan_batch_rename(items, target_dir=None):
+    """规划一批改名：items 为 [(源路径, 新文件名)]，返回 [(src, dst)]
+
+    target_dir 为空时在原目录改名，否则移动到 target_dir。
+    目标被占用时追加 _1、_2…；被本批其他文件"让出"的名字视为可用（支持互换文件名）。
+    与源路径相同的条目会被跳过。
+    """
+    def key(p):
+        return os.path.normcase(str(p))
+
+    pairs = []
+    for src, new_name in items:
+        src = Path(src)
+        if not _is_bare_filename(new_name):
+            raise RenameError(f'非法文件名: {new_name}')
+        if not src.is_file():
+            raise RenameError(f'源文件不存在: {src}')
+        dst_dir = Path(target_dir) if target_dir else src.parent
+        pairs.append((src, dst_dir / new_name))
+
+    moving = {key(src) for src, dst in pairs if key(src) != key(dst)}
+    claimed = set()
+    planned = []
+    for src, dst in pairs:
+        if key(src) == key(dst) and src.name == dst.name:
+            continue
+        stem, suffix = dst.stem, dst.suffix
+        candidate, counter = dst, 0
+        while True:
+            k = key(candidate)
+            taken = k in claimed or (os.path.lexists(candidate) and k not in moving and k != key(src))
+            if not taken:
+                break
+            counter += 1
+            candidate = dst.with_name(f"{stem}_{counter}{suffix}")
+        claimed.add(key(candidate))
+        planned.append((src, candidate))
+    return planned
+
+
+def execute_batch_rename(pairs):
+    """原子执行一批改名，全部成功或全部回滚
+
+    第一阶段把每个源文件改为目标目录下的临时名，第二阶段再改为最终名，
+    因此 A→B、B→A 这类互换也不会互相覆盖。任一步失败即逆序撤回已完成的步骤并抛出 RenameError。
+    只使用 os.rename，跨文件系统的移动会在第一阶段失败并回滚。
+    """
+    token = uuid.uuid4().hex[:8]
+    staged = []    # (src, tmp, dst) 已完成第一阶段
+    finished = []  # (tmp, dst) 已完成第二阶段
+    try:
+        for i, (src, dst) in enumerate(pairs):
+            tmp = dst.with_name(f".rename-{token}-{i}{dst.suffix}")
+            os.rename(src, tmp)
+            staged.append((src, tmp, dst))
+        for src, tmp, dst in staged:
+            if os.path.lexists(dst):
+                raise FileExistsError(f'目标已存在: {dst}')
+            os.rename(tmp, dst)
+            finished.append((tmp, dst))
+    except OSError as e:
+        rollback_errors = []
+        for tmp, dst in reversed(finished):
+            try:
+                os.rename(dst, tmp)
+            except OSError as re_err:
+                rollback_errors.append(str(re_err))
+        for src, tmp, _ in reversed(staged):
+            try:
+                os.rename(tmp, src)
+            except OSError as re_err:
+                rollback_errors.append(str(re_err))
+        msg = f'改名失败，已回滚: {e}'
+        if rollback_errors:
+            msg += '；回滚时出错: ' + '; '.join(rollback_errors)
+        raise RenameError(msg) from e
+
+
+def _journal_path(journal_id):
+    return RENAME_JOURNAL_DIR / f"{journal_id}.json"
+
+
+def _write_journal(journal):
+    path = _journal_path(journal['id'])
+    tmp_path = path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps(journal, ensure_ascii=False, indent=2), encoding='utf-8')
+    os.replace(tmp_path, path)
+
+
+def load_rename_journal(journal_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', journal_id or ''):
+        return None
+    try:
+        return json.loads(_journal_path(journal_id).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def list_rename_journals(limit=20):
+    """最近的改名日志（新的在前）"""
+    journals = []
+    for path in RENAME_JOURNAL_DIR.glob('*.json'):
+        try:
+            j = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            continue
+        journals.append({'id': j['id'], 'created': j['created'], 'status': j['status'],
+                         'count': len(j['entries'])})
+    journals.sort(key=lambda j: j['created'], reverse=True)
+    return journals[:limit]
+
+
+def batch_rename_with_journal(pairs):
+    """执行批量改名并写撤销日志，返回日志 dict
+
+    日志先以 pending 状态落盘再动文件，进程中途退出时仍能据此人工恢复。
+    """
+    import time
+    journal = {
+        'id': uuid.uuid4().hex,
+        'created': time.time(),
+        'status': 'pending',
+        'entries': [{'from': str(src), 'to': str(dst)} for src, dst in pairs],
+    }
+    _write_journal(journal)
+    try:
+        execute_batch_rename(pairs)
+    except RenameError:
+        journal['status'] = 'rolled_back'
+        _write_journal(journal)
+        raise
+    journal['status'] = 'done'
+    _write_journal(journal)
+    return journal
+
+
+def undo_rename_journal(journal):
+    """按日志把文件改回原名（同样是原子批次）"""
+    if journal['status'] != 'done':
+        raise RenameError(f"该批次状态为 {journal['status']}，无法撤销")
+    pairs = [(Path(e['to']), Path(e['from'])) for e in reversed(journal['entries'])]
+    for current, original in pairs:
+        if not current.is_file():
+            raise RenameError(f'文件已被移动或删除: {current}')
+        if os.path.lexists(original) and not any(str(original) == str(c) for c, _ in pairs):
+            raise RenameError(f'原文件名已被占用: {original}')
+    execute_batch_rename(pairs)
+    journal['status'] = 'undone'
+    _write_journal(journal)
+
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 视频编辑 - 导出最后一帧
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -873,6 +3630,119 @@ def _copy_image_to_clipboard_win(image_path):
         return False
 
 
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 流式上传：增量解析 multipart，直接写入最终路径并同步计算哈希
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 已上传文件的内容索引：sha256 -> {file_id, path, original_name}，用于识别重复上传
+_upload_hash_index = {}
+_upload_hash_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """上传请求格式错误"""
+
+
+def stream_multipart_upload(dest_dir, file_field, allowed_exts=None, name_prefix=''):
+    """增量解析当前请求的 multipart body（不经过 Werkzeug 的临时文件）
+
+    file_field 字段中的文件直接写入 dest_dir/{name_prefix}{uuid}{ext}，写入时计算 SHA-256；
+    扩展名不在 allowed_exts 中的文件直接丢弃。其余文本字段收集到 form。
+    返回 (files, form, seen_field)：
+      files: [{file_id, filename, path(Path), sha256, size}]
+      seen_field: 请求中是否出现过 file_field 字段（用于区分"没有选择文件"）
+    """
+    boundary = request.mimetype_params.get('boundary', '').encode('latin-1')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        raise UploadError('没有选择文件')
+
+    decoder = MultipartDecoder(boundary)
+    stream = request.stream
+    files, form = [], {}
+    seen_field = False
+    current = None       # 正在写入的文件 {'fh', 'digest', ...}
+    field_name = None    # 正在接收的文本字段名
+    field_buf = b''
+
+    def finish_part():
+        nonlocal current, field_name, field_buf
+        if current is not None:
+            current['fh'].close()
+            files.append({
+                'file_id': current['file_id'],
+                'filename': current['filename'],
+                'path': current['path'],
+                'sha256': current['digest'].hexdigest(),
+                'size': current['size'],
+            })
+            current = None
+        if field_name is not None:
+            form[field_name] = field_buf.decode('utf-8', 'replace')
+            field_name, field_buf = None, b''
+
+    try:
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                decoder.receive_data(chunk or None)
+            elif isinstance(event, File):
+                finish_part()
+                if event.name != file_field:
+                    continue
+                seen_field = True
+                ext = Path(event.filename or '').suffix.lower()
+                if not event.filename or (allowed_exts is not None and ext not in allowed_exts):
+                    continue
+                file_id = str(uuid.uuid4())
+                path = Path(dest_dir) / f"{name_prefix}{file_id}{ext}"
+                current = {
+                    'file_id': file_id, 'filename': event.filename, 'path': path,
+                    'fh': open(path, 'wb'), 'digest': hashlib.sha256(), 'size': 0,
+                }
+            elif isinstance(event, Field):
+                finish_part()
+                field_name = event.name
+            elif isinstance(event, Data):
+                if current is not None:
+                    current['fh'].write(event.data)
+                    current['digest'].update(event.data)
+                    current['size'] += len(event.data)
+                elif field_name is not None:
+                    field_buf += event.data
+                if not event.more_data:
+                    finish_part()
+            elif isinstance(event, Epilogue):
+                finish_part()
+                break
+    except Exception as e:
+        # 中途失败：删除已写入的文件，避免残留半截上传
+        if current is not None:
+            current['fh'].close()
+            current['path'].unlink(missing_ok=True)
+        for saved in files:
+            saved['path'].unlink(missing_ok=True)
+        if isinstance(e, ValueError):
+            # 请求体被截断 / 上传中断时 MultipartDecoder 抛 ValueError，按格式错误返回
+            raise UploadError('上传数据不完整，请重试') from e
+        raise
+
+    return files, form, seen_field
+
+
+def register_upload_hash(sha256, file_id, path, original_name):
+    """登记上传文件的内容哈希；若相同内容的文件仍在磁盘上，返回先前那条记录"""
+    with _upload_hash_lock:
+        previous = _upload_hash_index.get(sha256)
+        if previous and previous['file_id'] != file_id and Path(previous['path']).exists():
+            return previous
+        _upload_hash_index[sha256] = {
+            'file_id': file_id, 'path': str(path), 'original_name': original_name,
+        }
+        return None
+
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # Flask 路由 - 比例转换工具
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -896,92 +3766,279 @@ def settings_redirect():
     return render_template('index.html', active_tab='settings')
 
 
+def _video_file_entry(file_id, original_name, path, info, sha256='', duplicate_of=''):
+    """根据探测结果生成前端文件列表条目（/upload、分块上传、本地导入共用）"""
+    ratio = classify_ratio(info['width'], info['height'])
+    targets = get_target_ratios(ratio)
+    return {
+        'file_id': file_id,
+        'original_name': original_name,
+        'path': str(path),
+        'sha256': sha256,
+        'duplicate_of': duplicate_of,
+        'width': info['width'],
+        'height': info['height'],
+        'duration': info.get('duration', 0),
+        'codec': info.get('codec', ''),
+        'pix_fmt': info.get('pix_fmt', ''),
+        'rotation': info.get('rotation', 0),
+        'fps': info.get('fps'),
+        'ratio': ratio,
+        'ratio_label': RATIO_LABELS[ratio],
+        'targets': targets,
+        'target_labels': [RATIO_LABELS[t] for t in targets]
+    }
+
+
+def _video_upload_entry(file_id, original_name, save_path, sha256):
+    """探测已落盘的上传视频并生成文件条目；无法读取时删除文件并返回 None"""
+    info = get_video_info(save_path, content_hash=sha256)
+    if info is None:
+        os.remove(save_path)
+        return None
+
+    duplicate = register_upload_hash(sha256, file_id, save_path, original_name)
+    return _video_file_entry(file_id, original_name, save_path, info, sha256=sha256,
+                             duplicate_of=duplicate['original_name'] if duplicate else '')
+
+
 @app.route('/upload', methods=['POST'])
 def upload():
-    """处理视频文件上传，返回文件信息和检测到的比例"""
-    if 'files' not in request.files:
+    """处理视频文件上传，返回文件信息和检测到的比例（流式写盘，边写边算 SHA-256）"""
+    try:
+        saved_files, _, seen_field = stream_multipart_upload(UPLOAD_DIR, 'files', VIDEO_EXTENSIONS)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    if not seen_field:
         return jsonify({'error': '没有选择文件'}), 400
 
     uploaded = []
-    files = request.files.getlist('files')
+    for saved in saved_files:
+        entry = _video_upload_entry(saved['file_id'], saved['filename'], saved['path'], saved['sha256'])
+        if entry:
+            uploaded.append(entry)
 
-    for f in files:
-        if not f.filename:
-            continue
-        ext = Path(f.filename).suffix.lower()
-        if ext not in VIDEO_EXTENSIONS:
-            continue
+    return jsonify({'files': uploaded})
 
-        file_id = str(uuid.uuid4())
-        safe_name = f"{file_id}{ext}"
-        save_path = UPLOAD_DIR / safe_name
-        f.save(str(save_path))
 
-        info = get_video_info(save_path)
-        if info is None:
-            os.remove(save_path)
-            continue
+# ━━━ 分块断点续传：init → PUT chunk（可并发、可重试）→ finalize ━━━
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+UPLOAD_SESSION_TTL_SECONDS = 24 * 3600  # 超过该时长没有新分块的会话视为放弃，删除其 .part 文件
 
-        ratio = classify_ratio(info['width'], info['height'])
-        targets = get_target_ratios(ratio)
+# upload_id -> 会话 {filename, size, chunk_size, total_chunks, received(set), part_path, key, last_active,
+#                   digest, hashed, hash_lock}：digest 为已计入的连续分块前缀（前 hashed 块）的 SHA-256
+# 会话只在内存中，进程重启后无法续传，遗留的 .part 文件在启动时清理（cleanup_orphan_uploads）
+_chunk_sessions = {}
+_chunk_sessions_lock = threading.Lock()
 
-        uploaded.append({
-            'file_id': file_id,
-            'original_name': f.filename,
-            'path': str(save_path),
-            'width': info['width'],
-            'height': info['height'],
-            'ratio': ratio,
-            'ratio_label': RATIO_LABELS[ratio],
-            'targets': targets,
-            'target_labels': [RATIO_LABELS[t] for t in targets]
-        })
 
-    return jsonify({'files': uploaded})
+def _sweep_chunk_sessions():
+    """删除闲置超时的分块上传会话及其 .part 文件（调用方持有 _chunk_sessions_lock）"""
+    import time
+    deadline = time.time() - UPLOAD_SESSION_TTL_SECONDS
+    for upload_id in [u for u, sess in _chunk_sessions.items() if sess['last_active'] < deadline]:
+        session = _chunk_sessions.pop(upload_id)
+        session['part_path'].unlink(missing_ok=True)
+        print(f"  [Upload] Expired idle chunked upload {upload_id} ({session['filename']})")
+
+
+def _advance_chunk_hash(session, index=None, data=None):
+    """把已到达的连续分块前缀依次计入 SHA-256，finalize 时无需整文件重读
+
+    刚收到的分块直接用内存中的 data；乱序先到的分块等前面补齐后从 .part 回读（通常仍在页缓存中）。
+    """
+    with session['hash_lock']:
+        while session['hashed'] in session['received']:
+            i = session['hashed']
+            if i == index and data is not None:
+                chunk = data
+            else:
+                offset = i * session['chunk_size']
+                with open(session['part_path'], 'rb') as f:
+                    f.seek(offset)
+                    chunk = f.read(min(session['chunk_size'], session['size'] - offset))
+            session['digest'].update(chunk)
+            session['hashed'] += 1
+
+
+def cleanup_orphan_uploads():
+    """启动时删除上次运行遗留的 .part 文件（对应的会话已随进程退出丢失）"""
+    for part_path in UPLOAD_DIR.glob('*.part'):
+        part_path.unlink(missing_ok=True)
+        print(f"  [Upload] Removed orphaned partial upload {part_path.name}")
+
+
+def _chunk_session_status(upload_id, session):
+    return {
+        'upload_id': upload_id,
+        'chunk_size': session['chunk_size'],
+        'total_chunks': session['total_chunks'],
+        'received': sorted(session['received']),
+    }
+
+
+@app.route('/upload/init', methods=['POST'])
+def upload_init():
+    """创建（或按 key 恢复）分块上传会话，返回已接收的分块序号"""
+    import time
+    data = request.get_json() or {}
+    filename = (data.get('filename') or '').strip()
+    key = (data.get('key') or '').strip()
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': '缺少文件大小'}), 400
+
+    ext = Path(filename).suffix.lower()
+    if not filename or ext not in VIDEO_EXTENSIONS:
+        return jsonify({'error': '不支持的文件格式', 'unsupported': True}), 400
+    if size < 0 or size > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': '文件过大'}), 400
+
+    with _chunk_sessions_lock:
+        _sweep_chunk_sessions()
+        # 同一文件（前端以 文件名|大小|修改时间 作为 key）重新上传时续传已有会话
+        if key:
+            for upload_id, session in _chunk_sessions.items():
+                if session['key'] == key and session['size'] == size and session['part_path'].exists():
+                    session['last_active'] = time.time()
+                    return jsonify(_chunk_session_status(upload_id, session))
+
+        upload_id = str(uuid.uuid4())
+        part_path = UPLOAD_DIR / f"{upload_id}.part"
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+        session = {
+            'filename': filename,
+            'size': size,
+            'chunk_size': UPLOAD_CHUNK_BYTES,
+            'total_chunks': max(1, math.ceil(size / UPLOAD_CHUNK_BYTES)),
+            'received': set(),
+            'part_path': part_path,
+            'key': key,
+            'last_active': time.time(),
+            'digest': hashlib.sha256(),
+            'hashed': 0,
+            'hash_lock': threading.Lock(),
+        }
+        _chunk_sessions[upload_id] = session
+    return jsonify(_chunk_session_status(upload_id, session))
+
+
+@app.route('/upload/chunk/<upload_id>/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    """写入一个分块到 .part 文件的对应偏移（分块之间互不依赖，可乱序并发）"""
+    import time
+    session = _chunk_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    if not 0 <= index < session['total_chunks']:
+        return jsonify({'error': '分块序号无效'}), 400
+
+    offset = index * session['chunk_size']
+    expected = min(session['chunk_size'], session['size'] - offset)
+    data = request.get_data(cache=False)
+    if len(data) != expected:
+        return jsonify({'error': f'分块大小不符: {len(data)} != {expected}'}), 400
+
+    with open(session['part_path'], 'r+b') as f:
+        f.seek(offset)
+        f.write(data)
+    with _chunk_sessions_lock:
+        session['received'].add(index)
+        session['last_active'] = time.time()
+    _advance_chunk_hash(session, index, data)
+    return jsonify({'ok': True, 'received': len(session['received'])})
+
+
+@app.route('/upload/status/<upload_id>')
+def upload_status(upload_id):
+    """查询分块上传进度（断线后据此只补传缺失分块）"""
+    session = _chunk_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    return jsonify(_chunk_session_status(upload_id, session))
+
+
+@app.route('/upload/finalize/<upload_id>', methods=['POST'])
+def upload_finalize(upload_id):
+    """所有分块到齐后落定文件并立即探测，返回与 /upload 相同格式的文件条目"""
+    with _chunk_sessions_lock:
+        session = _chunk_sessions.get(upload_id)
+        if session is None:
+            return jsonify({'error': '上传会话不存在'}), 404
+        missing = session['total_chunks'] - len(session['received'])
+        if missing:
+            return jsonify({'error': f'还有 {missing} 个分块未上传',
+                            **_chunk_session_status(upload_id, session)}), 409
+        del _chunk_sessions[upload_id]
+
+    # 分块到达时已增量计算哈希；这里只补上仍在进行中的尾部，不再整文件重读
+    _advance_chunk_hash(session)
+    ext = Path(session['filename']).suffix.lower()
+    save_path = UPLOAD_DIR / f"{upload_id}{ext}"
+    os.replace(session['part_path'], save_path)
+    entry = _video_upload_entry(upload_id, session['filename'], save_path,
+                                session['digest'].hexdigest())
+    if entry is None:
+        return jsonify({'file': None, 'skipped': '无法读取视频信息'})
+    return jsonify({'file': entry})
 
 
 @app.route('/upload-template', methods=['POST'])
 def upload_template():
     """上传套版 PNG，检测透明区域，返回区域信息和缩略图预览"""
-    if 'file' not in request.files:
+    try:
+        saved_files, form, seen_field = stream_multipart_upload(
+            TEMPLATE_DIR, 'file', {'.png'}, name_prefix='template_')
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    if not seen_field:
         return jsonify({'error': '没有选择文件'}), 400
-
-    f = request.files['file']
-    ratio_label = request.form.get('ratio', '')
-
-    if not f.filename:
-        return jsonify({'error': '文件名为空'}), 400
-
-    ext = Path(f.filename).suffix.lower()
-    if ext != '.png':
+    if not saved_files:
         return jsonify({'error': '套版必须是 PNG 格式（需要透明通道）'}), 400
 
-    # 保存套版文件
-    template_id = str(uuid.uuid4())
-    save_path = TEMPLATE_DIR / f"template_{template_id}.png"
-    f.save(str(save_path))
+    # 只取第一个文件，多余的删除
+    for extra in saved_files[1:]:
+        extra['path'].unlink(missing_ok=True)
+    saved = saved_files[0]
+    ratio_label = form.get('ratio', '')
+    template_id = saved['file_id']
+    save_path = saved['path']
+
+    # 相同内容的套版直接复用缓存的透明区域和缩略图，跳过检测（哈希在写盘时已算好）
+    content_hash = saved['sha256']
+    cached = template_cache.get(content_hash)
+    thumb_path = TEMPLATE_THUMB_DIR / f"{content_hash}.png"
+    if cached and cached.get('region'):
+        region = cached['region']
+        print(f"  [Template] Cache hit: {content_hash[:12]}")
+    else:
+        # 检测透明区域
+        try:
+            region = detect_transparent_region(str(save_path))
+        except Exception as e:
+            save_path.unlink(missing_ok=True)
+            return jsonify({'error': f'检测透明区域失败: {str(e)}'}), 400
 
-    # 检测透明区域
-    try:
-        region = detect_transparent_region(str(save_path))
-    except Exception as e:
-        save_path.unlink(missing_ok=True)
-        return jsonify({'error': f'检测透明区域失败: {str(e)}'}), 400
+        if not region:
+            save_path.unlink(missing_ok=True)
+            return jsonify({'error': '未在套版中检测到透明区域，请确保 PNG 包含透明（alpha=0）区域'}), 400
 
-    if not region:
-        save_path.unlink(missing_ok=True)
-        return jsonify({'error': '未在套版中检测到透明区域，请确保 PNG 包含透明（alpha=0）区域'}), 400
+        # 生成缩略图供前端预览
+        try:
+            with PILImage.open(save_path) as img:
+                thumb = img.copy()
+                thumb.thumbnail((300, 300))
+                thumb.save(thumb_path, format='PNG')
+        except Exception:
+            pass
+        template_cache.put(content_hash, {'region': region})
 
-    # 生成缩略图 base64 供前端预览
     thumb_b64 = ''
     try:
-        with PILImage.open(save_path) as img:
-            thumb = img.copy()
-            thumb.thumbnail((300, 300))
-            buf = io.BytesIO()
-            thumb.save(buf, format='PNG')
-            thumb_b64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-    except Exception:
+        thumb_b64 = base64.b64encode(thumb_path.read_bytes()).decode('utf-8')
+    except OSError:
         pass
 
     return jsonify({
@@ -989,7 +4046,18 @@ def upload_template():
         'path': str(save_path),
         'region': region,
         'thumbnail': f'data:image/png;base64,{thumb_b64}' if thumb_b64 else '',
-        'ratio_label': ratio_label
+        'ratio_label': ratio_label,
+        'content_hash': content_hash
+    })
+
+
+@app.route('/api/cache-stats')
+def api_cache_stats():
+    """各缓存的条目数与命中统计"""
+    return jsonify({
+        'template': template_cache.stats(),
+        'probe': probe_cache.stats(),
+        'output': output_cache.stats(),
     })
 
 
@@ -1035,11 +4103,33 @@ def process():
         if ratio_key and tpl_data:
             templates[ratio_key] = tpl_data
 
+    # 准入控制：排队作业过多时直接拒绝，而不是让所有人一起变慢
+    cfg = get_processing_config()
+    client = request.remote_addr or ''
+    scheduler = get_scheduler()
+    if scheduler.queued_count() + len(files_info) > int(cfg['maxQueuedJobs']):
+        return jsonify({'error': '转码队列已满，请稍后再试'}), 429
+    if scheduler.queued_count(client) + len(files_info) > int(cfg['maxQueuedJobsPerClient']):
+        return jsonify({'error': '你已提交的排队作业过多，请等待已有任务完成'}), 429
+
+    try:
+        priority = max(-10, min(10, int(data.get('priority') or 0)))
+    except (TypeError, ValueError):
+        priority = 0
+
+    profile = data.get('profile') or None
+    if profile is not None and profile not in get_encoder_profiles():
+        return jsonify({'error': f'未知的编码档位: {profile}'}), 400
+    platform = data.get('platform') or None
+    if platform is not None and platform != 'auto' and platform not in get_delivery_targets():
+        return jsonify({'error': f'未知的投放平台: {platform}'}), 400
+
     task_id = str(uuid.uuid4())
     thread = threading.Thread(
         target=process_task,
         args=(task_id, files_info, str(target_dir)),
-        kwargs={'templates': templates}
+        kwargs={'templates': templates, 'priority': priority, 'client': client,
+                'profile': profile, 'platform': platform}
     )
     thread.daemon = True
     thread.start()
@@ -1047,23 +4137,184 @@ def process():
     return jsonify({'task_id': task_id, 'output_dir': str(target_dir)})
 
 
+@app.route('/api/encoder-profiles')
+def api_encoder_profiles():
+    """可选的编码档位（available 表示当前 FFmpeg 是否支持）、默认档位及各投放平台的交付限制"""
+    return jsonify({
+        'profiles': get_encoder_profiles(),
+        'default': resolve_encoder_profile()['name'],
+        'platforms': get_delivery_targets(),
+    })
+
+
+@app.route('/api/preview', methods=['POST'])
+def api_preview():
+    """预览单帧合成效果（或几秒低清片段），用于正式转码前检查比例 / 套版位置
+
+    请求: {path, ratio（"9:16" 或 竖/方/横）, time, template?: {path, region, content_hash},
+          format?: jpeg|webp, width?, clip?（秒，>0 时返回 MP4 片段）}
+    """
+    import time
+    data = request.get_json() or {}
+    input_path = Path(data.get('path') or '')
+    if input_path.suffix.lower() not in VIDEO_EXTENSIONS or not input_path.is_file():
+        return jsonify({'error': '视频文件不存在'}), 404
+    ratio = LABEL_TO_RATIO.get(data.get('ratio'), data.get('ratio'))
+    if ratio not in STANDARD_RATIOS:
+        return jsonify({'error': f"不支持的比例: {data.get('ratio')}"}), 400
+    fmt = data.get('format') or 'jpeg'
+    if fmt not in PREVIEW_FORMATS:
+        return jsonify({'error': f'不支持的格式: {fmt}'}), 400
+
+    template = data.get('template') or None
+    if template:
+        if not isinstance(template, dict) or not isinstance(template.get('path', ''), str) \
+                or not isinstance(template.get('region') or {}, dict):
+            return jsonify({'error': '套版参数格式错误'}), 400
+        if not (template.get('path') and template.get('region')):
+            template = None
+        elif not _is_within(template['path'], TEMPLATE_DIR) or not Path(template['path']).is_file():
+            return jsonify({'error': '套版文件不存在'}), 404
+
+    try:
+        at = float(data.get('time') or 0)
+        width = int(data.get('width') or 540)
+        clip = max(0.0, float(data.get('clip') or 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': '参数格式错误'}), 400
+
+    started = time.perf_counter()
+    try:
+        payload, mimetype = render_preview(input_path, ratio, template=template, at=at, fmt=fmt,
+                                           width=width, clip=clip)
+    except (ValueError, RuntimeError, subprocess.TimeoutExpired) as e:
+        return jsonify({'error': str(e)}), 500
+    print(f"  [Preview] {input_path.name} -> {ratio} @ {at:.1f}s in "
+          f"{(time.perf_counter() - started) * 1000:.0f} ms")
+    return Response(payload, mimetype=mimetype, headers={'Cache-Control': 'no-store'})
+
+
+TASK_ACTIONS = ('cancel', 'pause', 'resume')
+
+
+@app.route('/api/tasks/<task_id>/<action>', methods=['POST'])
+def api_task_action(task_id, action):
+    """取消 / 暂停 / 继续整个任务"""
+    if action not in TASK_ACTIONS:
+        return jsonify({'error': f'未知操作: {action}'}), 404
+    ok, error = control_task(task_id, action)
+    if not ok:
+        return jsonify({'error': error}), 409
+    return jsonify({'ok': True})
+
+
+@app.route('/api/tasks/<task_id>/jobs/<job_id>/<action>', methods=['POST'])
+def api_job_action(task_id, job_id, action):
+    """取消 / 暂停 / 继续任务中的单个作业（job_id 即上传文件的 file_id）"""
+    if action not in TASK_ACTIONS:
+        return jsonify({'error': f'未知操作: {action}'}), 404
+    ok, error = control_job(task_id, job_id, action)
+    if not ok:
+        return jsonify({'error': error}), 409
+    return jsonify({'ok': True})
+
+
+SSE_KEEPALIVE_SECONDS = 15
+
+
+def _sse_event(event_id, payload):
+    return f"id: {event_id}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _task_snapshots(select):
+    """为 select(task_id, info) 为真的任务生成快照，返回 (快照列表, 事件 id)
+
+    快照与 id 在同一把锁下取得：id 之前的事件都已体现在快照里，之后的增量不会重复也不会丢失。
+    """
+    with _progress_lock:
+        snapshots = [
+            # 深拷贝：工作线程会继续修改 jobs 等嵌套结构，序列化发生在锁外
+            {'type': 'snapshot', 'task_id': task_id, **json.loads(json.dumps(info)),
+             'queue': _last_queue_report.get(task_id)}
+            for task_id, info in progress_store.items() if select(task_id, info)
+        ]
+        return snapshots, progress_bus.last_id
+
+
+def _last_event_id():
+    """EventSource 重连时自带 Last-Event-ID 请求头；也允许用查询参数显式指定"""
+    raw = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or ''
+    try:
+        return int(raw)
+    except ValueError:
+        return 0
+
+
+def _sse_response(generator):
+    return Response(generator, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/progress/<task_id>')
 def progress(task_id):
-    """SSE 端点：处理进度推送"""
+    """SSE 端点：先发送任务快照，之后只推送增量事件（作业开始 / 进度 / 结果 / 错误 / 完成）"""
+    last_id = _last_event_id()
+
     def generate():
-        import time
-        while True:
-            info = progress_store.get(task_id)
-            if info is None:
+        cursor = last_id
+        if not progress_bus.can_resume(cursor):
+            snapshots, cursor = _task_snapshots(lambda t, info: t == task_id)
+            if not snapshots:
                 yield f"data: {json.dumps({'error': '任务不存在'})}\n\n"
-                break
-            yield f"data: {json.dumps(info, ensure_ascii=False)}\n\n"
-            if info['status'] == 'done':
-                break
-            time.sleep(0.5)
+                return
+            yield _sse_event(cursor, snapshots[0])
+            if snapshots[0]['status'] in FINISHED_TASK_STATUSES:
+                return
+        while True:
+            events, cursor = progress_bus.wait(cursor, task_ids={task_id},
+                                               timeout=SSE_KEEPALIVE_SECONDS)
+            if not events:
+                if task_id not in progress_store:
+                    yield f"data: {json.dumps({'error': '任务不存在'})}\n\n"
+                    return
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                yield _sse_event(event['id'], event)
+                if event['type'] == 'task_done':
+                    return
+
+    return _sse_response(generate())
+
+
+@app.route('/events')
+def events():
+    """多路复用 SSE 端点：一个连接接收所有（或 ?tasks=a,b 指定的）任务的增量事件
+
+    首次连接时先为每个未完成的任务发送快照；断线重连时按 Last-Event-ID 补发。
+    """
+    last_id = _last_event_id()
+    task_filter = {t for t in (request.args.get('tasks') or '').split(',') if t} or None
 
-    return Response(generate(), mimetype='text/event-stream',
-                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    def generate():
+        cursor = last_id
+        if not progress_bus.can_resume(cursor):
+            if task_filter is None:
+                snapshots, cursor = _task_snapshots(lambda t, info: info['status'] not in FINISHED_TASK_STATUSES)
+            else:
+                snapshots, cursor = _task_snapshots(lambda t, info: t in task_filter)
+            for snapshot in snapshots:
+                yield _sse_event(cursor, snapshot)
+        while True:
+            events, cursor = progress_bus.wait(cursor, task_ids=task_filter,
+                                               timeout=SSE_KEEPALIVE_SECONDS)
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                yield _sse_event(event['id'], event)
+
+    return _sse_response(generate())
 
 
 @app.route('/download/<filename>')
@@ -1088,13 +4339,14 @@ def output_files():
 @app.route('/browse-folder', methods=['POST'])
 def browse_folder():
     """打开系统文件夹选择对话框"""
+    data = request.get_json(silent=True) or {}
     try:
         import tkinter as tk
         from tkinter import filedialog
         root = tk.Tk()
         root.withdraw()
         root.attributes('-topmost', True)
-        folder = filedialog.askdirectory(title='选择输出目录')
+        folder = filedialog.askdirectory(title=data.get('title') or '选择输出目录')
         root.destroy()
         if folder:
             return jsonify({'path': folder})
@@ -1103,6 +4355,83 @@ def browse_folder():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/browse-files', methods=['POST'])
+def browse_files():
+    """打开系统文件选择对话框（多选视频）"""
+    try:
+        import tkinter as tk
+        from tkinter import filedialog
+        root = tk.Tk()
+        root.withdraw()
+        root.attributes('-topmost', True)
+        patterns = ' '.join(f'*{ext}' for ext in sorted(VIDEO_EXTENSIONS))
+        paths = filedialog.askopenfilenames(title='选择本地视频',
+                                            filetypes=[('视频文件', patterns), ('所有文件', '*.*')])
+        root.destroy()
+        return jsonify({'paths': list(paths)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def collect_media_paths(paths, extensions, recursive=True):
+    """展开文件 / 文件夹路径列表，返回扩展名匹配的文件（去重、按路径排序）"""
+    found = {}
+    for raw in paths:
+        p = Path(str(raw).strip().strip('"')).expanduser()
+        if p.is_file():
+            if p.suffix.lower() in extensions:
+                found[str(p.resolve())] = p
+        elif p.is_dir():
+            walker = p.rglob('*') if recursive else p.iterdir()
+            for child in walker:
+                if child.is_file() and child.suffix.lower() in extensions:
+                    found[str(child.resolve())] = child
+    return [found[k] for k in sorted(found)]
+
+
+def probe_paths_parallel(paths, probe_fn, max_workers=8):
+    """用线程池并行探测多个文件，返回与 paths 顺序一致的结果列表（失败为 None）"""
+    def safe_probe(path):
+        try:
+            return probe_fn(path)
+        except Exception:
+            return None
+
+    if not paths:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as pool:
+        return list(pool.map(safe_probe, paths))
+
+
+@app.route('/api/ingest-local', methods=['POST'])
+def ingest_local():
+    """本地导入：直接探测本机上的视频文件 / 文件夹，不经过 HTTP 上传和拷贝
+
+    处理时从原路径读取，任务结束后也不会删除源文件。
+    """
+    data = request.get_json() or {}
+    paths = data.get('paths') or []
+    if isinstance(paths, str):
+        paths = [paths]
+    recursive = bool(data.get('recursive', True))
+
+    video_paths = collect_media_paths(paths, VIDEO_EXTENSIONS, recursive=recursive)
+    if not video_paths:
+        return jsonify({'error': '未找到视频文件'}), 400
+
+    infos = probe_paths_parallel(video_paths, get_video_info)
+    entries, skipped = [], []
+    for path, info in zip(video_paths, infos):
+        if info is None:
+            skipped.append(str(path))
+            continue
+        entry = _video_file_entry(str(uuid.uuid4()), path.name, path, info)
+        entry['local'] = True
+        entries.append(entry)
+
+    return jsonify({'files': entries, 'skipped': skipped})
+
+
 def _open_folder_foreground(folder_path):
     """在系统文件管理器中打开文件夹，并尽量使窗口置前显示（Windows 下直接显示在桌面最前）"""
     target = Path(folder_path)
@@ -1222,28 +4551,23 @@ def api_extract_last_frame():
 @app.route('/api/upload-for-rename', methods=['POST'])
 def upload_for_rename():
     """上传素材文件，获取元数据（分辨率、比例）并用本地规则解析文件名"""
-    if 'files' not in request.files:
+    try:
+        saved_files, _, seen_field = stream_multipart_upload(RENAME_UPLOAD_DIR, 'files', MEDIA_EXTENSIONS)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    if not seen_field:
         return jsonify({'error': '没有选择文件'}), 400
 
     uploaded = []
-    files_list = request.files.getlist('files')
-
-    for f in files_list:
-        if not f.filename:
-            continue
-        ext = Path(f.filename).suffix.lower()
-        if ext not in MEDIA_EXTENSIONS:
-            continue
 
-        file_id = str(uuid.uuid4())
-        safe_name = f"{file_id}{ext}"
-        save_path = RENAME_UPLOAD_DIR / safe_name
-        f.save(str(save_path))
+    for saved in saved_files:
+        save_path = saved['path']
+        ext = save_path.suffix
 
         # 获取分辨率
         info = None
         if ext in VIDEO_EXTENSIONS:
-            info = get_video_info(save_path)
+            info = get_video_info(save_path, content_hash=saved['sha256'])
         elif ext in IMAGE_EXTENSIONS:
             info = get_image_info(save_path)
 
@@ -1253,12 +4577,13 @@ def upload_for_rename():
         ratio_label = classify_ratio_rename(info['width'], info['height'])
 
         # 本地规则解析文件名
-        parsed = parse_filename_local(f.filename)
+        parsed = parse_filename_local(saved['filename'])
 
         uploaded.append({
-            'file_id': file_id,
-            'original_name': f.filename,
+            'file_id': saved['file_id'],
+            'original_name': saved['filename'],
             'path': str(save_path),
+            'sha256': saved['sha256'],
             'width': info.get('width', 0),
             'height': info.get('height', 0),
             'ratio_label': ratio_label,
@@ -1295,25 +4620,16 @@ def export_renamed():
             errors.append({'filename': new_name, 'error': '源文件不存在'})
             continue
 
-        dst_path = actual_output_dir / new_name
-
-        # 处理重名
-        counter = 1
-        while dst_path.exists():
-            stem = Path(new_name).stem
-            ext = Path(new_name).suffix
-            dst_path = actual_output_dir / f"{stem}_{counter}{ext}"
-            counter += 1
-
+        dst_path = None
         try:
-            shutil.copy2(str(src_path), str(dst_path))
-            results.append({'filename': dst_path.name})
-            # 清理上传的临时文件
-            try:
-                src_path.unlink()
-            except OSError:
-                pass
+            # 处理重名（原子占位，避免并发导出拿到同一文件名）
+            dst_path = _reserve_output_path(actual_output_dir, new_name)
+            # 上传的临时文件导出后即删除，所以是"移动"：同盘直接改名，跨盘才真正拷贝
+            method = move_file_fast(src_path, dst_path)
+            results.append({'filename': dst_path.name, 'method': method})
         except Exception as e:
+            if dst_path is not None:
+                dst_path.unlink(missing_ok=True)
             errors.append({'filename': new_name, 'error': str(e)})
 
     return jsonify({
@@ -1323,6 +4639,89 @@ def export_renamed():
     })
 
 
+@app.route('/api/rename-scan-folder', methods=['POST'])
+def rename_scan_folder():
+    """扫描本地文件夹：并行探测素材宽高并解析文件名，不上传、不拷贝"""
+    data = request.get_json() or {}
+    paths = data.get('paths') or data.get('path') or []
+    if isinstance(paths, str):
+        paths = [paths]
+    recursive = bool(data.get('recursive', False))
+
+    media_paths = collect_media_paths(paths, MEDIA_EXTENSIONS, recursive=recursive)
+    if not media_paths:
+        return jsonify({'error': '未找到素材文件'}), 400
+
+    infos = probe_paths_parallel(media_paths, probe_media_info)
+    entries = []
+    for path, info in zip(media_paths, infos):
+        info = info or {'width': 0, 'height': 0}
+        entries.append({
+            'file_id': str(uuid.uuid4()),
+            'original_name': path.name,
+            'path': str(path),
+            'width': info.get('width', 0),
+            'height': info.get('height', 0),
+            'ratio_label': classify_ratio_rename(info.get('width', 0), info.get('height', 0)),
+            'parsed': parse_filename_local(path.name),
+            'local': True,
+        })
+
+    return jsonify({'files': entries})
+
+
+@app.route('/api/rename-in-place', methods=['POST'])
+def rename_in_place():
+    """原地批量改名（或移动到 target_dir），整批原子执行并记录撤销日志"""
+    data = request.get_json() or {}
+    file_list = data.get('files') or []
+    target_dir = (data.get('target_dir') or '').strip()
+    if not file_list:
+        return jsonify({'error': '没有文件需要重命名'}), 400
+
+    if target_dir:
+        try:
+            Path(target_dir).mkdir(parents=True, exist_ok=True)
+        except Exception:
+            return jsonify({'error': f'无法创建目录: {target_dir}'}), 400
+
+    try:
+        pairs = plan_batch_rename([(item['path'], item['new_filename']) for item in file_list],
+                                  target_dir or None)
+        if not pairs:
+            return jsonify({'results': [], 'journal_id': None})
+        journal = batch_rename_with_journal(pairs)
+    except (RenameError, KeyError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    print(f"  [Rename] {len(pairs)} files renamed in place (journal {journal['id']})")
+    return jsonify({
+        'results': [{'from': str(src), 'filename': dst.name, 'path': str(dst), 'method': 'rename'}
+                    for src, dst in pairs],
+        'journal_id': journal['id'],
+    })
+
+
+@app.route('/api/rename-journals', methods=['GET'])
+def rename_journals():
+    """最近的原地改名批次"""
+    return jsonify({'journals': list_rename_journals()})
+
+
+@app.route('/api/rename-undo', methods=['POST'])
+def rename_undo():
+    """按撤销日志把一整批文件改回原名"""
+    data = request.get_json() or {}
+    journal = load_rename_journal(data.get('journal_id'))
+    if journal is None:
+        return jsonify({'error': '撤销记录不存在'}), 404
+    try:
+        undo_rename_journal(journal)
+    except RenameError as e:
+        return jsonify({'error': str(e)}), 400
+
+    print(f"  [Rename] Journal {journal['id']} undone ({len(journal['entries'])} files)")
+    return jsonify({'ok': True, 'count': len(journal['entries'])})
 
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -1453,6 +4852,13 @@ def api_get_config():
 @app.route('/api/config', methods=['POST'])
 def api_save_config():
     data = request.get_json(force=True)
+    if 'processing' in data and isinstance(data['processing'], dict):
+        try:
+            data['processing'] = {k: coerce_processing_value(k, v)
+                                  for k, v in data['processing'].items()
+                                  if k in DEFAULT_PROCESSING_CONFIG}
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
     try:
         cfg = load_config()
         if 'creators' in data and isinstance(data['creators'], list):
@@ -1463,8 +4869,15 @@ def api_save_config():
             cfg['defaultPlatform'] = data['defaultPlatform']
         if 'defaultCreator' in data:
             cfg['defaultCreator'] = data['defaultCreator']
+        if 'processing' in data and isinstance(data['processing'], dict):
+            processing = dict(cfg.get('processing') or {})
+            processing.update({k: v for k, v in data['processing'].items()
+                               if k in DEFAULT_PROCESSING_CONFIG})
+            cfg['processing'] = processing
         save_config(cfg)
         sync_known_creators()
+        reconfigure_scheduler()
+        reconfigure_caches()
         return jsonify({'ok': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1674,9 +5087,12 @@ def api_do_update():
         print("  [Update] Updater launched, shutting down...")
 
         # 延迟退出，确保 bat 已启动且响应已返回前端，再结束进程释放 exe
+        # （os._exit 不执行 atexit，先把缓存索引写盘）
         def _exit_later():
             import time
             time.sleep(2)
+            for cache in (template_cache, probe_cache, output_cache):
+                cache.flush()
             os._exit(0)
 
         threading.Thread(target=_exit_later, daemon=True).start()
@@ -1754,6 +5170,12 @@ if __name__ == '__main__':
         print(f"  FFmpeg:  {FFMPEG_PATH}")
         print("  Close this window to exit.\n")
 
+        # 清理上次异常退出遗留的分段编码临时文件和未完成的分块上传，再恢复未完成的转码任务
+        for leftover in SEGMENT_DIR.iterdir():
+            shutil.rmtree(leftover, ignore_errors=True)
+        cleanup_orphan_uploads()
+        resume_interrupted_tasks()
+
         # 后台定期检查更新（启动时一次，之后每 30 分钟，仅打包模式）
         threading.Thread(target=_periodic_update_check_loop, daemon=True).start()
 
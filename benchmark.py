@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""转码性能基准测试
+
+用法:
+  python benchmark.py blur [--input 视频路径] [--ratio 9:16] [--factors 4 8 16]
+  python benchmark.py profiles [--input 视频路径 ...] [--ratio 9:16] [--profiles draft standard]
+  python benchmark.py prescale [--input 视频路径] [--ratios 9:16 1:1 16:9] [--max-fps 30]
+
+blur: 对比全分辨率 gblur（BLUR_SIGMA）与快速模糊（缩小 1/N 后模糊）的编码 fps 和 SSIM。
+profiles: 逐个编码档位编码参考片段，对比 fps、文件大小、码率和相对 standard 档位的 SSIM。
+prescale: 对比分流前缩小 / 降帧（source_prefilter）开启前后的多比例编码速度和 SSIM。
+未指定 --input 时用 FFmpeg testsrc2 生成参考片段（blur / profiles 为 1920x1080，
+prescale 为 3840x2160 60fps）。
+"""
+import re
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+import app
+
+
+def make_reference_clip(path, duration=10, size='1920x1080', rate=30):
+    """生成参考片段（彩色测试图 + 正弦音频）"""
+    cmd = [
+        app.FFMPEG_PATH, '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={rate}',
+        '-f', 'lavfi', '-i', 'sine=frequency=440',
+        '-t', str(duration),
+        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-crf', '18',
+        '-c:a', 'aac',
+        str(path)
+    ]
+    subprocess.run(cmd, check=True, **app._subprocess_kwargs)
+
+
+def encode(input_path, output_path, filter_complex, extra_args=None, video_args=None):
+    """执行一次编码，返回 (耗时秒, 帧数)；video_args 为空时使用 libx264 CRF 18 medium"""
+    cmd = [
+        app.FFMPEG_PATH, '-y', '-i', str(input_path),
+        '-filter_complex', filter_complex,
+        '-map', '[out]', '-an',
+    ] + (video_args or ['-c:v', 'libx264', '-crf', '18', '-preset', 'medium']) \
+      + (extra_args or []) + [str(output_path)]
+    start = time.perf_counter()
+    result = subprocess.run(cmd, capture_output=True, text=True,
+                            encoding='utf-8', errors='replace',
+                            **app._subprocess_kwargs)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-1000:])
+    frames = re.findall(r'frame=\s*(\d+)', result.stderr)
+    return elapsed, int(frames[-1]) if frames else 0
+
+
+def measure_ssim(reference_path, test_path):
+    """用 FFmpeg ssim 滤镜计算两段视频的平均 SSIM"""
+    cmd = [
+        app.FFMPEG_PATH, '-i', str(test_path), '-i', str(reference_path),
+        '-lavfi', 'ssim', '-f', 'null', '-'
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True,
+                            encoding='utf-8', errors='replace',
+                            **app._subprocess_kwargs)
+    match = re.search(r'All:([\d.]+)', result.stderr)
+    return float(match.group(1)) if match else None
+
+
+def multi_filter(info, ratios, prescale, max_fps):
+    """与 process_video_multi 相同结构的多比例模糊滤镜图，返回 (滤镜图, 输出标签)"""
+    prefilter, src_info = app.source_prefilter(info, prescale=prescale, max_fps=max_fps)
+    labels = [f"[s{i}]" for i in range(len(ratios) * 2)]
+    chains = [f"[0:v]{prefilter + ',' if prefilter else ''}split={len(labels)}{''.join(labels)}"]
+    for idx, ratio in enumerate(ratios):
+        out_w, out_h = app.calculate_output_dimensions(src_info['width'], src_info['height'], ratio)
+        chains.append(app._blur_filter(labels[idx * 2], labels[idx * 2 + 1], out_w, out_h, f'out{idx}'))
+    return ';'.join(chains), [f'out{idx}' for idx in range(len(ratios))]
+
+
+def bench_blur(args):
+    work_dir = Path(tempfile.mkdtemp(prefix='bench_blur_'))
+    input_path = Path(args.input) if args.input else work_dir / 'reference.mp4'
+    if not args.input:
+        print(f"  Generating reference clip: {input_path}")
+        make_reference_clip(input_path, duration=args.duration)
+
+    info = app.get_video_info(input_path)
+    if not info:
+        sys.exit(f"无法读取视频信息: {input_path}")
+    out_w, out_h = app.calculate_output_dimensions(info['width'], info['height'], args.ratio)
+    print(f"  Source {info['width']}x{info['height']} -> {out_w}x{out_h} ({args.ratio})\n")
+
+    baseline_path = work_dir / 'blur_full.mp4'
+    graph = app._blur_filter('[0:v]', '[0:v]', out_w, out_h, 'out', downscale=1)
+    elapsed, frames = encode(input_path, baseline_path, graph)
+    base_fps = frames / elapsed if elapsed else 0
+    print(f"  {'mode':<14}{'fps':>8}{'speedup':>10}{'SSIM':>10}")
+    print(f"  {'full gblur':<14}{base_fps:>8.1f}{1.0:>9.2f}x{'1.0000':>10}")
+
+    for factor in args.factors:
+        out_path = work_dir / f'blur_fast_{factor}.mp4'
+        graph = app._blur_filter('[0:v]', '[0:v]', out_w, out_h, 'out', downscale=factor)
+        elapsed, frames = encode(input_path, out_path, graph)
+        fps = frames / elapsed if elapsed else 0
+        ssim = measure_ssim(baseline_path, out_path)
+        speedup = fps / base_fps if base_fps else 0
+        ssim_str = f"{ssim:.4f}" if ssim is not None else 'n/a'
+        print(f"  {'fast 1/' + str(factor):<14}{fps:>8.1f}{speedup:>9.2f}x{ssim_str:>10}")
+
+    print(f"\n  Outputs kept in: {work_dir}")
+
+
+def bench_profiles(args):
+    work_dir = Path(tempfile.mkdtemp(prefix='bench_profiles_'))
+    inputs = [Path(p) for p in args.input]
+    if not inputs:
+        reference = work_dir / 'reference.mp4'
+        print(f"  Generating reference clip: {reference}")
+        make_reference_clip(reference, duration=args.duration)
+        inputs = [reference]
+
+    profiles = app.get_encoder_profiles()
+    names = args.profiles or list(profiles)
+    unknown = [n for n in names if n not in profiles]
+    if unknown:
+        sys.exit(f"未知的编码档位: {', '.join(unknown)}")
+    # standard 档位作为 SSIM 参照，先编码
+    names = sorted(names, key=lambda n: n != 'standard')
+
+    for input_path in inputs:
+        info = app.get_video_info(input_path)
+        if not info:
+            sys.exit(f"无法读取视频信息: {input_path}")
+        out_w, out_h = app.calculate_output_dimensions(info['width'], info['height'], args.ratio)
+        graph = app._blur_filter('[0:v]', '[0:v]', out_w, out_h, 'out')
+        print(f"\n  {input_path.name}: {info['width']}x{info['height']} -> {out_w}x{out_h} "
+              f"({args.ratio}), {info['duration']:.1f}s")
+        print(f"  {'profile':<16}{'codec':<10}{'fps':>8}{'size MB':>10}{'kbps':>9}{'SSIM':>9}")
+
+        baseline = None
+        for name in names:
+            profile = dict(profiles[name], name=name)
+            if not profile['available']:
+                print(f"  {name:<16}{profile['vcodec']:<10}{'(encoder not available)':>36}")
+                continue
+            out_path = work_dir / f"{input_path.stem}_{name}.mp4"
+            elapsed, frames = encode(input_path, out_path, graph,
+                                     video_args=app._video_encoder_args(profile, out_path))
+            fps = frames / elapsed if elapsed else 0
+            size = out_path.stat().st_size
+            kbps = size * 8 / 1000 / info['duration'] if info['duration'] else 0
+            if name == 'standard':
+                baseline = out_path
+            ssim = measure_ssim(baseline, out_path) if baseline else None
+            ssim_str = f"{ssim:.4f}" if ssim is not None else 'n/a'
+            print(f"  {name:<16}{profile['vcodec']:<10}{fps:>8.1f}{size / 1024 ** 2:>10.2f}"
+                  f"{kbps:>9.0f}{ssim_str:>9}")
+
+    print(f"\n  Outputs kept in: {work_dir}")
+
+
+def bench_prescale(args):
+    work_dir = Path(tempfile.mkdtemp(prefix='bench_prescale_'))
+    input_path = Path(args.input) if args.input else work_dir / 'reference.mp4'
+    if not args.input:
+        print(f"  Generating reference clip: {input_path}")
+        make_reference_clip(input_path, duration=args.duration, size='3840x2160', rate=60)
+
+    info = app.get_video_info(input_path)
+    if not info:
+        sys.exit(f"无法读取视频信息: {input_path}")
+    print(f"  Source {info['width']}x{info['height']} @ {info.get('fps') or '?'} fps, "
+          f"{info['duration']:.1f}s -> {' '.join(args.ratios)}\n")
+    print(f"  {'mode':<12}{'pre-filter':<28}{'speed':>8}{'speedup':>10}{'SSIM':>10}")
+
+    base_speed = None
+    baseline = None
+    for mode, prescale, max_fps in (('off', 0, 0), ('prescale', 1, 0), ('+fps cap', 1, args.max_fps)):
+        graph, labels = multi_filter(info, args.ratios, prescale, max_fps)
+        prefilter = app.source_prefilter(info, prescale=prescale, max_fps=max_fps)[0]
+        cmd = [app.FFMPEG_PATH, '-y', '-i', str(input_path), '-filter_complex', graph]
+        outputs = []
+        for label in labels:
+            out_path = work_dir / f"{mode.strip('+').replace(' ', '_')}_{label}.mp4"
+            cmd += ['-map', f'[{label}]', '-an', '-c:v', 'libx264', '-crf', '18',
+                    '-preset', 'medium', str(out_path)]
+            outputs.append(out_path)
+        start = time.perf_counter()
+        result = subprocess.run(cmd, capture_output=True, text=True,
+                                encoding='utf-8', errors='replace',
+                                **app._subprocess_kwargs)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            sys.exit(result.stderr[-1000:])
+        # 降帧后输出帧数变少，速度按源视频时长 / 耗时计
+        speed = info['duration'] / elapsed if elapsed else 0
+        base_speed = base_speed or speed
+        if baseline is None:
+            baseline = outputs
+        # SSIM 只在帧率相同时可比（降帧后帧序列不同）
+        ssim = measure_ssim(baseline[0], outputs[0]) if not max_fps else None
+        ssim_str = f"{ssim:.4f}" if ssim is not None else 'n/a'
+        print(f"  {mode:<12}{prefilter or '-':<28}{speed:>7.2f}x{speed / base_speed:>9.2f}x"
+              f"{ssim_str:>10}")
+
+    print(f"\n  Outputs kept in: {work_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='转码性能基准测试')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_blur = sub.add_parser('blur', help='全分辨率模糊 vs 快速模糊')
+    p_blur.add_argument('--input', help='参考视频（默认自动生成）')
+    p_blur.add_argument('--ratio', default='9:16', choices=app.STANDARD_RATIOS)
+    p_blur.add_argument('--factors', type=int, nargs='+', default=[4, 8, 16])
+    p_blur.add_argument('--duration', type=int, default=10, help='自动生成片段的时长（秒）')
+    p_blur.set_defaults(func=bench_blur)
+
+    p_profiles = sub.add_parser('profiles', help='各编码档位的速度 / 体积 / 质量')
+    p_profiles.add_argument('--input', nargs='*', default=[], help='参考视频（可多个，默认自动生成）')
+    p_profiles.add_argument('--ratio', default='9:16', choices=app.STANDARD_RATIOS)
+    p_profiles.add_argument('--profiles', nargs='+', help='只测试这些档位（默认全部）')
+    p_profiles.add_argument('--duration', type=int, default=10, help='自动生成片段的时长（秒）')
+    p_profiles.set_defaults(func=bench_profiles)
+
+    p_prescale = sub.add_parser('prescale', help='分流前缩小 / 降帧 开启前后')
+    p_prescale.add_argument('--input', help='参考视频（默认自动生成 4K 60fps）')
+    p_prescale.add_argument('--ratios', nargs='+', default=list(app.STANDARD_RATIOS),
+                            choices=app.STANDARD_RATIOS)
+    p_prescale.add_argument('--max-fps', type=int, default=30, help='第三轮使用的帧率上限')
+    p_prescale.add_argument('--duration', type=int, default=5, help='自动生成片段的时长（秒）')
+    p_prescale.set_defaults(func=bench_prescale)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
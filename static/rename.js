@@ -1,6 +1,7 @@
 /**
  * 素材重命名工具 - 前端逻辑（纯本地版，无 AI 依赖）
  * 流程：拖拽上传 → 服务端检测分辨率+本地解析文件名 → 手动校对 → 导出
+ *       或扫描本地文件夹 → 手动校对 → 原地批量改名（可撤销）
  */
 document.addEventListener('DOMContentLoaded', () => {
 
@@ -61,6 +62,11 @@ document.addEventListener('DOMContentLoaded', () => {
     const openOutputFolderBtn = document.getElementById('rename-open-output-folder-btn');
     const outputPathInput = document.getElementById('rename-output-path');
     const browseOutputBtn = document.getElementById('rename-browse-output-btn');
+    const localPathInput = document.getElementById('rename-local-path');
+    const localRecursive = document.getElementById('rename-local-recursive');
+    const scanBtn = document.getElementById('rename-scan-btn');
+    const browseLocalBtn = document.getElementById('rename-browse-local-btn');
+    const undoBtn = document.getElementById('rename-undo-btn');
 
     const cfgDate = document.getElementById('cfg-date');
     const cfgRegion = document.getElementById('cfg-region');
@@ -72,6 +78,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     let files = [];
     let lastOutputDir = '';
+    let lastJournalId = null;
 
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     // 初始化
@@ -179,39 +186,89 @@ document.addEventListener('DOMContentLoaded', () => {
             const data = await resp.json();
             if (data.error) { alert(data.error); return; }
 
-            for (const sf of data.files) {
-                const ext = sf.original_name.split('.').pop().toLowerCase();
-                const p = sf.parsed || {};
-
-                // 从解析结果和全局配置合并
-                const fileObj = {
-                    id: sf.file_id,
-                    originalName: sf.original_name,
-                    serverPath: sf.path,
-                    width: sf.width,
-                    height: sf.height,
-                    ext: ext,
-                    // 优先用解析到的值，否则用全局配置
-                    date: p.date || cfgDate.value,
-                    region: p.region || cfgRegion.value,
-                    property: p.property || '原创',
-                    audience: p.audience || '男性向',
-                    assetName: p.assetName || '',
-                    platform: p.platform || cfgPlatform.value,
-                    creator: p.creator || cfgCreator.value,
-                    ratio: sf.ratio_label || p.ratio || '横',
-                    version: p.version || '1',
-                    detectedPlatform: p.platform || '',
-                    status: 'done'
-                };
-                files.push(fileObj);
-            }
-            renderFiles();
+            addServerFiles(data.files);
         } catch (err) {
             alert('上传失败: ' + err.message);
         }
     }
 
+    // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    // 本地文件夹扫描 → 不上传，原地改名
+    // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    async function scanLocal(paths) {
+        paths = paths.map(p => p.trim()).filter(Boolean);
+        if (!paths.length) return;
+
+        scanBtn.disabled = true;
+        scanBtn.textContent = '扫描中...';
+        try {
+            const resp = await fetch('/api/rename-scan-folder', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ paths, recursive: localRecursive.checked })
+            });
+            const data = await resp.json();
+            if (data.error) { alert(data.error); return; }
+            fileListSection.style.display = 'block';
+            resultsSection.style.display = 'none';
+            addServerFiles(data.files);
+            localPathInput.value = '';
+        } catch (err) {
+            alert('扫描失败: ' + err.message);
+        } finally {
+            scanBtn.disabled = false;
+            scanBtn.textContent = '扫描';
+        }
+    }
+
+    scanBtn.addEventListener('click', () => scanLocal(localPathInput.value.split(';')));
+
+    browseLocalBtn.addEventListener('click', async () => {
+        try {
+            const resp = await fetch('/browse-folder', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ title: '选择素材文件夹' })
+            });
+            const data = await resp.json();
+            if (data.error) throw new Error(data.error);
+            if (data.path) scanLocal([data.path]);
+        } catch (err) { alert('浏览失败: ' + err.message); }
+    });
+
+    // 服务端返回的素材（上传或本地扫描）合并全局配置后加入列表
+    function addServerFiles(serverFiles) {
+        for (const sf of serverFiles) {
+            const ext = sf.original_name.split('.').pop().toLowerCase();
+            const p = sf.parsed || {};
+
+            // 从解析结果和全局配置合并
+            const fileObj = {
+                id: sf.file_id,
+                originalName: sf.original_name,
+                serverPath: sf.local ? '' : sf.path,
+                localPath: sf.local ? sf.path : '',
+                width: sf.width,
+                height: sf.height,
+                ext: ext,
+                // 优先用解析到的值，否则用全局配置
+                date: p.date || cfgDate.value,
+                region: p.region || cfgRegion.value,
+                property: p.property || '原创',
+                audience: p.audience || '男性向',
+                assetName: p.assetName || '',
+                platform: p.platform || cfgPlatform.value,
+                creator: p.creator || cfgCreator.value,
+                ratio: sf.ratio_label || p.ratio || '横',
+                version: p.version || '1',
+                detectedPlatform: p.platform || '',
+                status: 'done'
+            };
+            files.push(fileObj);
+        }
+        renderFiles();
+    }
+
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     // 文件名生成
     // {日期}-{地区}-{属性}-{受众}-{核心词}-{平台}-{制作人}-{比例}-{版本}.{后缀}
@@ -251,6 +308,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     <span>
                         <span class="rename-card-original">${escapeHtml(f.originalName)}</span>
                         <span class="rename-card-resolution">${resText}</span>
+                        ${f.localPath ? '<span class="rename-card-local">本地</span>' : ''}
                     </span>
                     <span class="rename-card-status status-done">就绪</span>
                 </div>
@@ -330,52 +388,91 @@ document.addEventListener('DOMContentLoaded', () => {
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     // 导出
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    // 导出方式（服务端按代价从低到高选择）
+    const EXPORT_METHOD_LABELS = {
+        rename: '移动', hardlink: '硬链接', reflink: '克隆',
+        copy_file_range: '内核拷贝', copy: '拷贝'
+    };
+
+    function appendResult(r) {
+        const div = document.createElement('div');
+        div.className = 'result-item';
+        const method = r.method ? `<span class="export-method">${EXPORT_METHOD_LABELS[r.method] || r.method}</span>` : '';
+        div.innerHTML = `<span class="file-name">${escapeHtml(r.filename)}</span>${method}`;
+        resultItems.appendChild(div);
+    }
+
+    function appendError(filename, error) {
+        const div = document.createElement('div');
+        div.className = 'error-item';
+        div.textContent = `${filename}: ${error}`;
+        errorItems.appendChild(div);
+    }
+
+    async function postJSON(url, body) {
+        const resp = await fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        });
+        return resp.json();
+    }
+
     exportBtn.addEventListener('click', async () => {
-        const validFiles = files.filter(f => f.serverPath);
-        if (!validFiles.length) { alert('没有可导出的文件'); return; }
+        const uploadedFiles = files.filter(f => f.serverPath);
+        const localFiles = files.filter(f => f.localPath);
+        if (!uploadedFiles.length && !localFiles.length) { alert('没有可导出的文件'); return; }
 
         exportBtn.disabled = true;
         exportBtn.textContent = '导出中...';
 
         try {
-            const exportData = validFiles.map(f => ({
-                server_path: f.serverPath,
-                new_filename: generateFilename(f)
-            }));
-
-            const resp = await fetch('/api/export-renamed', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    files: exportData,
-                    output_dir: outputPathInput.value.trim()
-                })
-            });
-            const data = await resp.json();
-            if (data.error) { alert(data.error); return; }
-
-            lastOutputDir = data.output_dir || '';
-            resultsSection.style.display = 'block';
+            const outputDir = outputPathInput.value.trim();
             resultItems.innerHTML = '';
             errorItems.innerHTML = '';
+            let remaining = [];
+
+            if (uploadedFiles.length) {
+                const data = await postJSON('/api/export-renamed', {
+                    files: uploadedFiles.map(f => ({
+                        server_path: f.serverPath,
+                        new_filename: generateFilename(f)
+                    })),
+                    output_dir: outputDir
+                });
+                if (data.error) { alert(data.error); return; }
+                lastOutputDir = data.output_dir || '';
+                (data.results || []).forEach(appendResult);
+                (data.errors || []).forEach(e => appendError(e.filename, e.error));
+            }
 
-            (data.results || []).forEach(r => {
-                const div = document.createElement('div');
-                div.className = 'result-item';
-                div.innerHTML = `<span class="file-name">${escapeHtml(r.filename)}</span>`;
-                resultItems.appendChild(div);
-            });
+            // 本地文件整批原子改名：要么全部成功，要么全部保持原名
+            if (localFiles.length) {
+                const data = await postJSON('/api/rename-in-place', {
+                    files: localFiles.map(f => ({
+                        path: f.localPath,
+                        new_filename: generateFilename(f)
+                    })),
+                    target_dir: outputDir
+                });
+                if (data.error) {
+                    appendError(`本地文件 (${localFiles.length} 个)`, data.error);
+                    remaining = localFiles;
+                } else {
+                    (data.results || []).forEach(appendResult);
+                    lastJournalId = data.journal_id || null;
+                    if (!lastOutputDir && data.results && data.results.length) {
+                        lastOutputDir = data.results[0].path.replace(/[\\/][^\\/]*$/, '');
+                    }
+                }
+            }
 
-            (data.errors || []).forEach(e => {
-                const div = document.createElement('div');
-                div.className = 'error-item';
-                div.textContent = `${e.filename}: ${e.error}`;
-                errorItems.appendChild(div);
-            });
+            resultsSection.style.display = 'block';
+            undoBtn.style.display = lastJournalId ? '' : 'none';
 
-            files = [];
-            fileItems.innerHTML = '';
-            fileListSection.style.display = 'none';
+            files = remaining;
+            renderFiles();
+            if (!files.length) fileListSection.style.display = 'none';
         } catch (err) {
             alert('导出失败: ' + err.message);
         } finally {
@@ -384,6 +481,23 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    undoBtn.addEventListener('click', async () => {
+        if (!lastJournalId) return;
+        if (!confirm('把本次原地改名的文件全部改回原名？')) return;
+        undoBtn.disabled = true;
+        try {
+            const data = await postJSON('/api/rename-undo', { journal_id: lastJournalId });
+            if (data.error) { alert(data.error); return; }
+            lastJournalId = null;
+            undoBtn.style.display = 'none';
+            alert(`已撤销 ${data.count} 个文件的改名`);
+        } catch (err) {
+            alert('撤销失败: ' + err.message);
+        } finally {
+            undoBtn.disabled = false;
+        }
+    });
+
     function openOutputFolder() {
         const path = (outputPathInput && outputPathInput.value.trim()) || lastOutputDir;
         return fetch('/open-folder', {
@@ -423,6 +537,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 id: f.id,
                 originalName: f.originalName,
                 serverPath: f.serverPath,
+                localPath: f.localPath,
                 width: f.width,
                 height: f.height,
                 ext: f.ext,
@@ -8,6 +8,11 @@ document.addEventListener('DOMContentLoaded', () => {
     const progressSection = document.getElementById('progress-section');
     const progressBar = document.getElementById('progress-bar');
     const progressText = document.getElementById('progress-text');
+    const taskPauseBtn = document.getElementById('task-pause-btn');
+    const taskPriority = document.getElementById('task-priority');
+    const taskProfile = document.getElementById('task-profile');
+    const taskPlatform = document.getElementById('task-platform');
+    const taskCancelBtn = document.getElementById('task-cancel-btn');
     const resultsSection = document.getElementById('results-section');
     const resultItems = document.getElementById('result-items');
     const errorItems = document.getElementById('error-items');
@@ -15,6 +20,17 @@ document.addEventListener('DOMContentLoaded', () => {
     const browseOutputBtn = document.getElementById('browse-output-btn');
     const openFolderBtn = document.getElementById('open-folder-btn');
     const openOutputFolderBtn = document.getElementById('open-output-folder-btn');
+    const localPathInput = document.getElementById('local-path');
+    const localIngestBtn = document.getElementById('local-ingest-btn');
+    const localBrowseFilesBtn = document.getElementById('local-browse-files-btn');
+    const localBrowseFolderBtn = document.getElementById('local-browse-folder-btn');
+    const previewPanel = document.getElementById('preview-panel');
+    const previewTitle = document.getElementById('preview-title');
+    const previewTime = document.getElementById('preview-time');
+    const previewTimeLabel = document.getElementById('preview-time-label');
+    const previewImage = document.getElementById('preview-image');
+    const previewStatus = document.getElementById('preview-status');
+    const previewCloseBtn = document.getElementById('preview-close-btn');
 
     let uploadedFiles = [];
     let lastOutputDir = '';
@@ -124,7 +140,8 @@ document.addEventListener('DOMContentLoaded', () => {
             // 保存套版数据
             templates[ratio] = {
                 path: data.path,
-                region: data.region
+                region: data.region,
+                content_hash: data.content_hash
             };
 
             // 显示预览
@@ -218,56 +235,270 @@ document.addEventListener('DOMContentLoaded', () => {
         progressText.textContent = '';
     }
 
-    async function uploadFiles(files) {
-        const formData = new FormData();
-        for (const file of files) {
-            formData.append('files', file);
+    // 分块上传参数：同时上传的文件数 / 每个文件同时在途的分块数 / 单个分块重试次数
+    const FILE_CONCURRENCY = 3;
+    const CHUNK_CONCURRENCY = 4;
+    const CHUNK_RETRIES = 5;
+    const VIDEO_EXTS = ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.mpg', '.mpeg'];
+
+    async function postJSON(url, body) {
+        const resp = await fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body || {})
+        });
+        return resp.json();
+    }
+
+    async function putChunk(uploadId, index, blob) {
+        for (let attempt = 0; ; attempt++) {
+            try {
+                const resp = await fetch(`/upload/chunk/${uploadId}/${index}`, { method: 'PUT', body: blob });
+                if (resp.ok) return;
+                // 4xx 属于请求本身错误，重试无意义
+                if (resp.status < 500) {
+                    const data = await resp.json().catch(() => ({}));
+                    throw Object.assign(new Error(data.error || `HTTP ${resp.status}`), { fatal: true });
+                }
+            } catch (err) {
+                if (err.fatal || attempt >= CHUNK_RETRIES) throw err;
+            }
+            await new Promise(r => setTimeout(r, Math.min(8000, 500 * 2 ** attempt)));
+        }
+    }
+
+    // 单个文件：init（可续传）→ 并发 PUT 缺失分块 → finalize（服务端立即探测）
+    async function uploadOneFile(file, onProgress) {
+        const init = await postJSON('/upload/init', {
+            filename: file.name,
+            size: file.size,
+            key: `${file.name}|${file.size}|${file.lastModified}`
+        });
+        if (init.error) throw Object.assign(new Error(init.error), { unsupported: !!init.unsupported });
+
+        const chunkSize = init.chunk_size;
+        const total = init.total_chunks;
+        const received = new Set(init.received || []);
+        const pending = [];
+        for (let i = 0; i < total; i++) if (!received.has(i)) pending.push(i);
+
+        let sent = received.size;
+        onProgress(sent / total);
+        async function chunkWorker() {
+            while (pending.length) {
+                const idx = pending.shift();
+                await putChunk(init.upload_id, idx, file.slice(idx * chunkSize, (idx + 1) * chunkSize));
+                sent++;
+                onProgress(sent / total);
+            }
         }
+        await Promise.all(Array.from({ length: Math.min(CHUNK_CONCURRENCY, pending.length) }, chunkWorker));
+
+        const fin = await postJSON(`/upload/finalize/${init.upload_id}`);
+        if (fin.error) throw new Error(fin.error);
+        return fin.file;
+    }
+
+    function renderFileItem(div, f) {
+        // 为每个目标比例标注是套版还是模糊
+        const targetTags = f.target_labels
+            .map(l => {
+                const hasTpl = !!templates[l];
+                const badge = hasTpl ? ' 🖼' : '';
+                return `<span class="tag ${tagClass[l]}" data-preview="${l}" title="${hasTpl ? '使用套版' : '模糊背景'}，点击预览">${l}${badge}</span>`;
+            })
+            .join(' ');
+
+        const dupTag = f.duplicate_of
+            ? `<span class="tag tag-duplicate" title="与已上传的 ${f.duplicate_of} 内容相同">重复</span>`
+            : '';
+        div.dataset.fileId = f.file_id;
+        const localTag = f.local ? `<span class="tag tag-local" title="${f.path}">本地</span>` : '';
+
+        div.innerHTML = `
+            <span class="file-name">${f.original_name}</span>
+            <span class="file-info">
+                ${localTag}${dupTag}
+                <span class="tag ${tagClass[f.ratio_label]}">${f.ratio_label}</span>
+                <span class="tag-arrow">&rarr;</span>
+                ${targetTags}
+            </span>`;
+    }
+
+    // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    // 单帧预览（点击文件的目标比例标签，按当前套版渲染一帧）
+    // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    let previewTarget = null;
+    let previewSeq = 0;
+
+    async function loadPreview() {
+        if (!previewTarget) return;
+        const { file, label } = previewTarget;
+        const seq = ++previewSeq;
+        const started = performance.now();
+        previewStatus.textContent = '渲染中...';
+        try {
+            const resp = await fetch('/api/preview', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    path: file.path,
+                    ratio: label,
+                    time: parseFloat(previewTime.value),
+                    template: templates[label] || null,
+                    width: 540
+                })
+            });
+            if (!resp.ok) {
+                const data = await resp.json().catch(() => ({}));
+                throw new Error(data.error || `HTTP ${resp.status}`);
+            }
+            const blob = await resp.blob();
+            // 拖动时只显示最后一次请求的结果
+            if (seq !== previewSeq) return;
+            if (previewImage.src) URL.revokeObjectURL(previewImage.src);
+            previewImage.src = URL.createObjectURL(blob);
+            previewStatus.textContent = `${templates[label] ? '套版' : '模糊背景'} · ${Math.round(performance.now() - started)} ms`;
+        } catch (err) {
+            if (seq === previewSeq) previewStatus.textContent = '预览失败: ' + err.message;
+        }
+    }
+
+    function openPreview(file, label) {
+        previewTarget = { file, label };
+        previewTitle.textContent = `${file.original_name} → ${label}`;
+        previewTime.max = Math.max(0.1, file.duration || 0).toFixed(1);
+        previewTime.value = Math.min(parseFloat(previewTime.value) || 0, previewTime.max);
+        previewTimeLabel.textContent = `${parseFloat(previewTime.value).toFixed(1)}s`;
+        previewPanel.style.display = 'block';
+        loadPreview();
+    }
+
+    fileItems.addEventListener('click', e => {
+        const tag = e.target.closest('.tag[data-preview]');
+        if (!tag) return;
+        const item = tag.closest('.file-item');
+        const file = uploadedFiles.find(f => f.file_id === item.dataset.fileId);
+        if (file) openPreview(file, tag.dataset.preview);
+    });
+    previewTime.addEventListener('input', () => {
+        previewTimeLabel.textContent = `${parseFloat(previewTime.value).toFixed(1)}s`;
+    });
+    previewTime.addEventListener('change', loadPreview);
+    previewCloseBtn.addEventListener('click', () => {
+        previewTarget = null;
+        previewPanel.style.display = 'none';
+    });
+
+    async function uploadFiles(files) {
+        const queue = Array.from(files).filter(f =>
+            VIDEO_EXTS.some(ext => f.name.toLowerCase().endsWith(ext)));
+        if (!queue.length) return;
+
+        const totalFiles = queue.length;
+        let finished = 0;
+        const failures = [];
 
         processBtn.disabled = true;
-        processBtn.textContent = '上传中...';
+        processBtn.textContent = `上传中 0/${totalFiles}...`;
         fileList.style.display = 'block';
 
-        try {
-            const resp = await fetch('/upload', { method: 'POST', body: formData });
-            const data = await resp.json();
+        // 每个文件上传完成即探测并显示，不必等整批结束
+        async function fileWorker() {
+            while (queue.length) {
+                const file = queue.shift();
+                const div = document.createElement('div');
+                div.className = 'file-item';
+                div.innerHTML = `
+                    <span class="file-name"></span>
+                    <span class="file-info upload-progress">等待上传</span>`;
+                div.querySelector('.file-name').textContent = file.name;
+                fileItems.appendChild(div);
+                const progressEl = div.querySelector('.upload-progress');
+
+                try {
+                    const entry = await uploadOneFile(file, ratio => {
+                        progressEl.textContent = `上传中 ${Math.round(ratio * 100)}%`;
+                    });
+                    if (entry) {
+                        uploadedFiles.push(entry);
+                        renderFileItem(div, entry);
+                    } else {
+                        div.remove();
+                    }
+                } catch (err) {
+                    div.remove();
+                    if (!err.unsupported) failures.push(`${file.name}: ${err.message}`);
+                }
+                finished++;
+                processBtn.textContent = `上传中 ${finished}/${totalFiles}...`;
+            }
+        }
+
+        await Promise.all(Array.from({ length: Math.min(FILE_CONCURRENCY, queue.length) }, fileWorker));
+
+        processBtn.disabled = false;
+        processBtn.textContent = '开始处理';
+        if (failures.length) alert('以下文件上传失败：\n' + failures.join('\n'));
+    }
+
+    // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    // 本地导入（服务端直接读取本机路径，不经过上传）
+    // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    async function ingestLocal(paths) {
+        paths = paths.map(p => p.trim()).filter(Boolean);
+        if (!paths.length) return;
 
+        localIngestBtn.disabled = true;
+        localIngestBtn.textContent = '读取中...';
+        try {
+            const data = await postJSON('/api/ingest-local', { paths });
             if (data.error) {
                 alert(data.error);
                 return;
             }
-
+            fileList.style.display = 'block';
             for (const f of data.files) {
                 uploadedFiles.push(f);
                 const div = document.createElement('div');
                 div.className = 'file-item';
-
-                // 为每个目标比例标注是套版还是模糊
-                const targetTags = f.target_labels
-                    .map(l => {
-                        const hasTpl = !!templates[l];
-                        const badge = hasTpl ? ' 🖼' : '';
-                        return `<span class="tag ${tagClass[l]}" title="${hasTpl ? '使用套版' : '模糊背景'}">${l}${badge}</span>`;
-                    })
-                    .join(' ');
-
-                div.innerHTML = `
-                    <span class="file-name">${f.original_name}</span>
-                    <span class="file-info">
-                        <span class="tag ${tagClass[f.ratio_label]}">${f.ratio_label}</span>
-                        <span class="tag-arrow">&rarr;</span>
-                        ${targetTags}
-                    </span>`;
+                renderFileItem(div, f);
                 fileItems.appendChild(div);
             }
+            if (data.skipped && data.skipped.length) {
+                alert('以下文件无法读取视频信息，已跳过：\n' + data.skipped.join('\n'));
+            }
+            localPathInput.value = '';
         } catch (err) {
-            alert('上传失败: ' + err.message);
+            alert('本地导入失败: ' + err.message);
         } finally {
-            processBtn.disabled = false;
-            processBtn.textContent = '开始处理';
+            localIngestBtn.disabled = false;
+            localIngestBtn.textContent = '导入';
         }
     }
 
+    localIngestBtn.addEventListener('click', () => ingestLocal(localPathInput.value.split(';')));
+
+    localBrowseFilesBtn.addEventListener('click', async () => {
+        try {
+            const data = await postJSON('/browse-files');
+            if (data.error) throw new Error(data.error);
+            if (data.paths && data.paths.length) ingestLocal(data.paths);
+        } catch (err) {
+            alert('浏览失败: ' + err.message);
+        }
+    });
+
+    localBrowseFolderBtn.addEventListener('click', async () => {
+        try {
+            const data = await postJSON('/browse-folder', { title: '选择视频文件夹' });
+            if (data.error) throw new Error(data.error);
+            if (data.path) ingestLocal([data.path]);
+        } catch (err) {
+            alert('浏览失败: ' + err.message);
+        }
+    });
+
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     // 处理与进度
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -289,7 +520,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: JSON.stringify({
                     files: uploadedFiles,
                     output_dir: outputPathInput.value.trim(),
-                    templates: templates
+                    templates: templates,
+                    priority: parseInt(taskPriority.value, 10) || 0,
+                    profile: taskProfile.value || null,
+                    platform: taskPlatform.value || null
                 })
             });
             const data = await resp.json();
@@ -310,44 +544,161 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    // 任务控制：暂停 / 继续 / 取消
+    // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    let activeTaskId = null;
+    let activeTaskPaused = false;
+
+    function updateTaskButtons() {
+        taskPauseBtn.textContent = activeTaskPaused ? '继续' : '暂停';
+        taskPauseBtn.disabled = taskCancelBtn.disabled = !activeTaskId;
+    }
+
+    async function taskAction(action) {
+        if (!activeTaskId) return;
+        try {
+            const data = await postJSON(`/api/tasks/${activeTaskId}/${action}`);
+            if (data.error) alert(data.error);
+        } catch (err) {
+            alert('操作失败: ' + err.message);
+        }
+    }
+
+    taskPauseBtn.addEventListener('click', () => taskAction(activeTaskPaused ? 'resume' : 'pause'));
+    taskCancelBtn.addEventListener('click', () => {
+        if (confirm('取消当前任务？已完成的文件会保留，未完成的会被删除。')) taskAction('cancel');
+    });
+
     function listenProgress(taskId) {
+        // 首条消息是任务快照，之后只收增量事件；断线时 EventSource 自动重连并带上 Last-Event-ID
         const evtSource = new EventSource(`/progress/${taskId}`);
+        let task = null;
         let taskDone = false;
+        activeTaskId = taskId;
+        activeTaskPaused = false;
+        updateTaskButtons();
+
+        function formatEta(seconds) {
+            if (seconds == null) return '';
+            const s = Math.round(seconds);
+            return `剩余 ${Math.floor(s / 60)}:${String(s % 60).padStart(2, '0')}`;
+        }
+
+        function render() {
+            // 已完成的输出 + 运行中作业按帧进度折算的部分
+            const jobs = Object.values(task.jobs || {});
+            const partial = jobs.reduce((sum, j) => sum + (j.percent || 0) / 100 * j.outputs, 0);
+            const pct = task.total > 0
+                ? Math.min(100, Math.round(((task.completed + partial) / task.total) * 100)) : 0;
+            progressBar.style.width = pct + '%';
+
+            const job = jobs.length ? jobs[jobs.length - 1] : null;
+            // 尚无作业运行时显示排队位置和预计开始时间
+            const queue = task.queue;
+            if (!job && queue && queue.position && task.status !== 'paused') {
+                progressText.textContent = `${task.completed}/${task.total} - 排队中：第 ${queue.position} 位` +
+                    (queue.eta_start ? `，预计 ${formatEta(queue.eta_start).replace('剩余 ', '')} 后开始` : '');
+                return;
+            }
+            const stats = job ? [
+                job.percent != null ? `${Math.round(job.percent)}%` : '',
+                job.fps ? `${job.fps.toFixed(0)} fps` : '',
+                job.speed ? `${job.speed.toFixed(2)}x` : '',
+                formatEta(job.eta)
+            ].filter(Boolean).join(' · ') : '';
+            progressText.textContent =
+                `${task.completed}/${task.total} - ${task.current_file || '完成'}` +
+                (stats ? ` (${stats})` : '') +
+                (task.status === 'paused' ? ' [已暂停]' : '');
+        }
+
+        function finish() {
+            taskDone = true;
+            activeTaskId = null;
+            updateTaskButtons();
+            evtSource.close();
+            showResults(task.results, task.errors);
+            resetUI();
+        }
 
         evtSource.onmessage = (event) => {
-            const info = JSON.parse(event.data);
+            const msg = JSON.parse(event.data);
 
-            if (info.error) {
+            if (msg.error && !msg.type) {
                 evtSource.close();
-                alert(info.error);
+                alert(msg.error);
                 resetUI();
                 return;
             }
 
-            const pct = info.total > 0
-                ? Math.round((info.completed / info.total) * 100) : 0;
-            progressBar.style.width = pct + '%';
-            progressText.textContent =
-                `${info.completed}/${info.total} - ${info.current_file || '完成'}`;
+            switch (msg.type) {
+                case 'snapshot':
+                    task = msg;
+                    break;
+                case 'task_started':
+                    task = { total: msg.total, completed: 0, current_file: '', jobs: {}, results: [], errors: [] };
+                    break;
+                case 'job_started':
+                case 'job_progress':
+                    task.current_file = msg.label;
+                    task.jobs[msg.job] = msg;
+                    break;
+                case 'job_finished':
+                    task.current_file = msg.current_file;
+                    delete task.jobs[msg.job];
+                    break;
+                case 'result':
+                    task.results.push(msg.result);
+                    task.completed = msg.completed;
+                    break;
+                case 'error':
+                    task.errors.push(msg.error);
+                    task.completed = msg.completed;
+                    break;
+                case 'queue':
+                    if (task) task.queue = msg;
+                    break;
+                case 'task_paused':
+                    task.status = 'paused';
+                    break;
+                case 'task_resumed':
+                    task.status = 'processing';
+                    break;
+                case 'task_cancelling':
+                    task.current_file = '正在取消...';
+                    taskCancelBtn.disabled = taskPauseBtn.disabled = true;
+                    break;
+                case 'task_done':
+                    task.completed = msg.completed;
+                    task.status = msg.status || 'done';
+                    break;
+            }
+            if (!task) return;
 
-            if (info.status === 'done') {
-                taskDone = true;
-                evtSource.close();
-                showResults(info.results, info.errors);
-                resetUI();
+            if (activeTaskPaused !== (task.status === 'paused')) {
+                activeTaskPaused = task.status === 'paused';
+                updateTaskButtons();
             }
+            render();
+            if (task.status === 'done' || task.status === 'cancelled') finish();
         };
 
         evtSource.onerror = () => {
-            evtSource.close();
-            if (!taskDone) {
+            if (taskDone) return;
+            if (evtSource.readyState === EventSource.CLOSED) {
                 progressText.textContent = '连接中断，请刷新页面重试';
                 processBtn.disabled = false;
                 processBtn.textContent = '开始处理';
+            } else {
+                progressText.textContent = '连接中断，正在重连...';
             }
         };
     }
 
+    // 未重新编码的输出在结果里标注来源
+    const METHOD_LABELS = { cache: '缓存', passthrough: '直通' };
+
     function showResults(results, errors) {
         resultsSection.style.display = 'block';
 
@@ -358,7 +709,11 @@ document.addEventListener('DOMContentLoaded', () => {
                 <span>
                     <span class="file-name">${r.filename}</span>
                     <span class="tag ${tagClass[r.label]}">${r.label}</span>
-                </span>`;
+                    ${METHOD_LABELS[r.method] ? `<span class="tag tag-method">${METHOD_LABELS[r.method]}</span>` : ''}
+                    ${r.platform ? `<span class="tag tag-method">${r.platform}</span>` : ''}
+                </span>
+                ${r.size ? `<span class="result-size${r.max_size && r.size > r.max_size ? ' over-budget' : ''}"
+                    title="${r.max_size ? `上限 ${(r.max_size / 1048576).toFixed(0)} MB` : ''}">${(r.size / 1048576).toFixed(1)} MB</span>` : ''}`;
             resultItems.appendChild(div);
         }
 
@@ -370,6 +725,29 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // 编码档位：当前 FFmpeg 不支持的档位显示但不可选
+    fetch('/api/encoder-profiles')
+        .then(r => r.json())
+        .then(data => {
+            for (const [name, p] of Object.entries(data.profiles)) {
+                const opt = document.createElement('option');
+                opt.value = name;
+                opt.textContent = p.available ? p.label : `${p.label}（不可用）`;
+                opt.title = `${p.vcodec} · preset ${p.preset} · CRF ${p.crf}`;
+                opt.disabled = !p.available;
+                opt.selected = name === data.default;
+                taskProfile.appendChild(opt);
+            }
+            for (const [code, t] of Object.entries(data.platforms || {})) {
+                const opt = document.createElement('option');
+                opt.value = code;
+                opt.textContent = `${code} · ${t.label || code}`;
+                opt.title = `≤ ${t.maxrateKbps} kbps · ≤ ${t.maxSizeMB} MB · ≤ ${t.maxFps} fps · AAC ${t.audioKbps} kbps`;
+                taskPlatform.appendChild(opt);
+            }
+        })
+        .catch(() => {});
+
     checkForUpdate();
     restoreAppState();
 });
@@ -24,6 +24,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const defaultRegion = document.getElementById('settings-default-region');
     const defaultPlatform = document.getElementById('settings-default-platform');
     const defaultCreator = document.getElementById('settings-default-creator');
+    const cpuBudgetInput = document.getElementById('settings-cpu-budget');
+    const parallelJobsInput = document.getElementById('settings-parallel-jobs');
 
     if (!creatorList) return;
 
@@ -46,6 +48,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 })), cfg.defaultPlatform || 'GG');
 
                 refreshCreatorSelect(cfg.defaultCreator || 'ZHM');
+
+                const processing = cfg.processing || {};
+                cpuBudgetInput.value = processing.cpuBudget || 0;
+                parallelJobsInput.value = processing.parallelJobs || 0;
             })
             .catch(() => {
                 statusEl.textContent = '加载配置失败';
@@ -107,7 +113,11 @@ document.addEventListener('DOMContentLoaded', () => {
             creators: creators,
             defaultRegion: defaultRegion.value,
             defaultPlatform: defaultPlatform.value,
-            defaultCreator: defaultCreator.value
+            defaultCreator: defaultCreator.value,
+            processing: {
+                cpuBudget: parseInt(cpuBudgetInput.value, 10) || 0,
+                parallelJobs: parseInt(parallelJobsInput.value, 10) || 0
+            }
         };
 
         fetch('/api/config', {